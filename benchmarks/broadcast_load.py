@@ -0,0 +1,171 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+from util.basedir import BaseDir
+from util.broadcast import BroadcastPublisher, BroadcastServer
+from util.logger import Logger
+
+
+class Subscriber:
+    # one long-polling client on a kept-alive connection, records when every event arrived
+    def __init__(self, host, port, user, timeout):
+        self.host = host
+        self.port = port
+        self.user = user
+        self.timeout = timeout
+        self.since = None
+        self.epoch = None
+        self.received = {}
+        self.resets = 0
+        self.reconnects = 0
+        self.reader = None
+        self.writer = None
+
+    async def connect(self):
+        self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+
+    def disconnect(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+    async def poll(self):
+        if self.writer is None:
+            await self.connect()
+            self.reconnects += 1
+        path = "/events?timeout=%s&user=%s" % (self.timeout, self.user)
+        if self.since is not None:
+            path += "&since=%s&epoch=%s" % (self.since, self.epoch)
+        self.writer.write(("GET %s HTTP/1.1\r\nHost: %s\r\n\r\n" % (path, self.host)).encode())
+        await self.writer.drain()
+        head = await self.reader.readuntil(b"\r\n\r\n")
+        length = int([line for line in head.decode().split("\r\n") if line.lower().startswith("content-length")][0].split(":")[1])
+        answer = json.loads(await self.reader.readexactly(length))
+        now = time.time()
+        self.since, self.epoch = answer["next"], answer["epoch"]
+        if answer["reset"]:
+            self.resets += 1
+        for event in answer["events"]:
+            self.received.setdefault(event["seq"], (now - event["time"], event["notified"]))
+
+    async def run(self, stop):
+        while not stop.is_set():
+            try:
+                await self.poll()
+            except (OSError, asyncio.IncompleteReadError):
+                self.disconnect()
+                await asyncio.sleep(0.1)
+
+
+def startServer(args):
+    # the server runs in its own process, so the subscribers do not compete with it for the interpreter
+    process = subprocess.Popen([sys.executable, "-m", "benchmarks.broadcast_load", "--serve", "--subscribers", str(args.subscribers), "--events", str(args.events),
+                                "--timeout", str(args.timeout)], cwd=BaseDir.get(), stdout=subprocess.PIPE, text=True)
+    return process, int(process.stdout.readline())
+
+
+def serve(args):
+    # runs until the load test terminates the process
+    server = BroadcastServer(port=0, bufferSize=args.events * 2, maxSubscribers=args.subscribers * 2, pollTimeout=args.timeout)
+    server.start()
+    print(server.port, flush=True)
+    server.thread.join()
+
+
+def fetchStats(port):
+    import urllib.request
+    with urllib.request.urlopen("http://127.0.0.1:%s/stats" % port) as response:
+        return json.loads(response.read())
+
+
+async def load(args):
+    process, port = startServer(args)
+    publisher = BroadcastPublisher("http://127.0.0.1:%s" % port)
+    subscribers = [Subscriber("127.0.0.1", port, "U%s" % i, args.timeout) for i in range(args.subscribers)]
+    start = time.perf_counter()
+    # connect in slices, the listen backlog is not unlimited
+    for i in range(0, len(subscribers), 500):
+        await asyncio.gather(*(s.connect() for s in subscribers[i:i + 500]))
+        await asyncio.gather(*(s.poll() for s in subscribers[i:i + 500]))
+    connected = time.perf_counter() - start
+    stop = asyncio.Event()
+    tasks = [asyncio.create_task(s.run(stop)) for s in subscribers]
+    await asyncio.sleep(0.5)
+
+    rng = random.Random(1)
+    dropped = rng.sample(subscribers, int(len(subscribers) * args.reconnect_share))
+    for n in range(args.events):
+        if n == args.events // 2:
+            # a share of the subscribers loses its connection and comes back after missing events
+            for s in dropped:
+                s.disconnect()
+        recipients = ["U%s" % i for i in rng.sample(range(args.subscribers), args.subscribers // 10)]
+        publisher.publish({"type": "raised", "level": "2", "recipients": recipients})
+        await asyncio.sleep(args.interval)
+    await asyncio.get_running_loop().run_in_executor(None, publisher.flush, 30)
+    # the last event needs a moment to reach everybody
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline and any(len(s.received) < args.events for s in subscribers):
+        await asyncio.sleep(0.1)
+    stop.set()
+    for s in subscribers:
+        s.disconnect()
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    stats = await asyncio.get_running_loop().run_in_executor(None, fetchStats, port)
+    process.terminate()
+    process.wait()
+
+    latencies = sorted(latency for s in subscribers for latency, notified in s.received.values())
+    complete = sum(1 for s in subscribers if len(s.received) == args.events)
+    return {
+        "subscribers": args.subscribers,
+        "events": args.events,
+        "connect_s": round(connected, 3),
+        "deliveries": len(latencies),
+        "expected_deliveries": args.subscribers * args.events,
+        "subscribers_complete": complete,
+        "reconnected": len(dropped),
+        "resets": sum(s.resets for s in subscribers),
+        "latency_ms": {"p50": round(statistics.median(latencies) * 1000, 1) if latencies else None,
+                       "p95": round(latencies[int(len(latencies) * 0.95)] * 1000, 1) if latencies else None,
+                       "max": round(latencies[-1] * 1000, 1) if latencies else None},
+        "server": stats
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.broadcast_load", description="Fan out notification events to many local long-poll subscribers.")
+    parser.add_argument("--subscribers", type=int, default=2000, help="concurrent subscribers (default: 2000)")
+    parser.add_argument("--events", type=int, default=20, help="events published (default: 20)")
+    parser.add_argument("--interval", type=float, default=0.2, help="seconds between events (default: 0.2)")
+    parser.add_argument("--timeout", type=float, default=10, help="long-poll timeout in seconds (default: 10)")
+    parser.add_argument("--reconnect-share", type=float, default=0.1, help="share of subscribers disconnected halfway (default: 0.1)")
+    parser.add_argument("--output", help="also write the result to this JSON file")
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    Logger.configure({"logging": {"level": "WARNING"}})
+    if args.serve:
+        serve(args)
+        return 0
+    result = asyncio.run(load(args))
+    print(json.dumps(result, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+    # every subscriber, including the reconnected ones, has to see every event
+    return 0 if result["subscribers_complete"] == args.subscribers else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,54 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FakeSendGrid(ThreadingHTTPServer):
+    # accepts POST /v3/mail/send like SendGrid, counts requests and recipients, latency simulates the round trip
+    # and status the answer (e.g. 503 for an outage)
+    daemon_threads = True
+
+    def __init__(self, latency=0.0):
+        super().__init__(("127.0.0.1", 0), Handler)
+        self.latency = latency
+        self.status = 202
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.recipients = 0
+        self.thread = None
+
+    @property
+    def url(self):
+        return "http://%s:%s" % self.server_address
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever, name="FakeSendGrid", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def reset(self):
+        with self.lock:
+            self.requests = 0
+            self.recipients = 0
+
+
+class Handler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        recipients = sum(len(p.get("to", [])) + len(p.get("bcc", [])) for p in body.get("personalizations", []))
+        with self.server.lock:
+            self.server.requests += 1
+            self.server.recipients += recipients
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        self.send_response(self.server.status)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
@@ -0,0 +1,58 @@
+import asyncio
+import socket
+import threading
+
+
+class FakeSmtp:
+    # local aiosmtpd server that accepts every message and counts connections, messages and recipients.
+    # It advertises PIPELINING, so the pipelined envelope of the SMTP transport is exercised as well.
+    def __init__(self, latency=0.0):
+        from aiosmtpd.controller import Controller
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.messages = 0
+        self.recipients = 0
+        # aiosmtpd needs a fixed port, a free one is picked up front
+        sock = socket.socket()
+        sock.bind(("127.0.0.1", 0))
+        self.port = sock.getsockname()[1]
+        sock.close()
+        self.controller = Controller(Handler(self), hostname="127.0.0.1", port=self.port)
+
+    @property
+    def host(self):
+        return "127.0.0.1"
+
+    def start(self):
+        self.controller.start()
+        return self
+
+    def stop(self):
+        self.controller.stop()
+
+    def reset(self):
+        with self.lock:
+            self.connections = 0
+            self.messages = 0
+            self.recipients = 0
+
+
+class Handler:
+    def __init__(self, server):
+        self.server = server
+
+    async def handle_EHLO(self, server, session, envelope, hostname, responses):
+        # the transport greets once per connection, there is no STARTTLS here
+        session.host_name = hostname
+        with self.server.lock:
+            self.server.connections += 1
+        return responses[:-1] + ["250-PIPELINING", responses[-1]]
+
+    async def handle_DATA(self, server, session, envelope):
+        if self.server.latency:
+            await asyncio.sleep(self.server.latency)
+        with self.server.lock:
+            self.server.messages += 1
+            self.server.recipients += len(envelope.rcpt_tos)
+        return "250 OK"
@@ -0,0 +1,316 @@
+import argparse
+import datetime
+import importlib.util
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+from benchmarks import standin
+from benchmarks.fakesendgrid import FakeSendGrid
+from util.basedir import BaseDir
+from util.database import Database
+from util.directory import UserDirectory
+from util.logger import Logger
+from util.pool import ConnectionPool
+from util.search import FilteredList, SearchIndex
+
+SIZES = (1000, 10000, 100000)
+OPERATOR = ("operator", "operator@example.com")
+SEARCH_QUERIES = ("n", "name0001", "first00012", "user000123@", "name00 first0001", "zzz")
+SHORT_TEXT = "Benchmark notification"
+LONG_TEXT = "The application is not available.\nWe are working on it.\n"
+HISTORY_PAGE = 50
+PERSONAL_TEXT = "Dear {{firstName}} {{name}},\n{{application}} is not available (level {{level}}).\nWe are working on it.\n"
+
+
+class Skipped(Exception):
+    pass
+
+
+def buildConfig(path, apiHost):
+    return {
+        "email": {"senderAddress": "sender@example.com", "receiverArray": "receiver@example.com", "body": "body-template.json",
+                  "contentType": "text/html", "apiHost": apiHost, "maxRetries": 0},
+        "database": {"driver": "sqlite-standin", "host": "localhost", "database": path, "owner": "dbo", "maxPoolSize": 5},
+        "activeUsers": {"window": 360},
+        "logging": {"level": "WARNING"}
+    }
+
+
+def measure(fn, repeat):
+    # fn returns the value to keep as extra information, e.g. a row count
+    times = []
+    info = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        info = fn()
+        times.append((time.perf_counter() - start) * 1000)
+    result = {"min_ms": round(min(times), 3), "median_ms": round(statistics.median(times), 3), "mean_ms": round(statistics.mean(times), 3), "runs": repeat}
+    if info is not None:
+        result["info"] = info
+    return result
+
+
+def benchImports():
+    # cost of the imports the headless entry point pays before the first query
+    start = time.perf_counter()
+    subprocess.run([sys.executable, "-c", "import util.cli"], cwd=BaseDir.get(), check=True)
+    return (time.perf_counter() - start) * 1000
+
+
+def registerPool(config):
+    # the stand-in takes the place of pyodbc in the pool every Database of this config shares
+    dbConfig = config["database"]
+    ConnectionPool.closeShared()
+    ConnectionPool.shared((dbConfig["driver"], dbConfig["host"], dbConfig["database"]), standin.connector(dbConfig["database"]), maxSize=dbConfig["maxPoolSize"])
+
+
+def newNotifier(config):
+    from util.notifier import Notifier
+    return Notifier(config)
+
+
+def benchStartup(config):
+    # cold start of the workflow: fresh pool, both user lists and the notification status
+    registerPool(config)
+    notifier = newNotifier(config)
+    now = notifier.loadUsersNow()
+    days = notifier.loadUsers90Days()
+    notifier.getStatus(maxAge=0)
+    return {"active_now": len(now), "last_90_days": len(days)}
+
+
+def benchDirectory(rows):
+    directory = UserDirectory()
+    return len(directory.load(rows))
+
+
+def benchSearch(records, repeat):
+    # a keystroke searches the index and filters both recipient lists, here every 10th user and 60% of them
+    start = time.perf_counter()
+    index = SearchIndex()
+    index.update(records)
+    result = {"build_ms": round((time.perf_counter() - start) * 1000, 3), "queries": {}}
+    labels = [r.label for r in records]
+    lists = [labels[::10], [label for i, label in enumerate(labels) if i % 5 < 3]]
+    filters = [FilteredList(index) for _ in lists]
+    start = time.perf_counter()
+    mask = index.search(SEARCH_QUERIES[0])
+    for items, filtered in zip(lists, filters):
+        filtered.rows(items, mask)
+    # the record numbers of the rows, looked up on the first keystroke after the lists or the index changed
+    result["filter_setup_ms"] = round((time.perf_counter() - start) * 1000, 3)
+
+    def keystroke(query):
+        mask = index.search(query)
+        return [len(filtered.rows(items, mask)) for items, filtered in zip(lists, filters)]
+    for query in SEARCH_QUERIES:
+        result["queries"][query] = measure(lambda: keystroke(query), repeat)
+    return result
+
+
+def benchCheckboxes(labels):
+    try:
+        import customtkinter as ctk
+        from ui.app import FILL_BATCH_SIZE, ScrollableCheckBoxFrame
+        root = ctk.CTk()
+    except Exception as e:
+        raise Skipped("no user interface available - %s" % e)
+    try:
+        root.withdraw()
+        frame = ScrollableCheckBoxFrame(master=root, item_list=[], width=400, height=600)
+        frame.grid(row=0, column=0)
+        start = time.perf_counter()
+        for i in range(0, len(labels), FILL_BATCH_SIZE):
+            frame.add_items(labels[i:i + FILL_BATCH_SIZE])
+        root.update_idletasks()
+        frame.changeselectall(1)
+        checked = len(frame.get_checked_items())
+        return (time.perf_counter() - start) * 1000, checked
+    finally:
+        root.destroy()
+
+
+def requireSendGrid():
+    if importlib.util.find_spec("sendgrid") is None:
+        raise Skipped("sendgrid is not installed")
+
+
+def startSmtp():
+    try:
+        from benchmarks.fakesmtp import FakeSmtp
+        return FakeSmtp().start()
+    except ImportError as e:
+        raise Skipped("aiosmtpd is not installed - %s" % e)
+
+
+def smtpConfig(config, smtp, transport, fallback):
+    return dict(config, email=dict(config["email"], transport=transport, fallback=fallback,
+                                   smtp={"host": smtp.host, "port": smtp.port, "starttls": False}))
+
+
+def runCase(results, name, fn):
+    try:
+        results[name] = fn()
+    except Skipped as e:
+        results[name] = {"skipped": str(e)}
+    print("  %-24s %s" % (name, json.dumps(results[name])), flush=True)
+
+
+def runSize(size, workDir, server, repeat):
+    path = os.path.join(workDir, "standin-%s.db" % size)
+    emails = standin.generate(path, size, notifications=size)
+    config = buildConfig(path, server.url)
+    results = {}
+    print("%s users" % size, flush=True)
+
+    runCase(results, "startup", lambda: measure(lambda: benchStartup(config), repeat))
+
+    registerPool(config)
+    db = Database.fromConfig(config)
+    with db.pool.connection() as conn:
+        # the generated users, without the operator row
+        rows = conn.execute("SELECT appGUID, Name, Vorname, Email FROM dbo.User WHERE appGUID <> ?", (standin.OPERATOR_GUID,)).fetchall()
+    runCase(results, "directory_load", lambda: measure(lambda: benchDirectory(rows), repeat))
+
+    runCase(results, "search", lambda: benchSearch(UserDirectory().load(rows), repeat))
+
+    labels = ["%s, %s <%s>" % (r[1], r[2], r[3]) for r in rows]
+
+    def checkboxes():
+        times = []
+        for _ in range(repeat):
+            elapsed, checked = benchCheckboxes(labels)
+            times.append(elapsed)
+        return {"min_ms": round(min(times), 3), "median_ms": round(statistics.median(times), 3), "mean_ms": round(statistics.mean(times), 3), "runs": repeat, "info": checked}
+    runCase(results, "checkbox_population", checkboxes)
+
+    def userIDs():
+        found = db.getUserIDs(emails)
+        if found is None:
+            raise RuntimeError("user lookup failed")
+        return len(found)
+    runCase(results, "get_user_ids", lambda: measure(userIDs, repeat))
+
+    def mail():
+        requireSendGrid()
+        notifier = newNotifier(config)
+        server.reset()
+        result = measure(lambda: notifier.mail.sendMail(emails, SHORT_TEXT, LONG_TEXT), repeat)
+        result["requests"] = server.requests
+        result["recipients"] = server.recipients
+        return result
+    runCase(results, "mail_build_send", mail)
+
+    def personalized():
+        requireSendGrid()
+        notifier = newNotifier(config)
+        server.reset()
+        recipients = {r[3]: {"name": r[1], "firstName": r[2], "application": "benchmark"} for r in rows}
+        result = measure(lambda: notifier.mail.sendMail(emails, SHORT_TEXT, PERSONAL_TEXT, {"level": "2"}, recipients), repeat)
+        result["requests"] = server.requests
+        result["recipients"] = server.recipients
+        return result
+    runCase(results, "mail_personalized", personalized)
+
+    def smtpCase(transport, fallback, sendGridStatus):
+        requireSendGrid()
+        smtp = startSmtp()
+        try:
+            notifier = newNotifier(smtpConfig(config, smtp, transport, fallback))
+            server.reset()
+            server.status = sendGridStatus
+            result = measure(lambda: notifier.mail.sendMail(emails, SHORT_TEXT, LONG_TEXT), repeat)
+            result.update(requests=server.requests, smtp_connections=smtp.connections, smtp_messages=smtp.messages, smtp_recipients=smtp.recipients)
+            return result
+        finally:
+            server.status = 202
+            smtp.stop()
+            ConnectionPool.closeShared()
+            registerPool(config)
+    runCase(results, "mail_smtp", lambda: smtpCase("smtp", [], 202))
+    # SendGrid answers 400, which is not retried, so every batch fails over to SMTP
+    runCase(results, "mail_failover", lambda: smtpCase("sendgrid", ["smtp"], 400))
+
+    def history():
+        # the first page and the last pages of a history as long as the directory, with and without the level filter
+        notifier = newNotifier(config)
+        with db.pool.connection() as conn:
+            oldest = conn.execute("SELECT DateNew, appGUID FROM dbo.Notifications ORDER BY DateNew, appGUID LIMIT 1 OFFSET ?", (HISTORY_PAGE,)).fetchone()
+        cursor = {notifier.apps[0].name: tuple(oldest)}
+        return {"first_page": measure(lambda: len(notifier.getHistory(HISTORY_PAGE)[0]), repeat),
+                "last_page": measure(lambda: len(notifier.getHistory(HISTORY_PAGE, cursor)[0]), repeat),
+                "level_last_page": measure(lambda: len(notifier.getHistory(HISTORY_PAGE, cursor, "2")[0]), repeat)}
+    runCase(results, "history", history)
+
+    def cycle():
+        requireSendGrid()
+        notifier = newNotifier(config)
+        users = notifier.loadUsersNow()
+
+        def raiseSolve():
+            mailSent, created = notifier.raiseNotification("2", SHORT_TEXT, LONG_TEXT, users, OPERATOR)
+            actNot, usrNot = notifier.getStatus(maxAge=0)
+            if not (mailSent and created and actNot):
+                raise RuntimeError("raise failed")
+            notified = notifier.getNotifiedUsers(usrNot)
+            mailSent, deactivated = notifier.solveNotification("Solved: " + SHORT_TEXT, LONG_TEXT, notified, notifier.activeIDs(usrNot))
+            if not (mailSent and deactivated):
+                raise RuntimeError("solve failed")
+            return len(notified)
+        return measure(raiseSolve, repeat)
+    runCase(results, "raise_solve", cycle)
+
+    ConnectionPool.closeShared()
+    return results
+
+
+def gitRevision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=BaseDir.get(), stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.run", description="Time the notification workflow against synthetic user directories.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=SIZES, help="user directory sizes (default: 1000 10000 100000)")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per case, min/median/mean are reported (default: 3)")
+    parser.add_argument("--mail-latency", type=float, default=0.0, help="seconds the fake SendGrid endpoint waits per request")
+    parser.add_argument("--output", default="bench_output.json", help="result file (default: bench_output.json)")
+    args = parser.parse_args(argv)
+
+    Logger.configure({"logging": {"level": "WARNING"}})
+    os.environ.setdefault("SENDGRID_API_KEY", "benchmark")
+    server = FakeSendGrid(args.mail_latency).start()
+    report = {
+        "created": datetime.datetime.now().isoformat(timespec="seconds"),
+        "revision": gitRevision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "repeat": args.repeat,
+        "mail_latency": args.mail_latency,
+        "import_ms": round(benchImports(), 3),
+        "sizes": {}
+    }
+    try:
+        with tempfile.TemporaryDirectory() as workDir:
+            for size in args.sizes:
+                report["sizes"][str(size)] = runSize(size, workDir, server, args.repeat)
+    finally:
+        server.stop()
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print("results written to %s" % args.output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
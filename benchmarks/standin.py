@@ -0,0 +1,98 @@
+import datetime
+import os
+import random
+import sqlite3
+import uuid
+
+# SQLite stand-in for the application schema, attached as the dbo owner so the production statements run
+# unchanged apart from the few T-SQL constructs SQLite spells differently (see translate)
+SCHEMA = (
+    "CREATE TABLE dbo.User (appGUID TEXT PRIMARY KEY, GID TEXT, Name TEXT, Vorname TEXT, Email TEXT)",
+    "CREATE INDEX dbo.User_Email ON User (Email)",
+    "CREATE TABLE dbo.UserActiveSession (appGUID TEXT, DateActive timestamp)",
+    "CREATE INDEX dbo.UserActiveSession_DateActive ON UserActiveSession (DateActive)",
+    "CREATE TABLE dbo.LV_ActiveEmailsLast90Days (Email TEXT)",
+    "CREATE TABLE dbo.Notifications (appGUID TEXT PRIMARY KEY, DateNew TEXT, DateChanged TEXT, ReadAccess TEXT, UserNew TEXT, UserChanged TEXT, WriteAccess TEXT, Level TEXT, ShortText TEXT, LongText TEXT, Active INTEGER, NotifiedUsers TEXT)",
+    "CREATE TABLE dbo.NotificationRecipients (NotificationID TEXT, UserID TEXT, PRIMARY KEY (NotificationID, UserID))",
+    # the history indexes of sql/notification_history.sql
+    "CREATE INDEX dbo.Notifications_DateNew ON Notifications (DateNew DESC, appGUID DESC)",
+    "CREATE INDEX dbo.Notifications_Level_DateNew ON Notifications (Level, DateNew DESC, appGUID DESC)",
+)
+# user row of the operator that raises the benchmark notifications, added on top of the generated users
+OPERATOR_GUID = "OPERATOR"
+
+sqlite3.register_adapter(datetime.datetime, lambda d: d.isoformat(" "))
+sqlite3.register_converter("timestamp", lambda b: datetime.datetime.fromisoformat(b.decode()))
+
+
+def translate(statement, params):
+    # TOP (?) becomes LIMIT ?, the dates are stored as text so the casts are dropped
+    params = list(params or ())
+    if statement.startswith("SELECT TOP (?) "):
+        statement = "SELECT %s LIMIT ?" % statement[len("SELECT TOP (?) "):]
+        params = params[1:] + params[:1]
+    return statement.replace("CAST(? AS datetime)", "?").replace("LEN(", "LENGTH("), params
+
+
+class Cursor:
+    def __init__(self, cursor):
+        self.cursor = cursor
+
+    def execute(self, statement, params=()):
+        self.cursor.execute(*translate(statement, params))
+        return self
+
+    def __getattr__(self, name):
+        return getattr(self.cursor, name)
+
+
+class Connection:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def cursor(self):
+        return Cursor(self.conn.cursor())
+
+    def __getattr__(self, name):
+        return getattr(self.conn, name)
+
+
+def connector(path):
+    # returns a connect function for ConnectionPool, one attached database file per benchmark size
+    def connect():
+        conn = sqlite3.connect(":memory:", check_same_thread=False, detect_types=sqlite3.PARSE_DECLTYPES)
+        conn.execute("ATTACH ? AS dbo", (path,))
+        conn.create_function("GETDATE", 0, lambda: datetime.datetime.now().isoformat(" "))
+        conn.create_function("getutcdate", 0, lambda: datetime.datetime.utcnow().isoformat(" "))
+        return Connection(conn)
+    return connect
+
+
+def generate(path, users, activeShare=0.1, recentShare=0.6, notifications=0, seed=1):
+    # synthetic directory of users, activeShare of them with a session in the last minutes, recentShare in the 90 days view,
+    # and a history of solved notifications, one every few hours going back from now. The operator row (OPERATOR_GUID)
+    # is added to the User table as well, returns the emails of the generated users only
+    if os.path.exists(path):
+        os.remove(path)
+    rng = random.Random(seed)
+    conn = connector(path)()
+    for statement in SCHEMA:
+        conn.execute(statement)
+    now = datetime.datetime.utcnow()
+    rows = []
+    for i in range(users):
+        guid = str(uuid.UUID(int=rng.getrandbits(128))).upper()
+        rows.append((guid, "gid%06d" % i, "Name%06d" % i, "First%06d" % i, "user%06d@example.com" % i))
+    conn.executemany("INSERT INTO dbo.User VALUES (?, ?, ?, ?, ?)", rows)
+    conn.executemany("INSERT INTO dbo.UserActiveSession VALUES (?, ?)",
+                     [(r[0], now - datetime.timedelta(seconds=rng.randint(0, 300))) for r in rows if rng.random() < activeShare])
+    conn.executemany("INSERT INTO dbo.LV_ActiveEmailsLast90Days VALUES (?)", [(r[4],) for r in rows if rng.random() < recentShare])
+    conn.execute("INSERT INTO dbo.User VALUES (?, 'operator', 'Operator', 'Bench', 'operator@example.com')", (OPERATOR_GUID,))
+    history = []
+    for i in range(notifications):
+        dateNew = (now - datetime.timedelta(hours=3 * i)).isoformat(" ", timespec="milliseconds")
+        history.append((str(uuid.UUID(int=rng.getrandbits(128))).upper(), dateNew, dateNew, OPERATOR_GUID, OPERATOR_GUID, str(rng.randint(1, 3)), "Notification %s" % i, 0))
+    conn.executemany("INSERT INTO dbo.Notifications(appGUID, DateNew, DateChanged, UserNew, UserChanged, Level, ShortText, Active) VALUES (?, ?, ?, ?, ?, ?, ?, ?)", history)
+    conn.commit()
+    conn.close()
+    return [r[4] for r in rows]
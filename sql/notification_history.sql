@@ -0,0 +1,21 @@
+-- Indexes behind the notification history (History tab, --headless history) and the status and solve statements.
+-- Replace dbo with the owner configured in database.owner. appGUID is assumed to be the primary key of Notifications.
+
+-- History pages, newest first: a page starts with a seek to (DateNew, appGUID) of the last row shown and reads
+-- the next rows in index order, so every page costs the same however many years of notifications the table holds.
+CREATE NONCLUSTERED INDEX IX_Notifications_DateNew ON dbo.Notifications (DateNew DESC, appGUID DESC)
+	INCLUDE (DateChanged, Level, ShortText, Active);
+GO
+
+-- The same pages filtered by level.
+CREATE NONCLUSTERED INDEX IX_Notifications_Level_DateNew ON dbo.Notifications (Level, DateNew DESC, appGUID DESC)
+	INCLUDE (DateChanged, ShortText, Active);
+GO
+
+-- The status poll only reads the few active rows.
+CREATE NONCLUSTERED INDEX IX_Notifications_Active ON dbo.Notifications (DateNew DESC)
+	INCLUDE (appGUID, ShortText) WHERE Active = 1;
+GO
+
+-- The title filter (LIKE '%text%') is checked on the rows read in index order. A page of a frequent text stays cheap,
+-- a text that matches only a few old notifications reads the rows in between, narrow it down with the level if needed.
@@ -0,0 +1,16 @@
+-- Recipients of a notification, one row per notified user, replacing the comma separated Notifications.NotifiedUsers.
+-- Replace dbo with the owner configured in database.owner.
+CREATE TABLE dbo.NotificationRecipients (
+	NotificationID uniqueidentifier NOT NULL,
+	UserID uniqueidentifier NOT NULL,
+	CONSTRAINT PK_NotificationRecipients PRIMARY KEY CLUSTERED (NotificationID, UserID)
+);
+GO
+
+-- "which notifications did this user get"
+CREATE NONCLUSTERED INDEX IX_NotificationRecipients_UserID ON dbo.NotificationRecipients (UserID) INCLUDE (NotificationID);
+GO
+
+-- Existing NotifiedUsers strings are moved afterwards in batches with:
+--   python application.py CONFIG --headless migrate-recipients
+-- The column is cleared once its content has been copied and can be dropped when no notification has it set any more.
@@ -0,0 +1,58 @@
+import os
+import sys
+
+import pytest
+
+# the tests import util and benchmarks from the repository root, like the entry points do
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+from benchmarks import run, standin
+from util.logger import Logger
+from util.pool import ConnectionPool
+
+USERS = 200
+NOTIFICATIONS = 120
+
+
+@pytest.fixture(scope="session", autouse=True)
+def logging():
+    Logger.configure({"logging": {"level": "WARNING"}})
+    yield
+    Logger.shutdown()
+
+
+@pytest.fixture
+def sendgrid(monkeypatch):
+    # fake SendGrid endpoint, the transport still needs the sendgrid client to post to it
+    pytest.importorskip("sendgrid")
+    monkeypatch.setenv("SENDGRID_API_KEY", "test")
+    from benchmarks.fakesendgrid import FakeSendGrid
+    server = FakeSendGrid().start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def smtp():
+    pytest.importorskip("aiosmtpd")
+    from benchmarks.fakesmtp import FakeSmtp
+    server = FakeSmtp().start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def directory(tmp_path):
+    # stand-in database of USERS generated users and NOTIFICATIONS solved notifications, returns their emails
+    path = str(tmp_path / "standin.db")
+    return path, standin.generate(path, USERS, notifications=NOTIFICATIONS)
+
+
+@pytest.fixture
+def config(directory, tmp_path):
+    # the benchmark configuration over the stand-in, tests that send mail point email.apiHost at the fake endpoint
+    config = run.buildConfig(directory[0], "http://127.0.0.1:9")
+    config["snapshot"] = {"path": str(tmp_path / "snapshot" / "directory.db")}
+    run.registerPool(config)
+    yield config
+    ConnectionPool.closeShared()
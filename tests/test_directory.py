@@ -0,0 +1,20 @@
+from util.directory import UserDirectory
+from util.search import SearchIndex
+
+
+def test_names_of_a_recipient_are_filled_in_later():
+    directory = UserDirectory()
+    # a previously notified user, known only by appGUID and email
+    recipient = directory.add("G1", None, None, "Anna.Meyer@example.com", "app")
+    assert recipient.label == "None, None <Anna.Meyer@example.com>"
+    record = directory.add("G1", "Meyer", "Anna", "anna.meyer@example.com", "app")
+    assert record is recipient
+    assert record.label == "Meyer, Anna <Anna.Meyer@example.com>"
+    assert directory.fromLabels([record.label]) == [record]
+    assert directory.fromLabels(["None, None <Anna.Meyer@example.com>"]) == []
+    index = SearchIndex()
+    index.update([record])
+    assert index.search("meyer anna")[index.ids[record.label]] == 1
+    # names already known are kept
+    directory.add("G1", "Other", "Name", "anna.meyer@example.com", "app")
+    assert record.label == "Meyer, Anna <Anna.Meyer@example.com>"
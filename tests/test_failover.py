@@ -0,0 +1,23 @@
+from benchmarks import run
+
+
+def test_rejected_batches_fail_over_to_smtp(config, sendgrid, smtp, directory):
+    # SendGrid answers 400, which is not retried, so every batch goes out over SMTP instead
+    sendgrid.status = 400
+    config = run.smtpConfig(dict(config, email=dict(config["email"], apiHost=sendgrid.url, batchSize=50)), smtp, "sendgrid", ["smtp"])
+    notifier = run.newNotifier(config)
+    emails = directory[1]
+    assert notifier.mail.sendMail(emails, run.SHORT_TEXT, run.LONG_TEXT)
+    batches = -(-len(emails) // 50)
+    assert sendgrid.requests == batches
+    assert smtp.messages == batches
+    # every batch carries the copy of the receiver address
+    assert smtp.recipients == len(emails) + batches
+
+
+def test_failed_fallback_reports_the_batches(config, sendgrid, directory):
+    sendgrid.status = 400
+    config["email"]["apiHost"] = sendgrid.url
+    notifier = run.newNotifier(config)
+    results = notifier.mail.deliver(directory[1], run.SHORT_TEXT, run.LONG_TEXT)
+    assert results and not any(r.ok for r in results)
@@ -0,0 +1,39 @@
+from conftest import NOTIFICATIONS
+
+from benchmarks import run
+
+
+def readAll(notifier, limit, level=None):
+    rows, cursor = notifier.getHistory(limit, level=level)
+    pages = [rows]
+    while cursor is not None:
+        rows, cursor = notifier.getHistory(limit, cursor, level)
+        pages.append(rows)
+    return pages
+
+
+def test_pages_cover_every_notification_once(config):
+    notifier = run.newNotifier(config)
+    pages = readAll(notifier, 50)
+    assert [len(page) for page in pages] == [50, 50, NOTIFICATIONS - 100]
+    rows = [row for page in pages for row in page]
+    assert len({row[1] for row in rows}) == NOTIFICATIONS
+    # newest first across the page boundaries
+    keys = [(row[2], row[1]) for row in rows]
+    assert keys == sorted(keys, reverse=True)
+
+
+def test_level_filter_pages(config):
+    notifier = run.newNotifier(config)
+    everything = [row for page in readAll(notifier, 50) for row in page]
+    for level in ("1", "2", "3"):
+        rows = [row for page in readAll(notifier, 7, level) for row in page]
+        assert [row[1] for row in rows] == [row[1] for row in everything if row[4] == level]
+
+
+def test_text_filter(config):
+    notifier = run.newNotifier(config)
+    rows, cursor = notifier.getHistory(50, text="Notification 11")
+    # Notification 11 and 110 to 119
+    assert sorted(row[5] for row in rows) == sorted(["Notification 11"] + ["Notification 11%s" % i for i in range(10)])
+    assert cursor is None
@@ -0,0 +1,32 @@
+import logging
+import os
+import time
+
+from util.logger import DatedFileHandler
+
+
+def record(message, created):
+    entry = logging.LogRecord("test", logging.INFO, __file__, 1, message, None, None)
+    entry.created = created
+    return entry
+
+
+def test_every_day_gets_its_own_file_and_old_days_are_pruned(tmp_path):
+    folder = str(tmp_path)
+    for day in ("2020_01_01", "2020_01_02"):
+        open(os.path.join(folder, day + ".txt"), "w").close()
+    open(os.path.join(folder, "notes.txt"), "w").close()
+    handler = DatedFileHandler(folder, backupCount=1)
+    now = time.time()
+    handler.emit(record("today", now))
+    # another process writing the same file at the same time only appends
+    with open(handler.baseFilename, "a") as other:
+        other.write("other process\n")
+    handler.emit(record("tomorrow", now + 86400))
+    handler.close()
+    today, tomorrow = (time.strftime("%Y_%m_%d", time.localtime(t)) + ".txt" for t in (now, now + 86400))
+    assert sorted(os.listdir(folder)) == sorted(["notes.txt", today, tomorrow])
+    with open(os.path.join(folder, today)) as f:
+        assert f.read() == "today\nother process\n"
+    with open(os.path.join(folder, tomorrow)) as f:
+        assert f.read() == "tomorrow\n"
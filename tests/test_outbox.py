@@ -0,0 +1,47 @@
+import threading
+import time
+
+from util.outbox import Outbox
+
+
+def test_two_outboxes_on_one_file_run_a_job_once(tmp_path):
+    # e.g. the user interface started while --headless scheduler delivers a planned job
+    path = str(tmp_path / "outbox.db")
+    calls = []
+    release = threading.Event()
+
+    def handler(job):
+        calls.append(job.key)
+        release.wait(5)
+        return True
+
+    first = Outbox(handler, path, lease=2)
+    second = Outbox(handler, path, lease=2)
+    key = first.enqueue("remind", {})
+    first.start()
+    time.sleep(0.3)
+    second.start()
+    # longer than the lease, the first outbox keeps renewing it
+    time.sleep(2.5)
+    release.set()
+    time.sleep(0.3)
+    first.stop()
+    second.stop()
+    assert calls == [key]
+    assert first.status(key) == "done"
+
+
+def test_expired_lease_is_taken_over(tmp_path):
+    # a process that died while running a job stops renewing its lease, another one resumes the job
+    path = str(tmp_path / "outbox.db")
+    crashed = Outbox(lambda job: True, path, lease=1)
+    key = crashed.enqueue("remind", {})
+    job, wait = crashed.next(crashed.lanes[0])
+    assert job.key == key and crashed.status(key) == "running"
+    done = []
+    other = Outbox(lambda job: done.append(job.key) or True, path, lease=1)
+    other.start()
+    time.sleep(1.8)
+    other.stop()
+    assert done == [key]
+    assert other.status(key) == "done"
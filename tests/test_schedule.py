@@ -0,0 +1,144 @@
+import json
+import time
+
+import pytest
+
+from benchmarks import run, standin
+from util.outbox import OutboxJob
+
+
+@pytest.fixture
+def notifier(config, sendgrid, tmp_path, monkeypatch):
+    # outbox and plans in the test directory, the operator of the benchmarks raises every notification
+    monkeypatch.setattr("util.user.User.get", staticmethod(lambda: run.OPERATOR))
+    config["email"]["apiHost"] = sendgrid.url
+    config["outbox"] = {"path": str(tmp_path / "outbox.db"), "maxAttempts": 2, "backoff": 0}
+    config["schedule"] = {"path": str(tmp_path / "schedule.db")}
+    notifier = run.newNotifier(config)
+    notifier.openScheduler()
+    yield notifier
+    if notifier.outbox is not None:
+        notifier.outbox.stop()
+
+
+def settle(outbox, key, timeout=5):
+    # final status of the outbox job
+    deadline = time.monotonic() + timeout
+    while outbox.status(key) not in ("done", "failed") and time.monotonic() < deadline:
+        time.sleep(0.02)
+    return outbox.status(key)
+
+
+def steps(scheduler, plan):
+    # {kind: entry} of the plan
+    with scheduler.lock:
+        keys = [row[0] for row in scheduler.conn.execute("SELECT key FROM entries WHERE plan = ?", (plan,))]
+    return {entry.kind: entry for entry in map(scheduler.get, keys)}
+
+
+def plan(notifier, at, duration=60, remindBefore=0):
+    users = notifier.loadUsers90Days()[:5]
+    return notifier.scheduleNotification("2", "Downtime", run.LONG_TEXT, users, at, duration, ("Solved: Downtime", run.LONG_TEXT), remindBefore, 0, run.OPERATOR)
+
+
+def notifications(directory, key):
+    conn = standin.connector(directory[0])()
+    return conn.execute("SELECT COUNT(*) FROM dbo.Notifications WHERE appGUID = ?", (key,)).fetchone()[0]
+
+
+def test_raise_is_skipped_while_a_notification_is_active(notifier, sendgrid):
+    notifier.startOutbox()
+    mailSent, created = notifier.raiseNotification("1", run.SHORT_TEXT, run.LONG_TEXT, notifier.loadUsers90Days()[:3], run.OPERATOR)
+    assert mailSent and created
+    at = time.time() + 60
+    entries = steps(notifier.scheduler, plan(notifier, at))
+    notifier.scheduler.fire(entries["raise"], at)
+    notifier.scheduler.fire(entries["solve"], at + 60)
+    assert notifier.scheduler.get(entries["raise"].key).status == "skipped"
+    assert notifier.scheduler.get(entries["solve"].key).status == "skipped"
+    assert notifier.outbox.status(entries["raise"].key) is None
+    assert notifier.outbox.status(entries["solve"].key) is None
+    assert sendgrid.requests == 1
+
+
+def test_solve_waits_for_the_raise_job(notifier, directory, sendgrid):
+    # the outbox is stopped, the raise is enqueued but not delivered yet
+    notifier.startOutbox().stop()
+    at = time.time() + 60
+    entries = steps(notifier.scheduler, plan(notifier, at))
+    raiseKey, solveKey = entries["raise"].key, entries["solve"].key
+    notifier.scheduler.fire(entries["raise"], at)
+    assert notifier.outbox.status(raiseKey) == "pending"
+    notifier.scheduler.fire(entries["solve"], at + 60)
+    assert notifier.scheduler.get(solveKey).status == "scheduled"
+    assert notifier.outbox.status(solveKey) is None
+
+    outbox = notifier.startOutbox()
+    assert settle(outbox, raiseKey) == "done"
+    assert notifications(directory, raiseKey) == 1
+    notifier.scheduler.fire(notifier.scheduler.get(solveKey), at + 60)
+    assert notifier.scheduler.get(solveKey).status == "fired"
+    assert settle(outbox, solveKey) == "done"
+    assert notifier.getStatus(maxAge=0) == (0, None)
+    assert sendgrid.requests == 2
+
+
+def test_solve_is_skipped_after_a_failed_raise(notifier, sendgrid):
+    sendgrid.status = 400
+    outbox = notifier.startOutbox()
+    at = time.time() + 60
+    entries = steps(notifier.scheduler, plan(notifier, at))
+    notifier.scheduler.fire(entries["raise"], at)
+    assert settle(outbox, entries["raise"].key) == "failed"
+    notifier.scheduler.fire(entries["solve"], at + 60)
+    assert notifier.scheduler.get(entries["solve"].key).status == "skipped"
+    assert outbox.status(entries["solve"].key) is None
+
+
+def test_reminder_expires_at_the_raise_time(notifier, sendgrid):
+    notifier.startOutbox()
+    at = time.time() + 1000
+    entries = steps(notifier.scheduler, plan(notifier, at, remindBefore=900))
+    assert entries["remind"].due == pytest.approx(at - 900)
+    # the process was down from before the reminder until after the raise time
+    notifier.scheduler.fire(entries["remind"], at + 1)
+    assert notifier.scheduler.get(entries["remind"].key).status == "expired"
+    assert notifier.outbox.status(entries["remind"].key) is None
+    assert sendgrid.requests == 0
+
+
+def test_cancelled_plan_is_not_sent(notifier, sendgrid):
+    notifier.startOutbox()
+    key = plan(notifier, time.time() + 0.2, duration=0.2)
+    entries = steps(notifier.scheduler, key)
+    assert notifier.scheduler.cancel(key) == 2
+    assert notifier.scheduler.entries() == []
+    notifier.startScheduler()
+    time.sleep(0.8)
+    notifier.scheduler.stop()
+    assert {entry.status for entry in steps(notifier.scheduler, key).values()} == {"cancelled"}
+    assert all(notifier.outbox.status(entry.key) is None for entry in entries.values())
+    assert sendgrid.requests == 0
+
+
+def test_outbox_resumes_and_replays_idempotently(notifier, directory, sendgrid):
+    users = notifier.loadUsers90Days()[:5]
+    # enqueued while no worker runs, e.g. the application was closed right after Start
+    notifier.startOutbox().stop()
+    key = notifier.enqueueRaise("2", run.SHORT_TEXT, run.LONG_TEXT, users)
+    assert notifier.outbox.pending("interactive") == 1
+    outbox = notifier.startOutbox()
+    assert settle(outbox, key) == "done"
+    assert notifications(directory, key) == 1
+    assert sendgrid.requests == 1
+
+    # a retry after the steps were recorded does nothing
+    payload = outbox.conn.execute("SELECT payload, state FROM jobs WHERE key = ?", (key,)).fetchone()
+    job = OutboxJob(key, "raise", json.loads(payload[0]), json.loads(payload[1]), 1)
+    assert notifier.processJob(job)
+    assert sendgrid.requests == 1
+    # a replay from scratch sends the mail again but does not create a second notification
+    job = OutboxJob(key, "raise", job.payload, {}, 0)
+    assert notifier.processJob(job)
+    assert notifications(directory, key) == 1
+    assert notifier.getStatus(maxAge=0)[0] == 1
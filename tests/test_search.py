@@ -0,0 +1,26 @@
+from benchmarks import standin
+from util.directory import UserDirectory
+from util.search import FilteredList, SearchIndex
+
+
+def expected(records, indexed, items, query):
+    # rows of indexed records that have a word starting with every term
+    words = {r.label: SearchIndex.wordsOf(r) for r in records}
+    terms = query.lower().split()
+    return [row for row, label in enumerate(items) if label in indexed and all(any(w.startswith(t) for w in words[label]) for t in terms)]
+
+
+def test_filtered_rows_match_the_query_in_list_order(directory):
+    conn = standin.connector(directory[0])()
+    records = UserDirectory().load(conn.execute("SELECT appGUID, Name, Vorname, Email FROM dbo.User").fetchall())
+    index = SearchIndex()
+    index.update(records[:150])
+    # in reverse order and with labels not indexed yet
+    items = [r.label for r in reversed(records)]
+    filtered = FilteredList(index)
+    for query in ("n", "name0001", "first00012 name", "user000123@", "zzz"):
+        assert filtered.rows(items, index.search(query)) == expected(records, {r.label for r in records[:150]}, items, query)
+    # the rest is indexed later, the rows are looked up again
+    index.update(records)
+    assert filtered.rows(items, index.search("name0019")) == expected(records, set(items), items, "name0019")
+    assert index.search("  ") is None
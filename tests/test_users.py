@@ -0,0 +1,11 @@
+from benchmarks import run
+
+
+def test_load_after_refresh_returns_every_active_user(config):
+    notifier = run.newNotifier(config)
+    added, expired = notifier.refreshUsersNow()
+    assert added and not expired
+    # e.g. the reload once the database is back, after the periodic refresh already ran
+    users = notifier.loadUsersNow()
+    assert sorted(u.email for u in users) == sorted(u.email for u in added)
+    assert notifier.lists["now"] == users
@@ -0,0 +1,25 @@
+from benchmarks import run
+
+
+def test_raise_and_solve(config, sendgrid):
+    config["email"]["apiHost"] = sendgrid.url
+    notifier = run.newNotifier(config)
+    users = notifier.loadUsers90Days()
+    assert users
+
+    mailSent, created = notifier.raiseNotification("2", run.SHORT_TEXT, run.LONG_TEXT, users, run.OPERATOR)
+    assert mailSent and created
+    actNot, usrNot = notifier.getStatus(maxAge=0)
+    assert actNot == 1
+    assert usrNot[2] == run.SHORT_TEXT
+    # every recipient gets the mail once, plus the copy of the receiver address
+    assert sendgrid.recipients == len(users) + 1
+
+    notified = notifier.getNotifiedUsers(usrNot)
+    assert sorted(u.email for u in notified) == sorted(u.email for u in users)
+    sendgrid.reset()
+    mailSent, deactivated = notifier.solveNotification("Solved: " + run.SHORT_TEXT, run.LONG_TEXT, notified, notifier.activeIDs(usrNot))
+    assert mailSent and deactivated
+    assert notifier.getStatus(maxAge=0) == (0, None)
+    assert sendgrid.recipients == len(users) + 1
+
@@ -0,0 +1,935 @@
+import time
+import datetime
+import queue
+from concurrent.futures import ThreadPoolExecutor
+from itertools import compress
+import tkinter as tk
+import tkinter.ttk as ttk
+import customtkinter as ctk
+from util.logger import Logger
+from util.metrics import Metrics
+from util.basedir import BaseDir
+from util.directory import UserDirectory
+from util.history import formatRow
+from util.notifier import Notifier
+from util.profiler import StartupProfiler
+from util.search import FilteredList
+from util.templates import TemplateRegistry
+
+# user lists are added to the checkbox frames in batches of this size, one batch per event loop turn
+FILL_BATCH_SIZE = 200
+LOAD_POLL_MS = 50
+OUTBOX_POLL_MS = 200
+DIAGNOSTICS_POLL_MS = 1000
+# the search runs once typing pauses for this long
+SEARCH_DEBOUNCE_MS = 150
+# unscaled height of one row in the recipient lists
+ROW_HEIGHT = 34
+# notifications per page of the History tab
+HISTORY_PAGE_SIZE = 50
+
+ctk.set_appearance_mode("System")  # Modes: "System" (standard), "Dark", "Light"
+ctk.set_default_color_theme("blue")  # Themes: "blue" (standard), "green", "dark-blue"
+
+class ScrollableCheckBoxFrame(ctk.CTkFrame):
+    # virtualized list: only the visible rows exist as widgets, selection lives in a bytearray indexed by row.
+    # With a filter set only the matching rows are shown, view holds their row numbers in list order.
+    # The filter is a search mask of the index the list is filtered over (see SearchIndex.search).
+    def __init__(self, master, item_list, command=None, **kwargs):
+        super().__init__(master, **kwargs)
+        self.grid_rowconfigure(0, weight=1)
+        self.grid_columnconfigure(0, weight=1)
+
+        self.command = command
+        self.items = []
+        self.index = {}
+        self.checked = bytearray()
+        self.filter = None
+        self.filtered = None
+        self.view = None
+        self.selected = 0
+        self.state = "normal"
+        self.top = 0
+        self.visible_rows = 1
+        self.checkbox_pool = []
+
+        self.rows_frame = ctk.CTkFrame(self, fg_color="transparent")
+        self.rows_frame.grid(row=0, column=0, sticky="nsew")
+        self.rows_frame.grid_propagate(False)
+        self.scrollbar = ctk.CTkScrollbar(self, command=self.event_scrollbar)
+        self.scrollbar.grid(row=0, column=1, sticky="ns")
+        self.rows_frame.bind("<Configure>", self.event_resize)
+        self.bind_mousewheel(self.rows_frame)
+        self.add_items(item_list)
+
+    def bind_mousewheel(self, widget):
+        widget.bind("<MouseWheel>", self.event_mousewheel)
+        widget.bind("<Button-4>", self.event_mousewheel)
+        widget.bind("<Button-5>", self.event_mousewheel)
+
+    def add_item(self, item):
+        self.add_items([item])
+
+    def add_items(self, item_list):
+        item_list = [item for item in item_list if item not in self.index]
+        for item in item_list:
+            self.index[item] = len(self.items)
+            self.items.append(item)
+        self.checked.extend(bytes([self.selected]) * len(item_list))
+        self.apply_filter()
+        self.render()
+
+    def remove_item(self, item):
+        self.remove_items([item])
+
+    def remove_items(self, item_list):
+        removed = {self.index[item] for item in item_list if item in self.index}
+        if not removed:
+            return
+        keep = [row not in removed for row in range(len(self.items))]
+        self.items = list(compress(self.items, keep))
+        self.checked = bytearray(compress(self.checked, keep))
+        self.index = {item: row for row, item in enumerate(self.items)}
+        if self.filtered is not None:
+            self.filtered.invalidate()
+        self.apply_filter()
+        self.render()
+
+    def get_checked_items(self):
+        return list(compress(self.items, self.checked))
+
+    def set_filter(self, mask, search_index=None):
+        # mask of the matching records of search_index, None shows the whole list
+        if mask is not None and (self.filtered is None or self.filtered.index is not search_index):
+            self.filtered = FilteredList(search_index)
+        self.filter = mask
+        self.top = 0
+        self.apply_filter()
+        self.render()
+
+    def apply_filter(self):
+        if self.filter is None:
+            self.view = None
+        else:
+            self.view = self.filtered.rows(self.items, self.filter)
+
+    def row_count(self):
+        return len(self.items) if self.view is None else len(self.view)
+
+    def row_at(self, position):
+        return position if self.view is None else self.view[position]
+
+    def changeselectall(self, action):
+        # with a filter only the matching rows change, the rows hidden keep their selection
+        if self.view is None:
+            self.selected = action
+            self.checked = bytearray([action]) * len(self.items)
+        else:
+            for row in self.view:
+                self.checked[row] = action
+        self.render()
+
+    def changestate(self, action):
+        self.state = "disabled" if action == 0 else "normal"
+        self.render()
+
+    def event_resize(self, event):
+        row_height = self._apply_widget_scaling(ROW_HEIGHT)
+        self.visible_rows = max(1, int(event.height // row_height))
+        while len(self.checkbox_pool) < self.visible_rows:
+            slot = len(self.checkbox_pool)
+            checkbox = ctk.CTkCheckBox(self.rows_frame, text="", command=lambda slot=slot: self.event_toggle(slot))
+            self.bind_mousewheel(checkbox)
+            self.checkbox_pool.append(checkbox)
+        self.render()
+
+    def event_toggle(self, slot):
+        self.checked[self.row_at(self.top + slot)] = self.checkbox_pool[slot].get()
+        if self.command is not None:
+            self.command()
+
+    def event_mousewheel(self, event):
+        if event.num == 4 or event.delta > 0:
+            self.scroll_to(self.top - 3)
+        else:
+            self.scroll_to(self.top + 3)
+
+    def event_scrollbar(self, action, value, unit=None):
+        if action == "moveto":
+            self.scroll_to(int(float(value) * self.row_count()))
+        elif unit == "pages":
+            self.scroll_to(self.top + int(value) * self.visible_rows)
+        else:
+            self.scroll_to(self.top + int(value))
+
+    def scroll_to(self, top):
+        top = max(0, min(top, self.row_count() - self.visible_rows))
+        if top != self.top:
+            self.top = top
+            self.render()
+
+    def render(self):
+        # only the pooled rows are touched, whatever the size of the list
+        count = self.row_count()
+        self.top = max(0, min(self.top, count - self.visible_rows))
+        for slot, checkbox in enumerate(self.checkbox_pool):
+            position = self.top + slot
+            if slot < self.visible_rows and position < count:
+                row = self.row_at(position)
+                checkbox.configure(text=self.items[row], state=self.state)
+                if self.checked[row]:
+                    checkbox.select()
+                else:
+                    checkbox.deselect()
+                checkbox.grid(row=slot, column=0, pady=5, padx=10, sticky="nw")
+            else:
+                checkbox.grid_remove()
+        if count:
+            self.scrollbar.set(self.top / count, min(1.0, (self.top + self.visible_rows) / count))
+        else:
+            self.scrollbar.set(0.0, 1.0)
+
+class App(ctk.CTk):
+    def __init__(self, config, startTime=None):
+        widgetsStart = time.perf_counter()
+        super().__init__()
+        self.startTime = startTime or widgetsStart
+        self.first_paint = False
+
+        self.config = config
+        self.notifier = Notifier(self.config)
+        self.outbox = self.notifier.startOutbox()
+        self.scheduler = self.notifier.startScheduler()
+        self.outbox_events = queue.SimpleQueue()
+        self.outbox.addListener(lambda job, status, message: self.outbox_events.put((job, status, message)))
+        self.directory = self.notifier.directory
+        self.templates = TemplateRegistry.shared()
+
+        # load logger
+        self.logger = Logger().getLogger("Application")
+
+        # configure window
+        self.title("Notification Manager")
+        self.geometry(f"{1100}x{580}")
+        self.iconbitmap(BaseDir.get() + '\\ico\\' + 'notification-manager.ico')
+        # configure grid layout (1x2) (rowsxcollumns)
+        self.grid_rowconfigure(0, weight=1)
+        self.grid_columnconfigure(0, weight=0) # collumns 0 and 1 should be fixed
+        self.grid_columnconfigure(1, weight=1) 
+        
+        
+        # create sidebar frame with widgets
+        self.sidebar_frame = ctk.CTkFrame(self, width=140, corner_radius=0)
+        self.sidebar_frame.grid(row=0, column=0, rowspan=7, sticky="nsew")
+        self.sidebar_frame.grid_rowconfigure(5, weight=1)
+        self.logo_label = ctk.CTkLabel(self.sidebar_frame, text="Notification Manager", font=ctk.CTkFont(size=20, weight="bold"))
+        self.logo_label.grid(row=0, column=0, padx=20, pady=(20, 10))
+        self.button_start = ctk.CTkButton(self.sidebar_frame, text="Raise notification", command=self.event_button_start)
+        self.button_start.grid(row=1, column=0, padx=20, pady=10)
+        self.button_stop = ctk.CTkButton(self.sidebar_frame, text="Solve notification", command=self.event_button_stop)
+        self.button_stop.grid(row=2, column=0, padx=20, pady=10)
+        self.sep = ttk.Separator(self.sidebar_frame)
+        self.sep.grid(row=3, column=0, padx=20, pady=20, sticky="ew")
+        self.label_std_texts = ctk.CTkLabel(self.sidebar_frame, text="Standard Texts:")
+        self.label_std_texts.grid(row=4, column=0, padx=20, pady=(10, 0), sticky="n")
+        self.optionemenu_std_texts = ctk.CTkOptionMenu(self.sidebar_frame, values=["None"], command=self.event_change_std_texts)
+        self.optionemenu_std_texts.grid(row=5, column=0, padx=20, pady=(10, 0), sticky="n")     
+        self.appearance_mode_label = ctk.CTkLabel(self.sidebar_frame, text="Appearance Mode:", anchor="w")
+        self.appearance_mode_label.grid(row=6, column=0, padx=20, pady=(10, 0))
+        self.appearance_mode_optionemenu = ctk.CTkOptionMenu(self.sidebar_frame, values=["Light", "Dark", "System"], command=self.event_change_appearance_mode)
+        self.appearance_mode_optionemenu.grid(row=7, column=0, padx=20, pady=(10, 10))
+        self.scaling_label = ctk.CTkLabel(self.sidebar_frame, text="UI Scaling:", anchor="w")
+        self.scaling_label.grid(row=8, column=0, padx=20, pady=(10, 0))
+        self.scaling_optionemenu = ctk.CTkOptionMenu(self.sidebar_frame, values=["80%", "90%", "100%", "110%", "120%"], command=self.event_change_scaling)
+        self.scaling_optionemenu.grid(row=9, column=0, padx=20, pady=(10, 20))
+        self.button_help = ctk.CTkButton(self.sidebar_frame, text="Help", command=self.event_button_help)
+        self.button_help.grid(row=10, column=0, padx=20, pady=10)
+        
+        # create tabview
+        self.tabview = ctk.CTkTabview(self, width=250, command=self.event_change_tab)
+        self.tabview.grid(row=0, column=1, padx=(20, 0), pady=(20, 0), sticky="nsew")
+        self.tabview.add("Notification")
+        self.tabview.add("User Selection")
+        self.tabview.add("History")
+        self.tabview.add("Diagnostics")
+        # configure grid of individual tabs
+        self.tabview._segmented_button.grid(sticky="w") 
+        self.tabview.tab("Notification").grid_rowconfigure((0, 1, 2), weight=0) # rows 0, 1 and 2 should be fixed
+        self.tabview.tab("Notification").grid_rowconfigure(3, weight=1)
+        self.tabview.tab("Notification").grid_columnconfigure((0, 1), weight=0) # collumns 0 and 1 should be fixed 
+        self.tabview.tab("Notification").grid_columnconfigure(2, weight=1) 
+        self.tabview.tab("User Selection").grid_rowconfigure(0, weight=0) # rows 0 should be fixed
+        self.tabview.tab("User Selection").grid_rowconfigure(1, weight=1)
+        self.tabview.tab("User Selection").grid_columnconfigure((0, 1), weight=1)
+        self.tabview.tab("History").grid_rowconfigure(0, weight=0)
+        self.tabview.tab("History").grid_rowconfigure(1, weight=1)
+        self.tabview.tab("History").grid_columnconfigure(0, weight=1)
+        self.tabview.tab("Diagnostics").grid_rowconfigure(0, weight=1)
+        self.tabview.tab("Diagnostics").grid_columnconfigure(0, weight=1)
+
+        # create diagnostics textbox, refreshed while its tab is shown
+        self.diagnostics = ctk.CTkTextbox(self.tabview.tab("Diagnostics"), font=ctk.CTkFont(family="Courier", size=12), wrap="none")
+        self.diagnostics.grid(row=0, column=0, padx=20, pady=20, sticky="nsew")
+        self.diagnostics.configure(state="disabled")
+
+        # create history filters and list, one page of past notifications is loaded whenever the tab is shown
+        self.history_frame = ctk.CTkFrame(self.tabview.tab("History"))
+        self.history_frame.grid(row=0, column=0, padx=20, pady=(20, 0), sticky="nsew")
+        self.history_frame.grid_columnconfigure(3, weight=1)
+        self.label_history_level = ctk.CTkLabel(master=self.history_frame, text="Level:")
+        self.label_history_level.grid(row=0, column=0, padx=10, pady=10, sticky="nse")
+        self.optionmenu_history_level = ctk.CTkOptionMenu(master=self.history_frame, values=["All", "1", "2", "3"], width=80, command=lambda level: self.event_history_search())
+        self.optionmenu_history_level.grid(row=0, column=1, padx=10, pady=10, sticky="ns")
+        self.label_history_text = ctk.CTkLabel(master=self.history_frame, text="Title contains:")
+        self.label_history_text.grid(row=0, column=2, padx=10, pady=10, sticky="nse")
+        self.entry_history_text = ctk.CTkEntry(master=self.history_frame)
+        self.entry_history_text.grid(row=0, column=3, padx=10, pady=10, sticky="ew")
+        self.entry_history_text.bind("<Return>", lambda event: self.event_history_search())
+        self.button_history_search = ctk.CTkButton(master=self.history_frame, text="Search", width=80, command=self.event_history_search)
+        self.button_history_search.grid(row=0, column=4, padx=10, pady=10)
+        self.button_history_newer = ctk.CTkButton(master=self.history_frame, text="< Newer", width=80, command=self.event_history_newer, state="disabled")
+        self.button_history_newer.grid(row=0, column=5, padx=10, pady=10)
+        self.button_history_older = ctk.CTkButton(master=self.history_frame, text="Older >", width=80, command=self.event_history_older, state="disabled")
+        self.button_history_older.grid(row=0, column=6, padx=10, pady=10)
+        self.history = ctk.CTkTextbox(self.tabview.tab("History"), font=ctk.CTkFont(family="Courier", size=12), wrap="none")
+        self.history.grid(row=1, column=0, padx=20, pady=20, sticky="nsew")
+        self.history.configure(state="disabled")
+        # cursors of the pages before the one shown, of the page shown and of the next page
+        self.history_pages = []
+        self.history_cursor = None
+        self.history_next = None
+        self.history_future = None
+        
+        # create frame and combobox level
+        self.frame_level = ctk.CTkFrame(self.tabview.tab("Notification"))
+        self.frame_level.grid(row=1, column=2, columnspan=2, padx=20, pady=10, sticky="nsew")   
+        self.combobox_level = ctk.CTkComboBox(master=self.frame_level, values=["", "1", "2", "3"], width=75, command=self.event_change_level)
+        self.combobox_level.grid(row=0, column=0, padx=20, pady=10, sticky="nsw")
+        
+        # create entry
+        self.shorttext = ctk.CTkEntry(self.tabview.tab("Notification"))
+        self.shorttext.grid(row=2, column=2, columnspan=2, padx=20, pady=20, sticky="nsew")
+        
+        # create textbox
+        self.longtext = ctk.CTkTextbox(self.tabview.tab("Notification"))
+        self.longtext.grid(row=3, column=2, columnspan=2, padx=20, pady=20, sticky="nsew")
+        
+        # set default values
+        self.appearance_mode_optionemenu.set("Dark")
+        self.scaling_optionemenu.set("100%")
+        self.combobox_level.set("")
+        # the notification status is polled in the background once the worker pool exists
+        self.button_start.configure(state="disabled")
+        self.button_stop.configure(state="disabled")
+        strStatus = "Checking notifications..."
+        self.radio_var = tk.IntVar(value=0)
+        
+        # create labels
+        self.label_status1 = ctk.CTkLabel(self.tabview.tab("Notification"), text="Status:")
+        self.label_status1.grid(row=0, column=1, padx=20, pady=20, sticky="nse")
+        self.label_status2 = ctk.CTkLabel(self.tabview.tab("Notification"), text=strStatus)
+        self.label_status2.grid(row=0, column=2, padx=20, pady=20, sticky="w")
+        self.label_level = ctk.CTkLabel(self.tabview.tab("Notification"), text="Level:")
+        self.label_level.grid(row=1, column=1, padx=20, pady=20, sticky="nse")
+        self.label_level2 = ctk.CTkLabel(master=self.frame_level, text="")
+        self.label_level2.grid(row=0, column=2, padx=20, pady=10, sticky="nsw")
+        self.label_shorttext = ctk.CTkLabel(self.tabview.tab("Notification"), text="Title:")
+        self.label_shorttext.grid(row=2, column=1, padx=20, pady=20, sticky="nse")
+        self.label_longtext = ctk.CTkLabel(self.tabview.tab("Notification"), text="Description:")
+        self.label_longtext.grid(row=3, column=1, padx=20, pady=20, sticky="ne")
+
+        # create application checkboxes, only needed when notifications are managed for several applications
+        self.app_vars = {}
+        if len(self.notifier.apps) > 1:
+            self.label_apps = ctk.CTkLabel(self.tabview.tab("Notification"), text="Applications:")
+            self.label_apps.grid(row=4, column=1, padx=20, pady=(0, 20), sticky="nse")
+            self.frame_apps = ctk.CTkFrame(self.tabview.tab("Notification"))
+            self.frame_apps.grid(row=4, column=2, columnspan=2, padx=20, pady=(0, 20), sticky="nsew")
+            for column, app in enumerate(self.notifier.apps):
+                self.app_vars[app.name] = tk.IntVar(value=1)
+                checkbox = ctk.CTkCheckBox(self.frame_apps, text=app.name, variable=self.app_vars[app.name])
+                checkbox.grid(row=0, column=column, padx=10, pady=10, sticky="w")
+
+        # create schedule entries, with a raise time Raise notification plans the notification instead of raising it now
+        self.label_schedule = ctk.CTkLabel(self.tabview.tab("Notification"), text="Schedule:")
+        self.label_schedule.grid(row=5, column=1, padx=20, pady=(0, 20), sticky="nse")
+        self.frame_schedule = ctk.CTkFrame(self.tabview.tab("Notification"))
+        self.frame_schedule.grid(row=5, column=2, columnspan=2, padx=20, pady=(0, 20), sticky="nsew")
+        self.entry_schedule_at = ctk.CTkEntry(self.frame_schedule, width=220, placeholder_text="raise at YYYY-MM-DD HH:MM")
+        self.entry_schedule_at.grid(row=0, column=0, padx=10, pady=10, sticky="w")
+        self.entry_schedule_duration = ctk.CTkEntry(self.frame_schedule, width=220, placeholder_text="solve after minutes (optional)")
+        self.entry_schedule_duration.grid(row=0, column=1, padx=10, pady=10, sticky="w")
+        
+        # create radiobutton frame
+        self.radiobutton_frame = ctk.CTkFrame(self.tabview.tab("User Selection"))
+        self.radiobutton_frame.grid(row=0, column=0, columnspan=4, padx=(20, 20), pady=(20, 0), sticky="nsew")
+        self.radiobutton_frame.grid_columnconfigure((0,1,2), weight=0)
+        self.radiobutton_frame.grid_columnconfigure((3,4), weight=1)
+        self.label_radiogroup = ctk.CTkLabel(master=self.radiobutton_frame, text="Choose a user group:")
+        self.label_radiogroup.grid(row=0, column=0, padx=10, pady=10, sticky="nse")
+        self.radiobutton_1 = ctk.CTkRadioButton(master=self.radiobutton_frame, command=self.event_radiobutton, variable=self.radio_var, value=0, text="Active users now")
+        self.radiobutton_1.grid(row=0, column=1, pady=10, padx=20, sticky="ns")
+        self.radiobutton_2 = ctk.CTkRadioButton(master=self.radiobutton_frame, command=self.event_radiobutton, variable=self.radio_var, value=1, text="Active users last 90 days")
+        self.radiobutton_2.grid(row=0, column=2, pady=10, padx=20, sticky="ns")
+        self.checkbox_selectall = ctk.CTkCheckBox(master=self.radiobutton_frame, command=self.event_selectall, text="Select All")
+        self.checkbox_selectall.grid(row=0, column=3, pady=20, padx=20, sticky="nse")
+
+        self.label_loading = ctk.CTkLabel(master=self.radiobutton_frame, text="Loading users...")
+        self.label_loading.grid(row=0, column=4, pady=20, padx=20, sticky="nsw")
+
+        # type-ahead search over name, first name and email of both lists
+        self.label_search = ctk.CTkLabel(master=self.radiobutton_frame, text="Search:")
+        self.label_search.grid(row=1, column=0, padx=10, pady=(0, 10), sticky="nse")
+        self.entry_search = ctk.CTkEntry(master=self.radiobutton_frame, placeholder_text="name, first name or email")
+        self.entry_search.grid(row=1, column=1, columnspan=2, padx=20, pady=(0, 10), sticky="ew")
+        self.entry_search.bind("<KeyRelease>", self.event_search_typed)
+        self.label_matches = ctk.CTkLabel(master=self.radiobutton_frame, text="")
+        self.label_matches.grid(row=1, column=3, columnspan=2, padx=20, pady=(0, 10), sticky="nsw")
+        self.search_after = None
+
+        # create scrollable checkbox frames, they are filled once the user lists are loaded
+        self.scrollable_checkbox_frame1 = ScrollableCheckBoxFrame(master=self.tabview.tab("User Selection"), item_list=[])
+        self.scrollable_checkbox_frame1.grid(row=1, column=0, padx=15, pady=15, sticky="nsew")
+        # create scrollable checkbox frames
+        self.scrollable_checkbox_frame2 = ScrollableCheckBoxFrame(master=self.tabview.tab("User Selection"), item_list=[])
+        self.scrollable_checkbox_frame2.grid(row=1, column=1, padx=15, pady=15, sticky="nsew")
+        self.scrollable_checkbox_frame1.changeselectall(1)
+        self.event_radiobutton()
+
+        # load both user lists concurrently in the background while the window shows up
+        # the snapshot of the last session is shown first, the lists are then reconciled with the database
+        self.loaded = {}
+        self.snapshot_date = None
+        self.load_failed = False
+        self.refresh_scheduled = False
+        self.executor = ThreadPoolExecutor(max_workers=4)
+        future_snapshot = self.executor.submit(self.notifier.loadSnapshot)
+        self.after(LOAD_POLL_MS, self.event_snapshot_loaded, future_snapshot)
+        self.start_users_load()
+        # whoami and the user code lookups are done once now instead of on the first Start
+        self.executor.submit(self.notifier.prepareOperator)
+        self.bind("<Map>", self.event_first_paint, add="+")
+        self.after(OUTBOX_POLL_MS, self.event_outbox_progress)
+        self.diagnostics_due = time.perf_counter() + DIAGNOSTICS_POLL_MS / 1000
+        self.after(DIAGNOSTICS_POLL_MS, self.event_update_diagnostics)
+        self.status = None
+        self.status_after = None
+        self.status_future = None
+        self.status_stale = False
+        self.event_update_status()
+        StartupProfiler.record("build widgets", widgetsStart, time.perf_counter())
+
+    def start_users_load(self):
+        # load both user lists concurrently in the background while the window shows up
+        self.loading = 2
+        self.load_failed = False
+        future_users_now = self.executor.submit(self.load_users_now)
+        future_users_90days = self.executor.submit(self.load_users_90days)
+        self.after(LOAD_POLL_MS, self.event_users_loaded, future_users_now, self.scrollable_checkbox_frame1)
+        self.after(LOAD_POLL_MS, self.event_users_loaded, future_users_90days, self.scrollable_checkbox_frame2)
+
+    def load_users_now(self):
+        records = self.notifier.loadUsersNow()
+        if records is None:
+            return None
+        self.logger.info("loaded %s active users now after %.0f ms" % (len(records), (time.perf_counter() - self.startTime) * 1000))
+        return [r.label for r in records]
+
+    def load_users_90days(self):
+        records = self.notifier.loadUsers90Days()
+        if records is None:
+            return None
+        self.logger.info("loaded %s active users last 90 days after %.0f ms" % (len(records), (time.perf_counter() - self.startTime) * 1000))
+        return [r.label for r in records]
+
+    def event_first_paint(self, event):
+        if event.widget is self and not self.first_paint:
+            self.first_paint = True
+            self.logger.info("time to first paint: %.0f ms" % ((time.perf_counter() - self.startTime) * 1000))
+            StartupProfiler.record("first paint", self.startTime, time.perf_counter())
+
+    def event_snapshot_loaded(self, future):
+        if not future.done():
+            self.after(LOAD_POLL_MS, self.event_snapshot_loaded, future)
+            return
+        try:
+            snapshot = future.result()
+        except Exception as e:
+            self.logger.error("could not load snapshot - %s" % e)
+            snapshot = None
+        if snapshot is None:
+            return
+        lists, self.snapshot_date = snapshot
+        for frame, name in ((self.scrollable_checkbox_frame1, "now"), (self.scrollable_checkbox_frame2, "days")):
+            # a list already loaded from the database is newer than the snapshot
+            if frame not in self.loaded:
+                self.loaded[frame] = "snapshot"
+                self.event_fill_users(frame, [r.label for r in lists.get(name, [])], 0, time.perf_counter(), "snapshot")
+        if self.loading:
+            self.label_loading.configure(text="Users of %s, refreshing..." % self.snapshot_date)
+
+    def event_users_loaded(self, future, frame):
+        # Tk is not thread safe, so the worker result is picked up from the event loop
+        if not future.done():
+            self.after(LOAD_POLL_MS, self.event_users_loaded, future, frame)
+            return
+        try:
+            items = future.result()
+        except Exception as e:
+            self.logger.error("could not load user list - %s" % e)
+            items = None
+        if items is None:
+            # database unreachable, a list shown from the snapshot stays as it is
+            self.load_failed = True
+            self.event_users_done()
+            return
+        if frame in self.loaded:
+            # only the difference to the list shown is applied, add_items skips the users already shown
+            current = set(items)
+            frame.remove_items([item for item in frame.items if item not in current])
+        self.loaded[frame] = "live"
+        self.event_fill_users(frame, items, 0, time.perf_counter(), "live")
+
+    def event_fill_users(self, frame, items, start, fillStart, source):
+        if source == "snapshot" and self.loaded.get(frame) != "snapshot":
+            return
+        with Metrics.timer("ui_seconds", "fill batch"):
+            frame.add_items(items[start:start + FILL_BATCH_SIZE])
+        if start + FILL_BATCH_SIZE < len(items):
+            self.after(1, self.event_fill_users, frame, items, start + FILL_BATCH_SIZE, fillStart, source)
+            return
+        StartupProfiler.record("fill %s users from %s" % (len(items), source), fillStart, time.perf_counter())
+        if source == "live":
+            self.event_users_done()
+
+    def event_users_done(self):
+        self.loading -= 1
+        if self.loading > 0:
+            return
+        if self.load_failed:
+            if self.snapshot_date:
+                self.label_loading.configure(text="Offline, users of %s" % self.snapshot_date)
+            else:
+                self.label_loading.configure(text="Offline, no users available")
+        else:
+            self.label_loading.configure(text="")
+            self.executor.submit(self.notifier.saveSnapshot)
+        # the search index is built once in the background, the lists only get incremental updates afterwards
+        items = self.scrollable_checkbox_frame1.items + self.scrollable_checkbox_frame2.items
+        future_index = self.executor.submit(lambda: self.notifier.indexUsers(self.notifier.directory.fromLabels(items)))
+        self.after(LOAD_POLL_MS, self.event_users_indexed, future_index)
+        self.logger.info("user lists filled after %.0f ms" % ((time.perf_counter() - self.startTime) * 1000))
+        StartupProfiler.report()
+        if not self.refresh_scheduled:
+            self.refresh_scheduled = True
+            self.schedule_refresh_users()
+
+    def schedule_refresh_users(self):
+        if self.notifier.refreshInterval > 0:
+            self.after(int(self.notifier.refreshInterval * 1000), self.event_refresh_users)
+
+    def event_refresh_users(self):
+        future = self.executor.submit(self.notifier.refreshUsersNow)
+        self.after(LOAD_POLL_MS, self.event_users_refreshed, future)
+
+    def event_users_refreshed(self, future):
+        # only the changed rows are added to or removed from the list, checked state of the others is kept
+        if not future.done():
+            self.after(LOAD_POLL_MS, self.event_users_refreshed, future)
+            return
+        try:
+            delta = future.result()
+        except Exception as e:
+            self.logger.error("could not refresh active users - %s" % e)
+            delta = None
+        if delta is not None:
+            added, expired = delta
+            with Metrics.timer("ui_seconds", "apply refresh"):
+                if expired:
+                    self.scrollable_checkbox_frame1.remove_items([r.label for r in expired])
+                if added:
+                    self.scrollable_checkbox_frame1.add_items([r.label for r in added])
+            if added and self.entry_search.get().strip():
+                self.event_search()
+        self.schedule_refresh_users()
+
+    def event_users_indexed(self, future):
+        if not future.done():
+            self.after(LOAD_POLL_MS, self.event_users_indexed, future)
+            return
+        try:
+            future.result()
+        except Exception as e:
+            self.logger.error("could not index users - %s" % e)
+        # a query typed while the index was built is answered now
+        if self.entry_search.get().strip():
+            self.event_search()
+
+    def event_search_typed(self, event):
+        if self.search_after is not None:
+            self.after_cancel(self.search_after)
+        self.search_after = self.after(SEARCH_DEBOUNCE_MS, self.event_search)
+
+    def event_search(self):
+        self.search_after = None
+        query = self.entry_search.get()
+        with Metrics.timer("ui_seconds", "search"):
+            matches = self.notifier.searchIndex.search(query)
+            self.scrollable_checkbox_frame1.set_filter(matches, self.notifier.searchIndex)
+            self.scrollable_checkbox_frame2.set_filter(matches, self.notifier.searchIndex)
+        if matches is None:
+            self.label_matches.configure(text="")
+            self.checkbox_selectall.configure(text="Select All")
+        else:
+            self.label_matches.configure(text="%s active now, %s last 90 days" % (self.scrollable_checkbox_frame1.row_count(), self.scrollable_checkbox_frame2.row_count()))
+            self.checkbox_selectall.configure(text="Select all matching")
+
+    def event_change_appearance_mode(self, new_appearance_mode: str):
+        ctk.set_appearance_mode(new_appearance_mode)
+    
+    def event_change_scaling(self, new_scaling: str):
+        new_scaling_float = int(new_scaling.replace("%", "")) / 100
+        ctk.set_widget_scaling(new_scaling_float)
+    
+    def event_radiobutton(self):
+        if self.radio_var.get() == 0:
+            self.scrollable_checkbox_frame2.changestate(0)
+            self.scrollable_checkbox_frame1.changestate(1)
+        else:
+            self.scrollable_checkbox_frame1.changestate(0)
+            self.scrollable_checkbox_frame2.changestate(1)
+            
+    def event_selectall(self):
+        if self.radio_var.get() == 0:
+            if self.checkbox_selectall.get() == 0:
+                self.scrollable_checkbox_frame1.changeselectall(0)
+            else:
+                self.scrollable_checkbox_frame1.changeselectall(1)
+        else:
+            if self.checkbox_selectall.get() == 0:
+                self.scrollable_checkbox_frame2.changeselectall(0)
+            else:
+                self.scrollable_checkbox_frame2.changeselectall(1)
+    
+    def event_change_level(self, new_level: str):
+        if new_level == "1":
+            self.label_level2.configure(text="Users will receive an email notification, new system notification will be created without showing pop-up.")
+        elif new_level == "2":
+            self.label_level2.configure(text="Users will receive an email notification + pop-up message on their screen.")
+        elif new_level == "3":
+            self.label_level2.configure(text="Users will receive an email notification + pop-up message on their screeen, and Application Edit Mode will be locked.")
+        else:
+            self.label_level2.configure(text="")
+    
+    def event_update_status(self):
+        # poll right away and from the base interval on, e.g. after our own raise/solve
+        if self.status_after is not None:
+            self.after_cancel(self.status_after)
+            self.status_after = None
+        self.status = None
+        self.status_interval = self.notifier.pollInterval
+        self.event_poll_status()
+
+    def poll_status(self):
+        status = self.notifier.getStatus()
+        # planned jobs run in their own lane and do not hold up a raise or solve from here
+        return self.outbox.pending("interactive"), self.notifier.offline, status
+
+    def event_poll_status(self):
+        self.status_after = None
+        if self.status_future is not None and not self.status_future.done():
+            # the running poll may predate a change, poll once more when it returns
+            self.status_stale = True
+            return
+        self.status_stale = False
+        self.status_future = self.executor.submit(self.poll_status)
+        self.after(LOAD_POLL_MS, self.event_status_polled, self.status_future)
+
+    def event_status_polled(self, future):
+        if not future.done():
+            self.after(LOAD_POLL_MS, self.event_status_polled, future)
+            return
+        try:
+            pending, offline, (actNot, usrNot) = future.result()
+        except Exception as e:
+            self.logger.error("could not poll notification status - %s" % e)
+            pending, offline, actNot, usrNot = None, None, None, None
+        if pending is not None:
+            status = (pending, offline, actNot, usrNot)
+            if status != self.status:
+                # changes made here or by other operators, poll at the base interval again
+                self.status = status
+                self.status_interval = self.notifier.pollInterval
+                self.label_status2.configure(text=self.apply_status(pending, offline, actNot, usrNot))
+            else:
+                self.status_interval = min(self.status_interval * 2, self.notifier.maxPollInterval)
+            if not offline and self.load_failed and not self.loading:
+                # the database is back, reconcile the lists shown from the snapshot
+                self.start_users_load()
+        if self.status_stale:
+            self.event_poll_status()
+        else:
+            self.status_after = self.after(int(self.status_interval * 1000), self.event_poll_status)
+
+    def apply_status(self, pending, offline, actNot, usrNot):
+        if offline:
+            # read-only until the database can be reached again
+            self.button_start.configure(state="disabled")
+            self.button_stop.configure(state="disabled")
+            self.combobox_level.configure(state="disabled")
+            return "Offline, the database cannot be reached."
+        if pending > 0:
+            # nothing new can be raised or solved until the outbox is drained
+            self.button_start.configure(state="disabled")
+            self.button_stop.configure(state="disabled")
+            self.combobox_level.configure(state="disabled")
+            return "Delivering %s notification(s) in the background..." % pending
+        if actNot > 0:
+            self.button_start.configure(state="disabled")
+            self.button_stop.configure(state="normal")
+            self.combobox_level.configure(state="disabled")
+            self.optionemenu_std_texts.configure(values=["None", "Solve"])
+            self.usrNot = usrNot
+            return "There is/are " + str(actNot) + " activated notifications. Click Stop before starting a new one!"
+        else:
+            self.button_start.configure(state="normal")
+            self.button_stop.configure(state="disabled")
+            self.combobox_level.configure(state="normal")
+            self.optionemenu_std_texts.configure(values=["None"] + [c.capitalize() for c in self.templates.categories() if c != "solve"])
+            return "No active notifications!"
+    
+    def event_button_start(self):
+        if self.loading and not self.snapshot_date:
+            tk.messagebox.showinfo("Info", "The user lists are still loading, please wait a moment.")
+            return
+        level = self.combobox_level.get()
+        shortText = self.shorttext.get()
+        longText = self.longtext.get("0.0", "end")
+        if level and shortText and longText:
+            if self.radio_var.get() == 0:
+                users = self.directory.fromLabels(self.scrollable_checkbox_frame1.get_checked_items())
+            else:
+                users = self.directory.fromLabels(self.scrollable_checkbox_frame2.get_checked_items())
+            if users:
+                blnConfirm = 1
+            else:
+                blnConfirm = tk.messagebox.askyesno("Question", "No user has been chosen in the selection tab.\nDo you still want to continue creating the notification?")
+
+            apps = self.selected_apps()
+            if apps is not None and not apps:
+                tk.messagebox.showinfo("Info", "You must choose at least one application.")
+            elif blnConfirm:
+                if self.entry_schedule_at.get().strip():
+                    if not self.schedule_raise(level, shortText, longText, users, apps):
+                        return
+                else:
+                    # delivery happens in the background, progress shows up in the status label
+                    self.notifier.enqueueRaise(level, shortText, longText, users, apps)
+                self.combobox_level.set("")
+                self.label_level2.configure(text="")
+                self.optionemenu_std_texts.set("None")
+                self.shorttext.delete(0,len(self.shorttext.get()))
+                self.longtext.delete(0.0, tk.END)    
+                self.event_update_status()
+            else:
+                self.tabview.set("User Selection")  # change focus to User Selection tab
+        else:
+            tk.messagebox.showinfo("Info", "You must choose a level and write the title and description to start a notification.")
+            
+    def schedule_raise(self, level, shortText, longText, users, apps):
+        # plans reminder, raise and, with a duration, the solve; returns False if the schedule entries are invalid
+        try:
+            at = datetime.datetime.fromisoformat(self.entry_schedule_at.get().strip()).timestamp()
+            duration = float(self.entry_schedule_duration.get().strip() or 0) * 60
+        except ValueError:
+            tk.messagebox.showinfo("Info", "Enter the raise time as YYYY-MM-DD HH:MM and the duration in minutes.")
+            return False
+        if at <= time.time():
+            tk.messagebox.showinfo("Info", "The raise time has to be in the future.")
+            return False
+        solveTexts = None
+        if duration:
+            solveTexts = ("Solved: " + shortText, "".join(line + "\n" for line in self.templates.getMessage("solve")) or longText)
+        plan = self.notifier.scheduleNotification(level, shortText, longText, users, at, duration or None, solveTexts, apps=apps)
+        steps = ["%s  %s" % (time.strftime("%Y-%m-%d %H:%M", time.localtime(entry.due)), entry.kind) for entry in self.scheduler.entries() if entry.plan == plan]
+        tk.messagebox.showinfo("Info", "Notification planned, this application or --headless scheduler has to be running at these times:\n" + "\n".join(steps))
+        self.entry_schedule_at.delete(0, tk.END)
+        self.entry_schedule_duration.delete(0, tk.END)
+        return True
+
+    def event_button_stop(self):
+        if self.loading and not self.snapshot_date:
+            tk.messagebox.showinfo("Info", "The user lists are still loading, please wait a moment.")
+            return
+        shortText = self.shorttext.get()
+        longText = self.longtext.get("0.0", "end")
+        if shortText and longText:
+            if self.radio_var.get() == 0:
+                users = self.directory.fromLabels(self.scrollable_checkbox_frame1.get_checked_items())
+            else:
+                users = self.directory.fromLabels(self.scrollable_checkbox_frame2.get_checked_items())
+
+            # the previously notified users are read from the databases in the background, the window stays responsive
+            self.button_stop.configure(state="disabled")
+            usrNot = self.usrNot
+            future = self.executor.submit(self.notifier.getNotifiedUsers, usrNot)
+            self.after(LOAD_POLL_MS, self.event_notified_loaded, future, shortText, longText, users, self.notifier.activeIDs(usrNot, self.selected_apps()))
+        else:
+            tk.messagebox.showinfo("Info", "You must write the title and description to stop a notification.")
+
+    def event_notified_loaded(self, future, shortText, longText, users, notificationIDs):
+        if not future.done():
+            self.after(LOAD_POLL_MS, self.event_notified_loaded, future, shortText, longText, users, notificationIDs)
+            return
+        try:
+            notified = future.result()
+        except Exception as e:
+            self.logger.error("could not load the notified users - %s" % e)
+            tk.messagebox.showerror(None, "Error loading the notified users, the notification was not solved.")
+            self.event_update_status()
+            return
+        diffUsers = UserDirectory.difference(users, notified)
+        if diffUsers:
+            if tk.messagebox.askyesno("Question", "There are new users who were not notified in the last notification.\nDo you want to include them in the solution notification?"):
+                notified.extend(diffUsers)
+
+        self.notifier.enqueueSolve(shortText, longText, notified, notificationIDs)
+        self.optionemenu_std_texts.set("None")
+        self.shorttext.delete(0,len(self.shorttext.get()))
+        self.longtext.delete(0.0, tk.END) 
+        self.event_update_status()
+
+    def selected_apps(self):
+        # None when there is only one application
+        if not self.app_vars:
+            return None
+        return [name for name, var in self.app_vars.items() if var.get()]
+
+    def event_change_std_texts(self, new_std_text: str):
+        self.shorttext.delete(0,len(self.shorttext.get()))
+        self.longtext.delete(0.0, tk.END)
+        if new_std_text == "None":
+            return
+        if new_std_text == "Solve":
+            self.shorttext.insert(0, "Solved: " + self.usrNot[2])
+        else:
+            self.shorttext.insert(0, self.templates.getShort(new_std_text))
+        for line in self.templates.getMessage(new_std_text):
+            self.longtext.insert(tk.CURRENT, line + "\n")
+
+    def event_button_help(self):
+        import webbrowser
+        webbrowser.open('XXXXXXXXXXX')  
+
+    def event_outbox_progress(self):
+        # outbox listeners run on the worker thread, their events are handled here on the Tk thread
+        while True:
+            try:
+                job, status, message = self.outbox_events.get_nowait()
+            except queue.Empty:
+                break
+            if job.lane != "interactive":
+                # planned jobs nobody started from this window, only the status is brought up to date
+                if status in ("done", "failed"):
+                    self.event_update_status()
+                continue
+            if status == "running" and message:
+                self.label_status2.configure(text=message)
+            elif status == "pending":
+                self.label_status2.configure(text="Delivery failed, retrying: %s" % message)
+            elif status == "failed":
+                self.event_update_status()
+                tk.messagebox.showerror(None, message)
+            elif status == "done":
+                self.event_update_status()
+                tk.messagebox.showinfo("Info", self.describe_job(job))
+        self.after(OUTBOX_POLL_MS, self.event_outbox_progress)
+
+    def event_change_tab(self):
+        if self.tabview.get() == "History":
+            # the page shown is read again, it may have changed since
+            self.load_history(self.history_cursor)
+
+    def event_history_search(self):
+        self.history_pages = []
+        self.load_history(None)
+
+    def event_history_newer(self):
+        if self.history_pages:
+            self.load_history(self.history_pages.pop())
+
+    def event_history_older(self):
+        if self.history_next is not None:
+            self.history_pages.append(self.history_cursor)
+            self.load_history(self.history_next)
+
+    def load_history(self, cursor):
+        self.history_cursor = cursor
+        level = self.optionmenu_history_level.get()
+        self.button_history_newer.configure(state="disabled")
+        self.button_history_older.configure(state="disabled")
+        self.history_future = self.executor.submit(self.notifier.getHistory, HISTORY_PAGE_SIZE, cursor, None if level == "All" else level, self.entry_history_text.get().strip())
+        self.after(LOAD_POLL_MS, self.event_history_loaded, self.history_future)
+
+    def event_history_loaded(self, future):
+        if future is not self.history_future:
+            # a newer page was asked for meanwhile
+            return
+        if not future.done():
+            self.after(LOAD_POLL_MS, self.event_history_loaded, future)
+            return
+        try:
+            history = future.result()
+        except Exception as e:
+            self.logger.error("could not load the notification history - %s" % e)
+            history = None
+        if history is None:
+            self.history_next = None
+            text = "Error loading the notification history."
+        else:
+            rows, self.history_next = history
+            text = "Page %s\n\n%s" % (len(self.history_pages) + 1, "\n".join(formatRow(row) for row in rows) if rows else "No notifications found.")
+        self.history.configure(state="normal")
+        self.history.delete("0.0", tk.END)
+        self.history.insert("0.0", text)
+        self.history.configure(state="disabled")
+        self.button_history_newer.configure(state="normal" if self.history_pages else "disabled")
+        self.button_history_older.configure(state="normal" if self.history_next is not None else "disabled")
+
+    def event_update_diagnostics(self):
+        # how late this timer fires tells how long the event loop was blocked
+        now = time.perf_counter()
+        Metrics.observe("ui_loop_lag_seconds", "event loop", max(0.0, now - self.diagnostics_due))
+        if self.tabview.get() == "Diagnostics":
+            self.diagnostics.configure(state="normal")
+            self.diagnostics.delete("0.0", tk.END)
+            self.diagnostics.insert("0.0", Metrics.format())
+            self.diagnostics.configure(state="disabled")
+        self.diagnostics_due = time.perf_counter() + DIAGNOSTICS_POLL_MS / 1000
+        self.after(DIAGNOSTICS_POLL_MS, self.event_update_diagnostics)
+
+    def describe_job(self, job):
+        mail = job.state.get("mail")
+        if mail is None:
+            lines = ["Notification email did not need to be sent."]
+        else:
+            lines = ["Email notification successfully sent!"]
+        if job.kind == "raise":
+            lines.append("System notification successfully created!")
+        elif job.kind == "solve":
+            lines.append("Notifications successfully deactivated!")
+        return "\n".join(lines)
+
+    def on_closing(self):
+        question = "Do you want to quit?"
+        if self.outbox.pending() > 0:
+            question = "Some notifications are still being delivered, they will resume at the next start.\nDo you want to quit?"
+        elif self.scheduler.entries():
+            question = "Planned notifications are only sent while this application or --headless scheduler is running.\nDo you want to quit?"
+        if tk.messagebox.askokcancel("Quit", question):
+            self.scheduler.stop()
+            self.outbox.stop()
+            if self.notifier.publisher is not None:
+                self.notifier.publisher.flush()
+            self.executor.shutdown(wait=False)
+            self.destroy()
@@ -0,0 +1,19 @@
+from util.database import Database
+from util.popup import PopUp
+from util.presence import ActiveSessions
+
+
+class Application:
+    # one application database whose notifications are managed, with its own session tracking
+    def __init__(self, name, db, directory, window=360, publisher=None):
+        self.name = name
+        self.db = db
+        self.notify = PopUp(db, publisher, name)
+        self.sessions = ActiveSessions(db, directory, window, name)
+
+    @staticmethod
+    def fromConfig(config, directory, publisher=None):
+        # the "applications" list, or the single "database" block of older configs
+        window = config.get("activeUsers", {}).get("window", 360)
+        entries = config.get("applications") or [{"database": config["database"]}]
+        return [Application(entry.get("name") or entry["database"]["database"], Database.fromSettings(entry["database"]), directory, window, publisher) for entry in entries]
@@ -2,4 +2,4 @@ import os
 
 class BaseDir:
 	def get():
-		return os.path.realpath(__file__).replace("\\util\\basedir.py", "")
\ No newline at end of file
+		return os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
@@ -0,0 +1,358 @@
+import asyncio
+import http.client
+import json
+import queue
+import threading
+import time
+import uuid
+from collections import deque
+from urllib.parse import unquote, urlsplit
+from util.logger import Logger
+from util.metrics import Metrics
+
+# longest request head accepted from a client, anything larger is an abuse of the channel
+MAX_HEAD = 8192
+MAX_BODY = 16 * 1024 * 1024
+# answers a subscriber has not read yet, above this it has to catch up within writeTimeout or is dropped
+WRITE_BUFFER_LIMIT = 64 * 1024
+
+
+class BroadcastServer:
+    # long-poll broadcast of notification events over local HTTP.
+    #   POST /publish          appends an event, "recipients" (user GUIDs) stay on the server
+    #   GET  /events?since=N   answers the events after sequence number N, or waits up to timeout seconds for the next one;
+    #                          with &user=GUID every event carries "notified" for that user
+    #   GET  /stats            counters of the channel
+    # The last bufferSize events are kept, so a client that reconnects with its last sequence number misses nothing.
+    # If its position is gone (older than the buffer, or from before a restart, told apart by the epoch) the answer
+    # has "reset": true and the client reads the current state from the database once.
+    def __init__(self, host="127.0.0.1", port=8765, bufferSize=1000, maxSubscribers=10000, pollTimeout=25, writeTimeout=5, token=None):
+        self.logger = Logger.getLogger(type(self).__name__)
+        self.host = host
+        self.port = port
+        self.maxSubscribers = maxSubscribers
+        self.pollTimeout = pollTimeout
+        self.writeTimeout = writeTimeout
+        self.token = token or None
+        self.epoch = uuid.uuid4().hex[:12]
+        # (seq, event, recipients or None, encoded event)
+        self.events = deque(maxlen=bufferSize)
+        self.seq = 0
+        # futures of the subscribers waiting for the next event
+        self.waiters = []
+        # encoded answers keyed by position and, for subscribers with a user filter, by which events notify the user;
+        # thousands of subscribers woken by one event share a handful of answers. Valid until the next event.
+        self.answers = {}
+        self.waiting = 0
+        self.stats = {"published": 0, "answered": 0, "subscribers": 0, "rejected": 0, "slow": 0}
+        self.loop = None
+        self.server = None
+        self.thread = None
+        self.ready = threading.Event()
+
+    @staticmethod
+    def fromConfig(config):
+        broadcastConfig = config.get("broadcast", {})
+        return BroadcastServer(broadcastConfig.get("host", "127.0.0.1"), broadcastConfig.get("port", 8765), broadcastConfig.get("bufferSize", 1000),
+                               broadcastConfig.get("maxSubscribers", 10000), broadcastConfig.get("pollTimeout", 25), broadcastConfig.get("writeTimeout", 5),
+                               broadcastConfig.get("token"))
+
+    async def serve(self):
+        self.loop = asyncio.get_running_loop()
+        self.server = await asyncio.start_server(self.handle, self.host, self.port, backlog=4096, limit=MAX_HEAD)
+        self.port = self.server.sockets[0].getsockname()[1]
+        Metrics.addSource("broadcast", self.getStats)
+        self.logger.info("broadcasting on %s:%s, epoch %s" % (self.host, self.port, self.epoch))
+        self.ready.set()
+        try:
+            async with self.server:
+                await self.server.serve_forever()
+        except asyncio.CancelledError:
+            pass
+        finally:
+            Metrics.removeSource("broadcast")
+
+    def serveForever(self):
+        try:
+            asyncio.run(self.serve())
+        except KeyboardInterrupt:
+            pass
+
+    def start(self):
+        # runs the server on its own event loop thread, returns once it accepts connections
+        self.thread = threading.Thread(target=lambda: asyncio.run(self.serve()), name="Broadcast", daemon=True)
+        self.thread.start()
+        self.ready.wait(10)
+        return self
+
+    def stop(self):
+        if self.loop is not None and self.server is not None:
+            self.loop.call_soon_threadsafe(self.server.close)
+        if self.thread is not None:
+            self.thread.join(5)
+
+    def getStats(self):
+        return dict(self.stats, waiting=self.waiting, seq=self.seq, buffered=len(self.events))
+
+    def publish(self, event):
+        # thread-safe, for a server running in the publishing process
+        self.loop.call_soon_threadsafe(self.append, event)
+
+    def append(self, event):
+        event = dict(event)
+        recipients = event.pop("recipients", None)
+        self.seq += 1
+        event["seq"] = self.seq
+        event.setdefault("time", time.time())
+        self.events.append((self.seq, event, frozenset(recipients) if recipients is not None else None, json.dumps(event)))
+        self.stats["published"] += 1
+        self.answers = {}
+        waiters, self.waiters = self.waiters, []
+        for waiter in waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+        return self.seq
+
+    def after(self, since):
+        # (buffered events after since, reset) - reset when the position is no longer in the buffer
+        if since > self.seq or (since < self.seq and (not self.events or since < self.events[0][0] - 1)):
+            return list(self.events), True
+        return [self.events[i] for i in range(len(self.events) - (self.seq - since), len(self.events))], False
+
+    def answer(self, since, user):
+        events, reset = self.after(since)
+        notified = None if user is None else tuple(recipients is None or user in recipients for seq, event, recipients, encoded in events)
+        body = self.answers.get((since, notified))
+        if body is None:
+            if notified is None:
+                encoded = [encoded for seq, event, recipients, encoded in events]
+            else:
+                encoded = [event[3][:-1] + ', "notified": %s}' % ("true" if flag else "false") for event, flag in zip(events, notified)]
+            body = ('{"epoch": "%s", "next": %s, "reset": %s, "events": [%s]}' % (self.epoch, self.seq, "true" if reset else "false", ", ".join(encoded))).encode()
+            self.answers[(since, notified)] = body
+        return body
+
+    async def handle(self, reader, writer):
+        # one connection, kept alive for as many requests as the client sends
+        try:
+            while True:
+                try:
+                    head = await reader.readuntil(b"\r\n\r\n")
+                except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+                    return
+                lines = head.decode("latin-1").split("\r\n")
+                headers = {}
+                for line in lines[1:]:
+                    if ":" in line:
+                        name, value = line.split(":", 1)
+                        headers[name.strip().lower()] = value.strip()
+                try:
+                    method, target = lines[0].split(" ")[:2]
+                    length = int(headers.get("content-length", 0))
+                except ValueError:
+                    await self.respond(writer, 400, b'{"error": "bad request"}')
+                    return
+                if length > MAX_BODY:
+                    await self.respond(writer, 413, b'{"error": "too large"}')
+                    return
+                try:
+                    body = await reader.readexactly(length) if length else b""
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    return
+                path, _, query = target.partition("?")
+                query = dict(unquote(part).partition("=")[::2] for part in query.split("&") if part)
+                if method == "POST" and path == "/publish":
+                    status, response = self.handlePublish(headers, body)
+                elif method == "GET" and path == "/events":
+                    status, response = await self.handleEvents(query)
+                elif method == "GET" and path == "/stats":
+                    status, response = 200, json.dumps(self.getStats()).encode()
+                else:
+                    status, response = 404, b'{"error": "not found"}'
+                if not await self.respond(writer, status, response):
+                    return
+                if headers.get("connection", "").lower() == "close":
+                    return
+        except asyncio.CancelledError:
+            # the server is shutting down
+            pass
+        finally:
+            writer.close()
+
+    def handlePublish(self, headers, body):
+        if self.token is not None and headers.get("authorization") != "Bearer %s" % self.token:
+            return 403, b'{"error": "forbidden"}'
+        try:
+            event = json.loads(body)
+        except ValueError:
+            return 400, b'{"error": "invalid json"}'
+        return 200, ('{"seq": %s}' % self.append(event)).encode()
+
+    async def handleEvents(self, query):
+        try:
+            since = int(query["since"]) if "since" in query else None
+            timeout = min(float(query.get("timeout", self.pollTimeout)), self.pollTimeout)
+        except ValueError:
+            return 400, b'{"error": "invalid since or timeout"}'
+        user = query.get("user")
+        if since is None:
+            # first request of a client: its position is now, what happened before is in the database
+            return 200, self.answer(self.seq, user)
+        if query.get("epoch", self.epoch) != self.epoch:
+            # the server restarted since the client's last answer
+            since = self.seq + 1
+        if since == self.seq:
+            if self.waiting >= self.maxSubscribers:
+                self.stats["rejected"] += 1
+                return 503, b'{"error": "too many subscribers"}'
+            # a plain future and timer per poll, far cheaper than wait_for with thousands of subscribers
+            waiter = self.loop.create_future()
+            self.waiters.append(waiter)
+            timer = self.loop.call_later(timeout, lambda: waiter.done() or waiter.set_result(None))
+            self.waiting += 1
+            self.stats["subscribers"] = max(self.stats["subscribers"], self.waiting)
+            try:
+                await waiter
+            finally:
+                timer.cancel()
+                self.waiting -= 1
+        return 200, self.answer(since, user)
+
+    async def respond(self, writer, status, body):
+        # a subscriber that does not read its answer within writeTimeout is dropped, it resumes from its position when it reconnects
+        writer.write(b"HTTP/1.1 %d %s\r\nContent-Type: application/json\r\nContent-Length: %d\r\n\r\n" % (status, b"OK" if status == 200 else b"Error", len(body)) + body)
+        if writer.transport.get_write_buffer_size() > WRITE_BUFFER_LIMIT:
+            try:
+                await asyncio.wait_for(writer.drain(), self.writeTimeout)
+            except (asyncio.TimeoutError, ConnectionError):
+                self.stats["slow"] += 1
+                return False
+        self.stats["answered"] += 1
+        return True
+
+
+class BroadcastPublisher:
+    # sends events to the broadcast server from a background thread, so a database write never waits for the channel.
+    # The queue is bounded, when the server is unreachable for long the oldest events are dropped; clients resync then.
+    def __init__(self, url, token=None, timeout=5, queueSize=1000):
+        self.logger = Logger.getLogger(type(self).__name__)
+        parts = urlsplit(url)
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.token = token or None
+        self.timeout = timeout
+        self.queue = queue.Queue(maxsize=queueSize)
+        self.conn = None
+        self.worker = threading.Thread(target=self.run, name="BroadcastPublisher", daemon=True)
+        self.worker.start()
+
+    @staticmethod
+    def fromConfig(config):
+        broadcastConfig = config.get("broadcast", {})
+        if not broadcastConfig.get("enabled", False):
+            return None
+        return BroadcastPublisher(broadcastConfig.get("url", "http://127.0.0.1:8765"), broadcastConfig.get("token"))
+
+    def publish(self, event):
+        while True:
+            try:
+                self.queue.put_nowait(event)
+                return
+            except queue.Full:
+                try:
+                    self.queue.get_nowait()
+                    Metrics.count("broadcast_dropped", "publish")
+                except queue.Empty:
+                    pass
+
+    def flush(self, timeout=5):
+        # waits until the queued events are sent or given up on
+        deadline = time.monotonic() + timeout
+        while self.queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    def run(self):
+        while True:
+            event = self.queue.get()
+            try:
+                self.send(event)
+            finally:
+                self.queue.task_done()
+
+    def send(self, event):
+        body = json.dumps(event).encode()
+        headers = {"Content-Type": "application/json"}
+        if self.token:
+            headers["Authorization"] = "Bearer %s" % self.token
+        # one retry on a fresh connection, the kept-alive one may have been closed by the server
+        for attempt in range(2):
+            start = time.perf_counter()
+            try:
+                if self.conn is None:
+                    self.conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+                self.conn.request("POST", "/publish", body, headers)
+                response = self.conn.getresponse()
+                response.read()
+                Metrics.observe("broadcast_seconds", "publish", time.perf_counter() - start)
+                if response.status != 200:
+                    self.logger.error("broadcast server refused %s event with status %s" % (event.get("type"), response.status))
+                return
+            except (OSError, http.client.HTTPException) as e:
+                self.conn.close()
+                self.conn = None
+                if attempt:
+                    Metrics.count("broadcast_errors", "publish")
+                    self.logger.warning("could not publish %s event - %s" % (event.get("type"), e))
+
+
+class BroadcastClient:
+    # long-polls the broadcast server and remembers its position, so a reconnect resumes after the last event seen.
+    # user is the appGUID of the subscriber, events then say whether it was notified
+    def __init__(self, url, user=None, timeout=25):
+        parts = urlsplit(url)
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.user = user
+        self.timeout = timeout
+        self.since = None
+        self.epoch = None
+        self.conn = None
+
+    def poll(self):
+        # (events, reset) of one long poll; reset means events were missed and the state has to be read from the database
+        path = "/events?timeout=%s" % self.timeout
+        if self.since is not None:
+            path += "&since=%s&epoch=%s" % (self.since, self.epoch)
+        if self.user:
+            path += "&user=%s" % self.user
+        try:
+            if self.conn is None:
+                self.conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout + 10)
+            self.conn.request("GET", path)
+            response = self.conn.getresponse()
+            body = response.read()
+        except (OSError, http.client.HTTPException):
+            if self.conn is not None:
+                self.conn.close()
+            self.conn = None
+            raise
+        if response.status != 200:
+            raise ConnectionError("broadcast server answered %s" % response.status)
+        answer = json.loads(body)
+        self.since, self.epoch = answer["next"], answer["epoch"]
+        return answer["events"], answer["reset"]
+
+    def listen(self, callback, stop=None, maxBackoff=30):
+        # callback(events, reset) for every answer with events, reconnects with back-off until stop is set
+        stop = stop or threading.Event()
+        backoff = 0.5
+        while not stop.is_set():
+            try:
+                events, reset = self.poll()
+                backoff = 0.5
+            except (OSError, ValueError, http.client.HTTPException):
+                stop.wait(backoff)
+                backoff = min(maxBackoff, backoff * 2)
+                continue
+            if events or reset:
+                callback(events, reset)
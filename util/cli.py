@@ -0,0 +1,244 @@
+import argparse
+import datetime
+import json
+import time
+from util.history import HistoryCursor, formatRow
+from util.logger import Logger
+from util.notifier import Notifier
+from util.templates import TemplateRegistry
+
+AUDIENCES = ("active-now", "last-90-days", "none")
+
+
+def buildParser():
+    parser = argparse.ArgumentParser(prog="application.py CONFIG --headless", description="Raise or solve notifications without the user interface.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    parserRaise = commands.add_parser("raise", help="send the email and create the system notification")
+    parserRaise.add_argument("--level", required=True, choices=["1", "2", "3"])
+    parserRaise.add_argument("--template", help="standard text category, e.g. downtime")
+    parserRaise.add_argument("--title", help="overrides the template title")
+    parserRaise.add_argument("--description", help="overrides the template description")
+    parserRaise.add_argument("--audience", choices=AUDIENCES, default="active-now", help="users to notify (default: active-now)")
+    parserRaise.add_argument("--app", action="append", help="application to create the notification in, repeatable (default: all)")
+
+    parserSolve = commands.add_parser("solve", help="deactivate the active notification and email the notified users")
+    parserSolve.add_argument("--template", default="solve", help="standard text category (default: solve)")
+    parserSolve.add_argument("--title", help="overrides \"Solved: <notification title>\"")
+    parserSolve.add_argument("--description", help="overrides the template description")
+    parserSolve.add_argument("--audience", choices=AUDIENCES, default="none", help="users checked against the notified ones (default: none)")
+    parserSolve.add_argument("--include-new", action="store_true", help="also email audience users who were not notified")
+    parserSolve.add_argument("--app", action="append", help="application to solve the notification in, repeatable (default: all)")
+
+    commands.add_parser("status", help="show the active notification")
+
+    parserMigrate = commands.add_parser("migrate-recipients", help="move NotifiedUsers strings into the NotificationRecipients table")
+    parserMigrate.add_argument("--batch", type=int, default=100, help="notifications migrated per query (default: 100)")
+
+    parserHistory = commands.add_parser("history", help="list past notifications, newest first")
+    parserHistory.add_argument("--limit", type=int, default=20, help="notifications per page (default: 20)")
+    parserHistory.add_argument("--level", choices=["1", "2", "3"], help="only notifications of this level")
+    parserHistory.add_argument("--text", help="only notifications whose title contains this text")
+    parserHistory.add_argument("--app", action="append", help="application to list, repeatable (default: all)")
+    parserHistory.add_argument("--cursor", help="continue with the page after the one that printed this cursor")
+    parserHistory.add_argument("--json", action="store_true", help="print the page and the next cursor as JSON")
+
+    parserSchedule = commands.add_parser("schedule", help="plan a notification: reminder mail, raise and automatic solve")
+    parserSchedule.add_argument("--at", required=True, type=datetime.datetime.fromisoformat, help="local time of the raise, e.g. \"2026-11-02 22:00\"")
+    parserSchedule.add_argument("--duration", type=float, help="minutes after which the notification is solved automatically")
+    parserSchedule.add_argument("--remind", type=float, help="minutes before the raise the reminder mail goes out, 0 for none (default: schedule.remindBefore)")
+    parserSchedule.add_argument("--window", type=float, help="seconds every mail is spread over (default: schedule.window)")
+    parserSchedule.add_argument("--level", required=True, choices=["1", "2", "3"])
+    parserSchedule.add_argument("--template", help="standard text category, e.g. downtime")
+    parserSchedule.add_argument("--title", help="overrides the template title")
+    parserSchedule.add_argument("--description", help="overrides the template description")
+    parserSchedule.add_argument("--solve-template", default="solve", help="standard text category of the automatic solve (default: solve)")
+    parserSchedule.add_argument("--audience", choices=AUDIENCES, default="last-90-days", help="users to notify, resolved now (default: last-90-days)")
+    parserSchedule.add_argument("--app", action="append", help="application to create the notification in, repeatable (default: all)")
+
+    commands.add_parser("schedule-list", help="show the planned notifications")
+
+    parserUnschedule = commands.add_parser("schedule-cancel", help="cancel a planned notification")
+    parserUnschedule.add_argument("key", help="plan key printed by schedule, or the key of a single step")
+
+    commands.add_parser("scheduler", help="send planned notifications when due, runs until interrupted")
+
+    commands.add_parser("broadcast-server", help="serve raised and solved notifications to subscribers (see the broadcast block of the config)")
+    return parser
+
+
+def loadAudience(notifier, audience):
+    if audience == "active-now":
+        return notifier.loadUsersNow() or []
+    if audience == "last-90-days":
+        return notifier.loadUsers90Days() or []
+    return []
+
+
+def getDescription(args, templates):
+    if args.description:
+        return args.description
+    if args.template:
+        return "".join(line + "\n" for line in templates.getMessage(args.template))
+    return ""
+
+
+def printHistory(notifier, args):
+    try:
+        cursor = HistoryCursor.decode(args.cursor)
+    except ValueError as e:
+        print(e)
+        return 2
+    history = notifier.getHistory(args.limit, cursor, args.level, args.text, args.app)
+    if history is None:
+        print("Error loading the notification history.")
+        return 1
+    rows, nextCursor = history
+    token = HistoryCursor.encode(nextCursor)
+    if args.json:
+        print(json.dumps({"notifications": [{"application": row[0], "notificationID": row[1], "raised": str(row[2]), "changed": str(row[3]), "level": row[4],
+                                             "shortText": row[5], "active": bool(row[6]), "recipients": row[7]} for row in rows], "next": token}, indent=2))
+        return 0
+    if not rows:
+        print("No notifications found.")
+    for row in rows:
+        print(formatRow(row))
+    if token:
+        print("More: --cursor %s" % token)
+    return 0
+
+
+def formatTime(epoch):
+    return time.strftime("%Y-%m-%d %H:%M", time.localtime(epoch))
+
+
+def schedule(notifier, args, templates):
+    shortText = args.title or (templates.getShort(args.template) if args.template else "")
+    longText = getDescription(args, templates)
+    if not shortText or not longText:
+        print("A title and a description are needed, pass --template or --title and --description.")
+        return 2
+    at = args.at.timestamp()
+    if at <= time.time():
+        print("The raise time has to be in the future.")
+        return 2
+    solveTexts = None
+    if args.duration:
+        solveDescription = "".join(line + "\n" for line in templates.getMessage(args.solve_template)) or longText
+        solveTexts = ("Solved: " + shortText, solveDescription)
+    users = loadAudience(notifier, args.audience)
+    remindBefore = args.remind * 60 if args.remind is not None else None
+    scheduler = notifier.openScheduler()
+    key = notifier.scheduleNotification(args.level, shortText, longText, users, at, args.duration * 60 if args.duration else None, solveTexts, remindBefore, args.window, apps=args.app)
+    print("Planned %s for %s users:" % (key, len(users)))
+    for entry in scheduler.entries():
+        if entry.plan == key:
+            print("  %s  %s" % (formatTime(entry.due), entry.kind))
+    print("Run --headless scheduler (or keep the user interface open) to send it.")
+    return 0
+
+
+def listSchedule(notifier):
+    entries = notifier.openScheduler().entries()
+    if not entries:
+        print("No planned notifications.")
+    for entry in entries:
+        print("%s  %-6s  %5s users  %s  (plan %s)" % (formatTime(entry.due), entry.kind, len(entry.payload.get("adresses", [])), entry.payload.get("shortText"), entry.plan))
+    return 0
+
+
+def runScheduler(notifier):
+    notifier.startOutbox()
+    notifier.startScheduler()
+    print("Sending planned notifications, press Ctrl+C to stop.")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        notifier.scheduler.stop()
+        notifier.outbox.stop()
+    return 0
+
+
+def main(config, argv):
+    args = buildParser().parse_args(argv)
+    logger = Logger.getLogger("Headless")
+    if args.command == "broadcast-server":
+        # needs no database, runs until interrupted
+        from util.broadcast import BroadcastServer
+        BroadcastServer.fromConfig(config).serveForever()
+        return 0
+    templates = TemplateRegistry.shared()
+    notifier = Notifier(config)
+    if args.command == "history":
+        return printHistory(notifier, args)
+    if args.command == "schedule":
+        return schedule(notifier, args, templates)
+    if args.command == "schedule-list":
+        return listSchedule(notifier)
+    if args.command == "schedule-cancel":
+        cancelled = notifier.openScheduler().cancel(args.key)
+        print("%s planned step(s) cancelled." % cancelled if cancelled else "Nothing planned under %s." % args.key)
+        return 0 if cancelled else 1
+    if args.command == "scheduler":
+        return runScheduler(notifier)
+    actNot, usrNot = notifier.getStatus()
+    if notifier.offline and args.command in ("status", "raise", "solve"):
+        # no answer is not the same as no active notification, monitoring scripts must see the failure
+        print("Error checking the notification status, the database cannot be reached.")
+        return 1
+
+    if args.command == "status":
+        if actNot > 0:
+            print("%s active notification(s): %s (raised %s)" % (actNot, usrNot[2], usrNot[1]))
+        else:
+            print("No active notifications!")
+        return 0
+
+    if args.command == "migrate-recipients":
+        migrated = notifier.migrateRecipients(args.batch)
+        if migrated is None:
+            print("Error migrating the notification recipients.")
+            return 1
+        print("Recipients of %s notification(s) migrated." % migrated)
+        return 0
+
+    if args.command == "raise":
+        if actNot > 0:
+            print("There is already an active notification, solve it before raising a new one.")
+            return 1
+        shortText = args.title or (templates.getShort(args.template) if args.template else "")
+        longText = getDescription(args, templates)
+        if not shortText or not longText:
+            print("A title and a description are needed, pass --template or --title and --description.")
+            return 2
+        users = loadAudience(notifier, args.audience)
+        logger.info("headless raise of level %s notification for %s users" % (args.level, len(users)))
+        mailSent, created = notifier.raiseNotification(args.level, shortText, longText, users, apps=args.app)
+    else:
+        if actNot == 0:
+            print("No active notifications!")
+            return 1
+        shortText = args.title or "Solved: " + usrNot[2]
+        longText = getDescription(args, templates)
+        if not longText:
+            print("A description is needed, pass --template or --description.")
+            return 2
+        notified = notifier.getNotifiedUsers(usrNot)
+        if args.include_new:
+            notified.extend(notifier.directory.difference(loadAudience(notifier, args.audience), notified))
+        logger.info("headless solve for %s users" % len(notified))
+        mailSent, created = notifier.solveNotification(shortText, longText, notified, notifier.activeIDs(usrNot, args.app))
+    if notifier.publisher is not None:
+        # the process ends right after, give the queued events a moment to reach the broadcast server
+        notifier.publisher.flush()
+
+    if mailSent is None:
+        print("Notification email did not need to be sent.")
+    else:
+        print("Email notification successfully sent!" if mailSent else "Error sending email notification.")
+    if args.command == "raise":
+        print("System notification successfully created!" if created else "Error creating system notification.")
+    else:
+        print("Notifications successfully deactivated!" if created else "Error in desactivating the notifications.")
+    return 0 if created and mailSent is not False else 1
@@ -1,182 +1,261 @@
-import pyodbc
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 from util.logger import Logger
+from util.metrics import Metrics, SIZE_BUCKETS, returnedNone
+from util.pool import ConnectionPool
+from util.profiler import StartupProfiler
+
+# bound parameters per lookup statement, SQL Server accepts at most 2100 per statement
+CHUNK_SIZES = (1, 10, 50, 200, 1000)
+# recipient rows per executemany call
+RECIPIENT_BATCH_SIZE = 1000
 
 class Database:
-    def __init__(self, driver, host, database, owner):
+    def __init__(self, driver, host, database, owner, minPoolSize=1, maxPoolSize=5, idleTimeout=300, connector=None):
         self.logger = Logger.getLogger(type(self).__name__)
         self.driver = driver
         self.host = host
         self.database = database
         self.owner = owner
+        # connector lets a stand-in driver (e.g. sqlite3) replace pyodbc
+        self.pool = ConnectionPool.shared((driver, host, database), connector or self.connect, minSize=minPoolSize, maxSize=maxPoolSize, idleTimeout=idleTimeout)
+
+    @staticmethod
+    def fromConfig(config):
+        return Database.fromSettings(config["database"])
+
+    @staticmethod
+    def fromSettings(dbConfig):
+        # one "database" block of the config
+        return Database(dbConfig["driver"], dbConfig["host"], dbConfig["database"], dbConfig["owner"],
+                        minPoolSize=dbConfig.get("minPoolSize", 1), maxPoolSize=dbConfig.get("maxPoolSize", 5), idleTimeout=dbConfig.get("idleTimeout", 300))
 
     def connect(self):
-        try:
-            self.conn = pyodbc.connect('Driver={' + self.driver + '};Server=' + self.host + ';Database=' + self.database + ';Trusted_Connection=yes;')
-            cursor = self.conn.cursor()
-            cursor.execute('SELECT TOP(1) column FROM table_name')
-            # see if the cursor returned something
-            if cursor:
-                return True
-            self.logger.error("could not connect to database")
-            return False
-        except Exception as e:
-            self.logger.error("exception on database connection: %s" % e)
+        # pyodbc is only imported once a connection is really needed
+        with StartupProfiler.phase("import pyodbc"):
+            import pyodbc
+        with StartupProfiler.phase("db connect"):
+            return pyodbc.connect('Driver={' + self.driver + '};Server=' + self.host + ';Database=' + self.database + ';Trusted_Connection=yes;')
 
-    def getCurrentActiveUsers(self):
+    @Metrics.instrument("db", failed=returnedNone)
+    def getCurrentActiveUsers(self, since):
+        # sessions active at or after since (UTC), callers pass their last DateActive to get only the changes
         try:
-            if not hasattr(self,'conn'):
-                if self.connect() == False:
-                    return
-            selectStatement = "SELECT U.GID, U.Name, U.Vorname, U.Email FROM %s.User U INNER JOIN (SELECT * FROM %s.UserActiveSession WHERE DateActive > DateAdd(second,-360, getutcdate())) UAS ON U.appGUID = UAS.appGUID" % (self.owner, self.owner)
+            selectStatement = "SELECT U.GID, U.Name, U.Vorname, U.Email, U.appGUID, UAS.DateActive FROM %s.User U INNER JOIN %s.UserActiveSession UAS ON U.appGUID = UAS.appGUID WHERE UAS.DateActive >= ?" % (self.owner, self.owner)
             self.logger.debug(selectStatement)
-            cursor = self.conn.cursor()
-            cursor.execute(selectStatement)
-            results = [row for row in cursor.fetchall()]
-            return results
+            with self.pool.connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute(selectStatement, (since,))
+                results = [row for row in cursor.fetchall()]
+                return results
         except Exception as e:
-            self.conn.close()
-            delattr(self,'conn') 
             self.logger.error("could not select in database - %s" % e)
             self.logger.error("Query: %s" % selectStatement)
     
+    @Metrics.instrument("db", failed=returnedNone)
     def getActiveUsersLast90Days(self):
         try:
-            if not hasattr(self,'conn'):
-                if self.connect() == False:
-                    return
-            selectStatement = "SELECT U.Name, U.Vorname, U.Email FROM %s.LV_ActiveEmailsLast90Days lastUs LEFT JOIN %s.User U ON lastUs.Email = U.Email" % (self.owner, self.owner)
+            selectStatement = "SELECT U.Name, U.Vorname, U.Email, U.appGUID FROM %s.LV_ActiveEmailsLast90Days lastUs LEFT JOIN %s.User U ON lastUs.Email = U.Email" % (self.owner, self.owner)
             self.logger.debug(selectStatement)
-            cursor = self.conn.cursor()
-            cursor.execute(selectStatement)
-            results = [row for row in cursor.fetchall()]
-            return results
+            with self.pool.connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute(selectStatement)
+                results = [row for row in cursor.fetchall()]
+                return results
         except Exception as e:
-            self.conn.close()
-            delattr(self,'conn') 
             self.logger.error("could not select in database - %s" % e)
             self.logger.error("Query: %s" % selectStatement)
 
+    @Metrics.instrument("db")
     def getUserCode(self, userGID, userEmail):
         try:
-            if not hasattr(self,'conn'):
-                if self.connect() == False:
-                    return
             selectStatement = "SELECT appGUID FROM %s.User WHERE GID = '%s' OR Email = '%s'" % (self.owner, userGID, userEmail) 
             self.logger.debug(selectStatement)
-            cursor = self.conn.cursor()
-            cursor.execute(selectStatement)
-            return cursor.fetchone()[0]
+            with self.pool.connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute(selectStatement)
+                return cursor.fetchone()[0]
         except Exception as e:
-            self.conn.close()
-            delattr(self,'conn') 
             self.logger.error("could not select in database - %s" % e)
             self.logger.error("Query: %s" % selectStatement)
     
+    @Metrics.instrument("db", failed=returnedNone)
     def getUserIDs(self, adresses):
+        # {email: appGUID}, None if the query failed
+        selectStatement = "SELECT Email, appGUID FROM %s.User WHERE Email IN (%%s)" % (self.owner)
+        return self.bulkLookup(selectStatement, adresses)
+
+    @Metrics.instrument("db", failed=returnedNone)
+    def getNotificationStatus(self):
+        # number of active notifications and the newest active row in one round trip, (0, None) if there is none
         try:
-            if not hasattr(self,'conn'):
-                if self.connect() == False:
-                    return
-            for i in range(len(adresses)):
-                if i == 0:
-                    inStatement = "'" + adresses[i] + "'"
-                else:
-                    inStatement += ',' + "'" + adresses[i] + "'"
-            selectStatement = "SELECT appGUID FROM %s.User WHERE Email IN (" % (self.owner) + inStatement + ")"
+            selectStatement = "SELECT COUNT(*) OVER (), appGUID, DateNew, ShortText, NotifiedUsers FROM %s.Notifications WHERE Active = 1 ORDER BY DateNew DESC" % (self.owner)
             self.logger.debug(selectStatement)
-            cursor = self.conn.cursor()
-            cursor.execute(selectStatement)
-            results = [row for row in cursor.fetchall()]
-            return (results)
+            with self.pool.connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute(selectStatement)
+                row = cursor.fetchone()
+                if row is None:
+                    return 0, None
+                return row[0], tuple(row[1:])
         except Exception as e:
-            self.conn.close()
-            delattr(self,'conn') 
             self.logger.error("could not select in database - %s" % e)
             self.logger.error("Query: %s" % selectStatement)
 
-    def getActiveNotifications(self):
+    @Metrics.instrument("db", failed=returnedNone)
+    def getNotifiedUsersEmails(self, usersIDs):
+        # {appGUID: email}, None if the query failed
+        selectStatement = "SELECT appGUID, Email FROM %s.User WHERE appGUID IN (%%s)" % (self.owner)
+        return self.bulkLookup(selectStatement, usersIDs)
+
+    def bulkLookup(self, selectStatement, values):
         try:
-            if not hasattr(self,'conn'):
-                if self.connect() == False:
-                    return
-            selectStatement = "SELECT COUNT(appGUID) FROM %s.Notifications WHERE Active = 1" % (self.owner)
-            self.logger.debug(selectStatement)
-            cursor = self.conn.cursor()
-            cursor.execute(selectStatement)
-            return cursor.fetchone()[0]
+            values = list(dict.fromkeys(v for v in values if v))
+            chunks = [values[i:i + CHUNK_SIZES[-1]] for i in range(0, len(values), CHUNK_SIZES[-1])]
+            self.logger.debug("%s [%s values in %s chunks]" % (selectStatement, len(values), len(chunks)))
+            if len(chunks) <= 1:
+                results = [self.lookupChunk(selectStatement, chunk) for chunk in chunks]
+            else:
+                with ThreadPoolExecutor(max_workers=min(len(chunks), self.pool.maxSize)) as executor:
+                    results = list(executor.map(lambda chunk: self.lookupChunk(selectStatement, chunk), chunks))
+            merged = {}
+            for rows in results:
+                merged.update((row[0], row[1]) for row in rows)
+            return merged
         except Exception as e:
-            self.conn.close()
-            delattr(self,'conn') 
+            # None, unlike an empty dict, tells the caller the values could not be looked up
             self.logger.error("could not select in database - %s" % e)
             self.logger.error("Query: %s" % selectStatement)
 
-    def getNotifiedUsers(self):
+    @Metrics.instrument("db")
+    def lookupChunk(self, selectStatement, chunk):
+        # pad up to a fixed chunk size by repeating the last value, so only a handful of statement shapes reach the plan cache
+        size = next(s for s in CHUNK_SIZES if s >= len(chunk))
+        params = chunk + [chunk[-1]] * (size - len(chunk))
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(selectStatement % ",".join("?" * size), params)
+            return cursor.fetchall()
+
+    @Metrics.instrument("db", failed=returnedNone)
+    def addNotification(self, user, level, shortText, longText, active, readAccess, writeAccess, usersIDs, notificationID=None):
+        # a given notificationID makes the insert idempotent, replaying it does not create a second row
+        try:
+            if notificationID is None:
+                notificationID = str(uuid.uuid4()).upper()
+            insertStatement = "INSERT INTO %s.Notifications(appGUID, DateNew, DateChanged, ReadAccess, UserNew, UserChanged, WriteAccess, Level, ShortText, LongText, Active) SELECT ?, GETDATE(), GETDATE(), ?, ?, ?, ?, ?, ?, ?, ? WHERE NOT EXISTS (SELECT 1 FROM %s.Notifications WHERE appGUID = ?)" % (self.owner, self.owner)
+            self.logger.debug(insertStatement)
+            with self.pool.connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute(insertStatement, (notificationID, readAccess, user, user, writeAccess, level, shortText, longText, active, notificationID))
+                self.insertRecipients(cursor, notificationID, usersIDs)
+                conn.commit()
+                return True
+        except Exception as e:
+            self.logger.error("could not insert in database - %s" % e)
+            self.logger.error("Query: %s" % insertStatement)
+
+    @Metrics.instrument("db", failed=returnedNone)
+    def uptNotification(self, usersIDs, notificationID):
+        # deactivates exactly the given notification, a seek on appGUID instead of touching every active row
         try:
-            if not hasattr(self,'conn'):
-                if self.connect() == False:
-                    return
-            selectStatement = "SELECT appGUID, DateNew, ShortText, NotifiedUsers FROM %s.Notifications WHERE Active = 1"  % (self.owner)
+            updateStatement = "UPDATE %s.Notifications SET Active = 0, DateChanged = GETDATE() WHERE appGUID = ? AND Active = 1" % (self.owner)
+            if notificationID is None:
+                raise ValueError("no notification to deactivate")
+            self.logger.debug(updateStatement)
+            with self.pool.connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute(updateStatement, (notificationID,))
+                self.insertRecipients(cursor, notificationID, usersIDs)
+                conn.commit()
+                return True
+        except Exception as e:
+            self.logger.error("could not update in database - %s" % e)
+            self.logger.error("Query: %s" % updateStatement)
+
+    def insertRecipients(self, cursor, notificationID, usersIDs):
+        # one row per recipient, already recorded recipients are skipped so a replay or the solve step only adds new ones
+        insertStatement = "INSERT INTO %s.NotificationRecipients(NotificationID, UserID) SELECT ?, ? WHERE NOT EXISTS (SELECT 1 FROM %s.NotificationRecipients WHERE NotificationID = ? AND UserID = ?)" % (self.owner, self.owner)
+        rows = [(notificationID, userID, notificationID, userID) for userID in dict.fromkeys(u for u in usersIDs if u)]
+        self.logger.debug("%s [%s rows]" % (insertStatement, len(rows)))
+        Metrics.observe("db_batch_rows", "insertRecipients", len(rows), SIZE_BUCKETS)
+        if hasattr(cursor, "fast_executemany"):
+            # pyodbc sends the parameter array in one round trip per batch
+            cursor.fast_executemany = True
+        for i in range(0, len(rows), RECIPIENT_BATCH_SIZE):
+            cursor.executemany(insertStatement, rows[i:i + RECIPIENT_BATCH_SIZE])
+
+    @Metrics.instrument("db", failed=returnedNone)
+    def getNotificationRecipients(self, notificationID):
+        # [(UserID, Email)], Email is None for users no longer in the User table
+        try:
+            selectStatement = "SELECT R.UserID, U.Email FROM %s.NotificationRecipients R LEFT JOIN %s.User U ON U.appGUID = R.UserID WHERE R.NotificationID = ?" % (self.owner, self.owner)
             self.logger.debug(selectStatement)
-            cursor = self.conn.cursor()
-            cursor.execute(selectStatement)
-            return cursor.fetchone()
+            with self.pool.connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute(selectStatement, (notificationID,))
+                return cursor.fetchall()
         except Exception as e:
-            self.conn.close()
-            delattr(self,'conn') 
             self.logger.error("could not select in database - %s" % e)
             self.logger.error("Query: %s" % selectStatement)
 
-    def getNotifiedUsersEmails(self, usersIDs):
+    @Metrics.instrument("db", failed=returnedNone)
+    def getNotificationHistory(self, limit, after=None, level=None, text=None):
+        # one page of notifications, newest first, as [(appGUID, DateNew, DateChanged, Level, ShortText, Active, Recipients)].
+        # after is (DateNew, appGUID) of the last row already shown: the page is read from that key on along
+        # IX_Notifications_DateNew (see sql/notification_history.sql), so it costs the same on the first page and the thousandth
         try:
-            if not hasattr(self,'conn'):
-                if self.connect() == False:
-                    return
-            for i in range(len(usersIDs)):
-                if i == 0:
-                    inStatement = "'" + usersIDs[i] + "'"
-                else:
-                    inStatement += ',' + "'" + usersIDs[i] + "'"
-            selectStatement = "SELECT Email FROM %s.User WHERE appGUID IN (" % (self.owner) + inStatement + ")"
+            conditions = []
+            params = [limit]
+            if after is not None:
+                # the parameter is cast back to datetime, compared as datetime2 it would not match the row it was read from.
+                # The redundant DateNew <= ? turns the condition into a seek, the OR alone makes the index be read from the top
+                conditions.append("N.DateNew <= CAST(? AS datetime) AND (N.DateNew < CAST(? AS datetime) OR (N.DateNew = CAST(? AS datetime) AND N.appGUID < ?))")
+                params.extend([after[0], after[0], after[0], after[1]])
+            if level is not None:
+                conditions.append("N.Level = ?")
+                params.append(level)
+            if text:
+                conditions.append("N.ShortText LIKE ? ESCAPE '\\'")
+                params.append("%%%s%%" % "".join("\\" + c if c in "\\%_[" else c for c in text))
+            # unmigrated notifications still count the NotifiedUsers string, the others their NotificationRecipients rows
+            selectStatement = ("SELECT TOP (?) N.appGUID, N.DateNew, N.DateChanged, N.Level, N.ShortText, N.Active, "
+                               "CASE WHEN N.NotifiedUsers IS NULL OR N.NotifiedUsers = '' THEN (SELECT COUNT(*) FROM %s.NotificationRecipients R WHERE R.NotificationID = N.appGUID) "
+                               "ELSE LEN(N.NotifiedUsers) - LEN(REPLACE(N.NotifiedUsers, ',', '')) + 1 END "
+                               "FROM %s.Notifications N%s ORDER BY N.DateNew DESC, N.appGUID DESC") % (self.owner, self.owner, "".join((" AND " if i else " WHERE ") + c for i, c in enumerate(conditions)))
             self.logger.debug(selectStatement)
-            cursor = self.conn.cursor()
-            cursor.execute(selectStatement)
-            results = [row for row in cursor.fetchall()]
-            return (results)
+            with self.pool.connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute(selectStatement, params)
+                return cursor.fetchall()
         except Exception as e:
-            self.conn.close()
-            delattr(self,'conn') 
             self.logger.error("could not select in database - %s" % e)
             self.logger.error("Query: %s" % selectStatement)
 
-    def addNotification(self, user, level, shortText, longText, active, readAccess, writeAccess, notifiedUsers):
+    @Metrics.instrument("db", failed=returnedNone)
+    def getUnmigratedNotifications(self, limit):
+        # notifications whose NotifiedUsers string has not been copied to NotificationRecipients yet
         try:
-            if not hasattr(self,'conn'):
-                if self.connect() == False:
-                    return
-            insertStatement = "INSERT INTO %s.Notifications(appGUID, DateNew, DateChanged, ReadAccess, UserNew, UserChanged, WriteAccess, Level, ShortText, LongText, Active, NotifiedUsers) VALUES(NEWID(), GETDATE(), GETDATE(), %s, %s, %s, %s, %s, '%s', '%s', %s, '%s')" % (self.owner, readAccess, user, user, writeAccess, level, shortText, longText, active, notifiedUsers)
-            cursor = self.conn.cursor()
-            cursor.execute(insertStatement)
-            self.conn.commit()
-            return True
+            selectStatement = "SELECT appGUID, NotifiedUsers FROM %s.Notifications WHERE NotifiedUsers IS NOT NULL AND NotifiedUsers <> '' ORDER BY DateNew" % (self.owner)
+            self.logger.debug(selectStatement)
+            with self.pool.connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute(selectStatement)
+                return cursor.fetchmany(limit)
         except Exception as e:
-            self.conn.close()
-            delattr(self,'conn') 
-            self.logger.error("could not insert in database - %s" % e)
-            self.logger.error("Query: %s" % insertStatement)
+            self.logger.error("could not select in database - %s" % e)
+            self.logger.error("Query: %s" % selectStatement)
 
-    def uptNotification(self, notifiedUsers):
+    @Metrics.instrument("db", failed=returnedNone)
+    def migrateRecipients(self, notificationID, usersIDs):
+        # the NotifiedUsers string is cleared in the same transaction, so a migrated notification is not picked up again
         try:
-            if not hasattr(self,'conn'):
-                if self.connect() == False:
-                    return
-            updateStatement = "UPDATE %s.Notifications SET Active = 0, DateChanged = GETDATE(), NotifiedUsers = '%s' WHERE Active = 1" % (self.owner, notifiedUsers)
-            self.logger.debug(updateStatement)
-            cursor = self.conn.cursor()
-            cursor.execute(updateStatement)
-            self.conn.commit()
-            return True
+            updateStatement = "UPDATE %s.Notifications SET NotifiedUsers = NULL WHERE appGUID = ?" % (self.owner)
+            with self.pool.connection() as conn:
+                cursor = conn.cursor()
+                self.insertRecipients(cursor, notificationID, usersIDs)
+                cursor.execute(updateStatement, (notificationID,))
+                conn.commit()
+                return True
         except Exception as e:
-            self.conn.close()
-            delattr(self,'conn') 
-            self.logger.error("could not update in database - %s" % e)
-            self.logger.error("Query: %s" % updateStatement) 
\ No newline at end of file
+            self.logger.error("could not migrate recipients - %s" % e)
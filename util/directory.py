@@ -0,0 +1,102 @@
+import threading
+
+
+class UserRecord:
+    __slots__ = ("guid", "guids", "name", "firstName", "email", "label")
+
+    def __init__(self, guid, name, firstName, email):
+        self.guid = guid
+        # appGUID per application, the same person has a different one in every application database
+        self.guids = {}
+        self.email = email
+        self.rename(name, firstName)
+
+    def rename(self, name, firstName):
+        self.name = name
+        self.firstName = firstName
+        self.label = "%s, %s <%s>" % (name, firstName, self.email)
+
+
+class UserDirectory:
+    # users of all applications, one record per normalized email, also indexed by appGUID and list label
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.byEmail = {}
+        self.byGuid = {}
+        self.byLabel = {}
+
+    @staticmethod
+    def normalize(email):
+        return email.strip().lower()
+
+    def __len__(self):
+        return len(self.byEmail)
+
+    def add(self, guid, name, firstName, email, app=None):
+        key = self.normalize(email)
+        with self.lock:
+            record = self.byEmail.get(key)
+            if record is None:
+                record = UserRecord(guid, name, firstName, email)
+                self.byEmail[key] = record
+                self.byLabel[record.label] = record
+            else:
+                if record.guid is None and guid is not None:
+                    record.guid = guid
+                if record.name is None and record.firstName is None and (name is not None or firstName is not None):
+                    # created without names from a recipient row, e.g. by getNotifiedUsers, the user lists bring them later
+                    if self.byLabel.get(record.label) is record:
+                        del self.byLabel[record.label]
+                    record.rename(name, firstName)
+                    self.byLabel[record.label] = record
+            if guid is not None:
+                record.guids.setdefault(app, guid)
+                self.byGuid[guid] = record
+            return record
+
+    def load(self, users, app=None):
+        # users as (guid, name, firstName, email) rows of one application, returns one record per email in first seen order
+        seen = set()
+        records = []
+        for guid, name, firstName, email in users:
+            if email is None:
+                continue
+            key = self.normalize(email)
+            if key in seen:
+                continue
+            seen.add(key)
+            records.append(self.add(guid, name, firstName, email, app))
+        return records
+
+    def get(self, email):
+        return self.byEmail.get(self.normalize(email))
+
+    def fromLabels(self, labels):
+        return [self.byLabel[label] for label in labels if label in self.byLabel]
+
+    def fromGuids(self, guids):
+        # returns the known records and the guids missing from the directory
+        records = []
+        missing = []
+        for guid in dict.fromkeys(g for g in guids if g):
+            record = self.byGuid.get(guid)
+            if record is None:
+                missing.append(guid)
+            else:
+                records.append(record)
+        return records, missing
+
+    @staticmethod
+    def guidsFor(records, app):
+        return [r.guids[app] for r in records if app in r.guids]
+
+    @staticmethod
+    def merge(lists):
+        # records of several lists without duplicates, in first seen order
+        return list({id(r): r for records in lists for r in records}.values())
+
+    @staticmethod
+    def difference(records, others):
+        # records not contained in others, compared by normalized email
+        keys = {UserDirectory.normalize(r.email) for r in others}
+        return [r for r in records if UserDirectory.normalize(r.email) not in keys]
@@ -0,0 +1,37 @@
+import base64
+import datetime
+import json
+
+
+def formatRow(row):
+    # one line of a history page as shown by the History tab and --headless history
+    return "%s  %-8s  level %s  %-6s  %5s users  %s" % (str(row[2])[:19], row[0], row[4], "active" if row[6] else "solved", row[7], row[5])
+
+
+class HistoryCursor:
+    # position of a history page as {application name: (DateNew, appGUID) of the last row shown from it},
+    # passed around outside the process as an opaque url-safe token
+    @staticmethod
+    def encode(cursor):
+        if not cursor:
+            return None
+        positions = {name: [dateNew.isoformat() if isinstance(dateNew, datetime.datetime) else dateNew, guid] for name, (dateNew, guid) in cursor.items()}
+        return base64.urlsafe_b64encode(json.dumps(positions, separators=(",", ":")).encode()).decode().rstrip("=")
+
+    @staticmethod
+    def decode(token):
+        # raises ValueError for a token that was not made by encode
+        if not token:
+            return None
+        try:
+            positions = json.loads(base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)))
+            return {name: (HistoryCursor.parseDate(dateNew), guid) for name, (dateNew, guid) in positions.items()}
+        except (TypeError, ValueError) as e:
+            raise ValueError("invalid history cursor - %s" % e)
+
+    @staticmethod
+    def parseDate(value):
+        try:
+            return datetime.datetime.fromisoformat(value)
+        except ValueError:
+            return value
@@ -1,28 +1,132 @@
-import logging, os
-from datetime import datetime
+import logging, os, queue, re, time, atexit, threading
+import logging.handlers
 from util.basedir import BaseDir
 
 FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-logging.basicConfig(format=FORMAT, level="DEBUG")
+DEFAULTS = {
+    "level": "INFO",
+    "levels": {},
+    "rotation": "date",
+    "maxBytes": 10 * 1024 * 1024,
+    "backupCount": 30,
+    "maxMessageLength": 2000
+}
+
+
+class TruncatingQueueHandler(logging.handlers.QueueHandler):
+    # runs on the calling thread, so it only formats and cuts the message, the listener thread does the I/O
+    def __init__(self, logQueue, maxMessageLength):
+        super().__init__(logQueue)
+        self.maxMessageLength = maxMessageLength
+
+    def prepare(self, record):
+        record = super().prepare(record)
+        if self.maxMessageLength and len(record.msg) > self.maxMessageLength:
+            record.msg = "%s... [truncated %s chars]" % (record.msg[:self.maxMessageLength], len(record.msg) - self.maxMessageLength)
+            record.message = record.msg
+        return record
+
+
+class DatedFileHandler(logging.FileHandler):
+    # appends to logs/<YYYY_MM_DD>.txt of the day. The next day opens its own file instead of renaming the old one, so the
+    # user interface and --headless scheduler can both log to the folder (on Windows a rename fails while the other holds the file).
+    # Only the files of the last backupCount days before the current one are kept
+    pattern = re.compile(r"^\d{4}_\d{2}_\d{2}\.txt$", re.ASCII)
+
+    def __init__(self, folder, backupCount):
+        self.folder = folder
+        self.backupCount = backupCount
+        self.day = time.strftime('%Y_%m_%d')
+        super().__init__(os.path.join(folder, self.day + '.txt'), 'a', delay=True)
+        self.prune()
+
+    def emit(self, record):
+        day = time.strftime('%Y_%m_%d', time.localtime(record.created))
+        if day != self.day:
+            # called with the handler lock held, the file of the new day is opened by the next write
+            if self.stream is not None:
+                self.stream.close()
+                self.stream = None
+            self.day = day
+            self.baseFilename = os.path.join(self.folder, day + '.txt')
+            self.prune()
+        super().emit(record)
+
+    def prune(self):
+        if not self.backupCount:
+            return
+        days = sorted(name for name in os.listdir(self.folder) if self.pattern.match(name) and name < self.day)
+        for name in days[:-self.backupCount]:
+            try:
+                os.remove(os.path.join(self.folder, name))
+            except OSError:
+                # still open in another process, deleted by a later prune
+                pass
+
 
 class Logger:
+    lock = threading.Lock()
+    settings = None
+    queueHandler = None
+    listener = None
+
     @staticmethod
     def getLogger(name):
-        ret = logging.getLogger(name)
-        Logger.setFileName(ret)
-        return ret
+        if Logger.listener is None:
+            Logger.configure()
+        return logging.getLogger(name)
+
+    @staticmethod
+    def configure(config=None):
+        # one queue handler on the root logger feeds a single listener thread that owns the file and console handlers
+        settings = dict(DEFAULTS)
+        if config is not None:
+            settings.update(config.get("logging", {}))
+        with Logger.lock:
+            if Logger.settings == settings:
+                return
+            if Logger.listener is not None:
+                Logger.stopListener()
+            root = logging.getLogger()
+            if Logger.queueHandler is not None:
+                root.removeHandler(Logger.queueHandler)
+            logQueue = queue.SimpleQueue()
+            Logger.queueHandler = TruncatingQueueHandler(logQueue, settings["maxMessageLength"])
+            root.addHandler(Logger.queueHandler)
+            root.setLevel(settings["level"])
+            for name, level in settings["levels"].items():
+                logging.getLogger(name).setLevel(level)
+            formatter = logging.Formatter(FORMAT)
+            handlers = [Logger.createFileHandler(settings), logging.StreamHandler()]
+            for handler in handlers:
+                handler.setFormatter(formatter)
+            Logger.listener = logging.handlers.QueueListener(logQueue, *handlers, respect_handler_level=True)
+            Logger.listener.start()
+            Logger.settings = settings
+
+    @staticmethod
+    def createFileHandler(settings):
+        path = os.path.join(BaseDir.get(), 'logs')
+        os.makedirs(path, exist_ok=True)
+        if settings["rotation"] == "size":
+            # renames application.txt when it is full, only for a single process per log folder
+            return logging.handlers.RotatingFileHandler(os.path.join(path, 'application.txt'), maxBytes=settings["maxBytes"], backupCount=settings["backupCount"], delay=True)
+        return DatedFileHandler(path, settings["backupCount"])
 
     @staticmethod
-    def setFileName(logger):
-        path = BaseDir.get() + '\\logs\\'
-        # create folder if it not exists
-        if not os.path.exists(path):
-            os.makedirs(path)
-
-        log_file = str(datetime.now().strftime('%Y_%m_%d')) + '.txt'
-        fileh = logging.FileHandler(path + '%s' % log_file, 'a')
-        formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-        fileh.setFormatter(formatter)
-        for hdlr in logger.handlers[:]:
-            logger.removeHandler(hdlr)
-        logger.addHandler(fileh)
+    def stopListener():
+        # the file handlers are closed as well, an open one keeps application.txt locked on Windows
+        Logger.listener.stop()
+        for handler in Logger.listener.handlers:
+            handler.close()
+
+    @staticmethod
+    def shutdown():
+        with Logger.lock:
+            if Logger.listener is not None:
+                Logger.stopListener()
+                Logger.listener = None
+                Logger.settings = None
+
+
+atexit.register(Logger.shutdown)
@@ -1,48 +1,157 @@
 import os
-import json
-import sendgrid
+import copy
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from util.logger import Logger
+from util.metrics import Metrics, SIZE_BUCKETS, returnedNone
+from util.ratelimit import RateLimiter
 from util.basedir import BaseDir
+from util.render import MailTemplate
+from util.templates import TemplateRegistry
+from util.transport import Transport
+
+# status codes worth retrying, anything else is a permanent failure
+RETRY_STATUS = (429, 500, 502, 503, 504)
+
+
+class BatchResult:
+    def __init__(self, batch, recipients):
+        self.batch = batch
+        self.recipients = recipients
+        self.status = None
+        self.attempts = 0
+        self.error = None
+        self.transport = None
+
+    @property
+    def ok(self):
+        return self.status is not None and 200 <= self.status < 300
+
 
 class Mail:
     def __init__(self, config):
         self.logger = Logger.getLogger(type(self).__name__)
         self.senderAddress = config["email"]["senderAddress"]
         self.receiverArray = config["email"]["receiverArray"]
-        self.bodyPath = BaseDir.get() + '\\config\\' + config["email"]["body"]
+        self.bodyPath = os.path.join(BaseDir.get(), 'config', config["email"]["body"])
         self.contentType = config["email"]["contentType"]
+        # SendGrid accepts at most 1000 recipients per request, the receiver address takes one of them
+        self.batchSize = config["email"].get("batchSize", 999)
+        self.maxWorkers = config["email"].get("maxWorkers", 4)
+        self.maxRetries = config["email"].get("maxRetries", 3)
+        self.backoff = config["email"].get("backoff", 1.0)
+        # a transport that failed a batch is skipped for this long while a fallback is configured
+        self.failoverCooldown = config["email"].get("failoverCooldown", 60)
+        self.transports = Transport.fromConfig(config)
+        # batches started per second over all mails, so parallel workers and concurrent jobs stay below the provider's throttling
+        self.limiter = RateLimiter(config["email"].get("maxBatchesPerSecond", 0), config["email"].get("burstBatches", 1))
+        self.lock = threading.Lock()
+        self.downUntil = {}
+        self.templates = TemplateRegistry.shared()
+
+    def activeTransports(self):
+        # transports in cooldown go last, so they are only used if every other one fails too
+        now = time.monotonic()
+        with self.lock:
+            return sorted(self.transports, key=lambda t: self.downUntil.get(t.name, 0) > now)
 
-    def sendMail(self, adresses, shortText, longText):
+    def sendMail(self, adresses, shortText, longText, fields=None, recipients=None):
+        results = self.deliver(adresses, shortText, longText, fields=fields, recipients=recipients)
+        return results is not None and all(r.ok for r in results)
+
+    @Metrics.instrument("mail", failed=returnedNone)
+    def deliver(self, adresses, shortText, longText, skipBatches=(), fields=None, recipients=None, window=0):
+        # batches listed in skipBatches were already delivered by an earlier attempt.
+        # With a window (seconds) the batches are spread evenly over it instead of being sent in one burst.
+        # fields are the merge fields common to all recipients (e.g. level), recipients the ones of every
+        # address ({email: {"name": ..., "firstName": ..., "application": ...}}).
+        # Without recipient fields in the texts every batch is one bcc personalization,
+        # otherwise every recipient gets an own personalization with its substitutions.
         try:
-            sg = sendgrid.SendGridAPIClient(os.environ.get('SENDGRID_API_KEY'))
-            data = json.loads(open(self.bodyPath, "r").read())
-            # transform longText back in html format
-            longText_html = ""
-            lines = longText.splitlines()
-            for i in range(len(lines)):
-                if i == 0:
-                    longText_html = '<p>' + lines[i]
-                elif (i == (len(lines)-1) and lines[i] == ''):
-                    break
+            mailTemplate = MailTemplate.get(shortText, longText)
+            fields = fields or {}
+            subject, body = mailTemplate.render(fields)
+            base = copy.deepcopy(self.templates.getJson(self.bodyPath))
+            base["from"]["email"] = self.senderAddress
+            base["subject"] = subject
+            base["content"][0]["type"] = self.contentType
+            base["content"][0]["value"] = body
+            personalization = base["personalizations"][0]
+            recipients = recipients or {}
+            batches = [adresses[i:i + self.batchSize] for i in range(0, len(adresses), self.batchSize)] or [[]]
+            payloads = []
+            results = []
+            for i, batch in enumerate(batches):
+                if i in skipBatches:
+                    continue
+                data = dict(base)
+                if mailTemplate.personal:
+                    # the receiver address keeps its copy, as in the bcc batches
+                    data["personalizations"] = [{"to": [{"email": adress}], "substitutions": mailTemplate.substitutions(dict(fields, **recipients.get(adress, {}), email=adress))}
+                                                for adress in [self.receiverArray] + batch]
                 else:
-                    longText_html = longText_html + '</p><p>' + lines[i]
-            longText_html = longText_html + '</p></p>'
-            bcc = []
-            for adress in adresses:
-                bcc.append({'email':adress})
-                data["personalizations"][0]["bcc"] += [{'email':adress}]
-            data["personalizations"][0]["to"][0]["email"] = self.receiverArray
-            data["from"]["email"] = self.senderAddress
-            data["subject"] = shortText
-            data["content"][0]["type"] = self.contentType
-            data["content"][0]["value"] = longText_html
+                    data["personalizations"] = [dict(personalization, to=[{"email": self.receiverArray}], bcc=[{"email": adress} for adress in batch])]
+                payloads.append(data)
+                results.append(BatchResult(i, len(batch)))
+            pacer = RateLimiter.over(len(payloads), window)
+            if len(payloads) == 1:
+                self.sendBatch(payloads[0], results[0])
+            elif payloads:
+                with ThreadPoolExecutor(max_workers=min(self.maxWorkers, len(payloads))) as executor:
+                    list(executor.map(lambda i: self.sendBatch(payloads[i], results[i], pacer), range(len(payloads))))
+            failed = [r for r in results if not r.ok]
+            self.logger.info("sent alert email to %s recipients in %s of %s batches, %s failed" % (sum(r.recipients for r in results), len(results), len(batches), len(failed)))
+            return results
+        except Exception as e:
+            self.logger.error("sending mail failed: %s" % str(e))
+            return None
+
+    def sendBatch(self, data, result, pacer=None):
+        # the batch fails over to the next transport once the current one gave up on it
+        waited = (pacer.acquire() if pacer is not None else 0.0) + self.limiter.acquire()
+        if waited:
+            Metrics.observe("mail_throttle_seconds", "batch", waited)
+        for transport in self.activeTransports():
+            start = time.perf_counter()
+            attempts = result.attempts
             try:
-                response = sg.client.mail.send.post(request_body=data)
-                self.logger.info("send alert email with status\n%s\n%s\n%s" % (response.status_code, response.body, response.headers))
-                return True
+                self.sendAttempts(transport, data, result)
+            finally:
+                Metrics.observe("mail_batch_seconds", transport.name, time.perf_counter() - start)
+                Metrics.observe("mail_batch_recipients", transport.name, result.recipients, SIZE_BUCKETS)
+                Metrics.count("mail_retries", transport.name, result.attempts - attempts - 1)
+                Metrics.count("mail_status", "%s %s" % (transport.name, result.status))
+            if result.ok:
+                return result
+            if len(self.transports) > 1:
+                with self.lock:
+                    self.downUntil[transport.name] = time.monotonic() + self.failoverCooldown
+                self.logger.warning("batch %s: %s failed, failing over" % (result.batch, transport.name))
+        return result
+
+    def sendAttempts(self, transport, data, result):
+        result.transport = transport.name
+        tries = 0
+        while True:
+            tries += 1
+            result.attempts += 1
+            try:
+                result.status = transport.send(data)
+                result.error = None
+                self.logger.info("batch %s: sent to %s recipients via %s with status %s after %s attempts" % (result.batch, result.recipients, transport.name, result.status, tries))
+                if result.ok:
+                    with self.lock:
+                        self.downUntil.pop(transport.name, None)
+                return result
             except Exception as e:
-                self.logger.error("sending mail failed: %s" % str(e))
-                return False
-        except Exception as e:
-            self.logger.error( "sending mail failed: %s" % str(e))
-            return False
\ No newline at end of file
+                result.status = getattr(e, "status_code", None)
+                result.error = str(e)
+                if not getattr(e, "retryable", result.status in RETRY_STATUS) or tries > self.maxRetries:
+                    self.logger.error("batch %s: sending mail via %s failed after %s attempts: %s" % (result.batch, transport.name, tries, result.error))
+                    return result
+                # exponential backoff with full jitter, so parallel batches do not retry in lockstep
+                delay = random.uniform(0, self.backoff * 2 ** (tries - 1))
+                self.logger.warning("batch %s: %s status %s, retrying in %.1f s" % (result.batch, transport.name, result.status, delay))
+                time.sleep(delay)
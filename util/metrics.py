@@ -0,0 +1,199 @@
+import bisect
+import functools
+import os
+import threading
+import time
+from contextlib import contextmanager
+from util.logger import Logger
+
+# upper bounds in seconds for latencies, in items for sizes, the last bucket is everything above
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+SIZE_BUCKETS = (1, 10, 50, 100, 250, 500, 1000, 5000, 10000, 100000)
+PREFIX = "notification_manager"
+
+
+def returnedNone(result):
+    # failed predicate of instrument for the methods that log their error and return None
+    return result is None
+
+
+class Histogram:
+    __slots__ = ("buckets", "counts", "count", "sum", "max")
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def copy(self):
+        other = Histogram(self.buckets)
+        other.counts = list(self.counts)
+        other.count, other.sum, other.max = self.count, self.sum, self.max
+        return other
+
+    def quantile(self, q):
+        # upper bound of the bucket holding the quantile, capped at the largest value seen
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank and count:
+                return min(bound, self.max)
+        return self.max
+
+
+class Metrics:
+    # process-wide histograms and counters keyed by (name, operation), plus named sources of current values such as pool stats
+    lock = threading.Lock()
+    histograms = {}
+    counters = {}
+    sources = {}
+    exporter = None
+
+    @staticmethod
+    def observe(name, op, value, buckets=LATENCY_BUCKETS):
+        with Metrics.lock:
+            histogram = Metrics.histograms.get((name, op))
+            if histogram is None:
+                histogram = Metrics.histograms[(name, op)] = Histogram(buckets)
+            histogram.observe(value)
+
+    @staticmethod
+    def count(name, op, value=1):
+        with Metrics.lock:
+            Metrics.counters[(name, op)] = Metrics.counters.get((name, op), 0) + value
+
+    @staticmethod
+    @contextmanager
+    def timer(name, op):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            Metrics.observe(name, op, time.perf_counter() - start)
+
+    @staticmethod
+    def instrument(name, failed=None):
+        # times every call as <name>_seconds, counts returned rows and calls that failed: the ones that raised
+        # and, with a failed(result) predicate, the ones whose result it marks as a failure
+        def decorate(fn):
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                error = True
+                try:
+                    result = fn(*args, **kwargs)
+                    error = failed is not None and failed(result)
+                    if isinstance(result, (list, dict)):
+                        Metrics.count(name + "_rows", fn.__name__, len(result))
+                    return result
+                finally:
+                    Metrics.observe(name + "_seconds", fn.__name__, time.perf_counter() - start)
+                    if error:
+                        Metrics.count(name + "_errors", fn.__name__)
+            return wrapper
+        return decorate
+
+    @staticmethod
+    def addSource(name, source):
+        # source() returns {stat: number}, it is only called when the metrics are read
+        with Metrics.lock:
+            Metrics.sources[name] = source
+
+    @staticmethod
+    def removeSource(name):
+        with Metrics.lock:
+            Metrics.sources.pop(name, None)
+
+    @staticmethod
+    def collect():
+        with Metrics.lock:
+            histograms = {key: h.copy() for key, h in Metrics.histograms.items()}
+            counters = dict(Metrics.counters)
+            sources = dict(Metrics.sources)
+        values = {}
+        for name, source in sources.items():
+            try:
+                values[name] = source()
+            except Exception as e:
+                values[name] = {"error": str(e)}
+        return histograms, counters, values
+
+    @staticmethod
+    def format():
+        # plain text table for the diagnostics tab
+        histograms, counters, values = Metrics.collect()
+        lines = ["%-40s %8s %10s %10s %10s %10s" % ("operation", "count", "p50", "p95", "max", "total")]
+        for (name, op), h in sorted(histograms.items()):
+            if name.endswith("_seconds"):
+                lines.append("%-40s %8d %8.1fms %8.1fms %8.1fms %9.2fs" % ("%s %s" % (name[:-8], op), h.count, h.quantile(0.5) * 1000, h.quantile(0.95) * 1000, h.max * 1000, h.sum))
+            else:
+                lines.append("%-40s %8d %10.0f %10.0f %10.0f %10.0f" % ("%s %s" % (name, op), h.count, h.quantile(0.5), h.quantile(0.95), h.max, h.sum))
+        if counters:
+            lines.append("")
+            for (name, op), value in sorted(counters.items()):
+                lines.append("%-40s %8s" % ("%s %s" % (name, op), value))
+        for name, stats in sorted(values.items()):
+            lines.append("")
+            lines.append("%s: %s" % (name, ", ".join("%s=%s" % item for item in stats.items())))
+        return "\n".join(lines)
+
+    @staticmethod
+    def prometheus():
+        histograms, counters, values = Metrics.collect()
+        lines = []
+        for name in sorted({name for name, op in histograms}):
+            lines.append("# TYPE %s_%s histogram" % (PREFIX, name))
+            for (other, op), h in sorted(histograms.items()):
+                if other != name:
+                    continue
+                cumulative = 0
+                for bound, count in zip(h.buckets + ("+Inf",), h.counts):
+                    cumulative += count
+                    lines.append('%s_%s_bucket{op="%s",le="%s"} %s' % (PREFIX, name, op, bound, cumulative))
+                lines.append('%s_%s_sum{op="%s"} %s' % (PREFIX, name, op, h.sum))
+                lines.append('%s_%s_count{op="%s"} %s' % (PREFIX, name, op, h.count))
+        for name in sorted({name for name, op in counters}):
+            lines.append("# TYPE %s_%s_total counter" % (PREFIX, name))
+            for (other, op), value in sorted(counters.items()):
+                if other == name:
+                    lines.append('%s_%s_total{op="%s"} %s' % (PREFIX, name, op, value))
+        if values:
+            lines.append("# TYPE %s_source gauge" % PREFIX)
+            for source, stats in sorted(values.items()):
+                for stat, value in stats.items():
+                    if isinstance(value, (int, float)):
+                        lines.append('%s_source{source="%s",stat="%s"} %s' % (PREFIX, source, stat, value))
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def writeTextfile(path):
+        # written next to the target and renamed, so the node exporter never reads a partial file
+        temp = path + ".tmp"
+        with open(temp, "w") as f:
+            f.write(Metrics.prometheus())
+        os.replace(temp, path)
+
+    @staticmethod
+    def startExport(path, interval=15):
+        if Metrics.exporter is not None or not path:
+            return
+        logger = Logger.getLogger(Metrics.__name__)
+
+        def run():
+            while True:
+                try:
+                    Metrics.writeTextfile(path)
+                except Exception as e:
+                    logger.error("could not write metrics to %s - %s" % (path, e))
+                time.sleep(interval)
+        Metrics.exporter = threading.Thread(target=run, name="MetricsExport", daemon=True)
+        Metrics.exporter.start()
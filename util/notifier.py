@@ -0,0 +1,425 @@
+import heapq
+import itertools
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from util.application import Application
+from util.directory import UserDirectory
+from util.logger import Logger
+from util.mail import Mail
+from util.metrics import Metrics
+from util.outbox import Outbox, OutboxJob
+from util.profiler import StartupProfiler
+from util.render import MailTemplate
+from util.scheduler import Scheduler
+from util.search import SearchIndex
+from util.snapshot import DirectorySnapshot
+from util.user import User
+
+
+class Notifier:
+    # raise/solve workflow shared by the Tk application and the headless command line,
+    # every database step fans out to the configured applications in parallel
+    def __init__(self, config):
+        self.logger = Logger.getLogger(type(self).__name__)
+        self.config = config
+        self.directory = UserDirectory()
+        # events of raised and solved notifications for the broadcast server, None unless broadcast.enabled
+        self.publisher = None
+        if config.get("broadcast", {}).get("enabled", False):
+            # asyncio and the broadcast module are only imported when the channel is used
+            with StartupProfiler.phase("import broadcast"):
+                from util.broadcast import BroadcastPublisher
+            self.publisher = BroadcastPublisher.fromConfig(config)
+        self.apps = Application.fromConfig(config, self.directory, self.publisher)
+        self.mail = Mail(config)
+        activeConfig = config.get("activeUsers", {})
+        self.refreshInterval = activeConfig.get("refreshInterval", 30)
+        statusConfig = config.get("status", {})
+        self.statusTTL = statusConfig.get("ttl", 5)
+        self.pollInterval = statusConfig.get("pollInterval", 5)
+        self.maxPollInterval = statusConfig.get("maxPollInterval", 60)
+        self.statusLock = threading.Lock()
+        self.statusCache = None
+        self.statusGeneration = 0
+        self.outbox = None
+        self.scheduler = None
+        # steps of one job may run concurrently, their updates of job.state and job.error are serialized
+        self.jobLock = threading.Lock()
+        metricsConfig = config.get("metrics", {})
+        Metrics.startExport(metricsConfig.get("textfile"), metricsConfig.get("exportInterval", 15))
+        snapshotConfig = config.get("snapshot", {})
+        self.snapshot = None
+        if snapshotConfig.get("enabled", True):
+            self.snapshot = DirectorySnapshot(",".join("%s/%s" % (app.db.host, app.db.database) for app in self.apps), snapshotConfig.get("path"))
+        # the user lists last loaded from the databases, written to the snapshot
+        self.lists = {}
+        # type-ahead index over the users of both lists
+        self.searchIndex = SearchIndex()
+        # set while no database can be reached, the user interface is read-only then
+        self.offline = False
+
+    def selectApps(self, names=None):
+        if names is None:
+            return self.apps
+        return [app for app in self.apps if app.name in names]
+
+    def fanOut(self, fn, apps=None):
+        # {application name: fn(application)}, run in parallel so the latency is that of the slowest database
+        apps = self.apps if apps is None else apps
+        if len(apps) <= 1:
+            return {app.name: fn(app) for app in apps}
+        with ThreadPoolExecutor(max_workers=len(apps), thread_name_prefix="FanOut") as executor:
+            return dict(zip([app.name for app in apps], executor.map(fn, apps)))
+
+    def succeeded(self, results, what):
+        # results of the applications that answered, None if none did
+        failed = [name for name, result in results.items() if result is None]
+        if failed:
+            self.logger.warning("could not %s in %s" % (what, ", ".join(failed)))
+        if results and len(failed) == len(results):
+            self.offline = True
+            return None
+        return [result for result in results.values() if result is not None]
+
+    def loadUsersNow(self):
+        # get current active users in all applications
+        # None if no database could be queried
+        with StartupProfiler.phase("query active users now"):
+            deltas = self.succeeded(self.fanOut(lambda app: app.sessions.refresh()), "load active users")
+        if deltas is None:
+            return None
+        # the refresh only returns the users added since the last one, the list is every active session
+        self.lists["now"] = UserDirectory.merge(app.sessions.records() for app in self.apps)
+        return self.lists["now"]
+
+    def refreshUsersNow(self):
+        # (added, expired) records since the last load or refresh, None if no query succeeded
+        start = time.perf_counter()
+        deltas = self.succeeded(self.fanOut(lambda app: app.sessions.refresh()), "refresh active users")
+        if deltas is None:
+            return None
+        added = UserDirectory.merge(delta[0] for delta in deltas)
+        # a user only leaves the list once no application has an active session any more
+        expired = [r for r in UserDirectory.merge(delta[1] for delta in deltas) if not any(app.sessions.isActive(r) for app in self.apps)]
+        self.lists["now"] = UserDirectory.merge(app.sessions.records() for app in self.apps)
+        if len(self.searchIndex):
+            self.indexUsers(added)
+        self.logger.info("refreshed active users in %.0f ms, %s added, %s expired, %s active" % ((time.perf_counter() - start) * 1000, len(added), len(expired), len(self.lists["now"])))
+        return added, expired
+
+    def loadUsers90Days(self):
+        # get active users in all applications in the last 90 days
+        def load(app):
+            rows = app.db.getActiveUsersLast90Days()
+            if rows is None:
+                return None
+            return self.directory.load(((u[3], u[0], u[1], u[2]) for u in rows), app.name)
+        with StartupProfiler.phase("query active users last 90 days"):
+            lists = self.succeeded(self.fanOut(load), "load users of the last 90 days")
+        if lists is None:
+            return None
+        self.lists["days"] = UserDirectory.merge(lists)
+        return self.lists["days"]
+
+    def loadSnapshot(self):
+        # ({"now": records, "days": records}, savedAt) from the last successful load, None without a usable snapshot
+        snapshot = self.snapshot.load() if self.snapshot is not None else None
+        if snapshot is None:
+            return None
+        lists, savedAt = snapshot
+        return {name: UserDirectory.merge([[self.directory.add(guid, userName, firstName, email, app) for app, guid, userName, firstName, email in rows]])
+                for name, rows in lists.items()}, savedAt
+
+    def saveSnapshot(self):
+        # one row per user and application the user belongs to
+        if self.snapshot is not None and "now" in self.lists and "days" in self.lists:
+            return self.snapshot.save({name: [(app, guid, r.name, r.firstName, r.email) for r in records for app, guid in (r.guids.items() or [(None, r.guid)])]
+                                       for name, records in self.lists.items()})
+
+    def indexUsers(self, records=None):
+        # adds the users of both lists (or the records given) not indexed yet, returns their number
+        if records is None:
+            records = UserDirectory.merge(self.lists.values())
+        start = time.perf_counter()
+        added = self.searchIndex.update(records)
+        if added:
+            Metrics.observe("search_seconds", "index", time.perf_counter() - start)
+            self.logger.info("indexed %s users in %.0f ms, %s in the index" % (added, (time.perf_counter() - start) * 1000, len(self.searchIndex)))
+        return added
+
+    def getStatus(self, maxAge=None):
+        # number of active notifications in all applications and the newest active row, if any,
+        # answered from the cache while it is younger than maxAge (the configured ttl by default).
+        # The row carries the active row of every application as its last element.
+        maxAge = self.statusTTL if maxAge is None else maxAge
+        with self.statusLock:
+            if self.statusCache is not None and time.monotonic() - self.statusCache[0] < maxAge:
+                return self.statusCache[1]
+            generation = self.statusGeneration
+        with StartupProfiler.phase("query notification status"):
+            results = self.fanOut(lambda app: app.notify.checkStatus())
+        if self.succeeded(results, "check the notification status") is None:
+            return 0, None
+        self.offline = False
+        active = {name: result[1] for name, result in results.items() if result is not None and result[1] is not None}
+        actNot = sum(result[0] for result in results.values() if result is not None)
+        status = (actNot, tuple(max(active.values(), key=lambda row: row[1])) + (active,)) if active else (actNot, None)
+        with self.statusLock:
+            # a write that happened while the query ran makes its result unfit for the cache
+            if generation == self.statusGeneration:
+                self.statusCache = (time.monotonic(), status)
+        return status
+
+    def invalidateStatus(self):
+        with self.statusLock:
+            self.statusCache = None
+            self.statusGeneration += 1
+
+    def activeIDs(self, usrNot, apps=None):
+        # {application name: active notification appGUID} of the status row
+        return {name: row[0] for name, row in usrNot[4].items() if apps is None or name in apps}
+
+    def getNotifiedUsers(self, usrNot):
+        # previously notified users of every application with an active notification, without duplicates
+        def notified(app):
+            row = usrNot[4][app.name]
+            # NotificationRecipients, the NotifiedUsers string only for not yet migrated rows
+            if not row[3]:
+                rows = app.notify.checkRecipients(row[0]) or []
+                return [self.directory.add(guid, None, None, email, app.name) for guid, email in rows if email is not None]
+            records, missing = self.directory.fromGuids(row[3].split(','))
+            if missing:
+                for guid, email in (app.db.getNotifiedUsersEmails(missing) or {}).items():
+                    records.append(self.directory.add(guid, None, None, email, app.name))
+            return records
+        return UserDirectory.merge(self.fanOut(notified, self.selectApps(usrNot[4])).values())
+
+    def getHistory(self, limit=50, cursor=None, level=None, text=None, apps=None):
+        # (rows, next cursor) of one page of past notifications, newest first, None if no database answered.
+        # A row is (application name, appGUID, DateNew, DateChanged, Level, ShortText, Active, recipients).
+        # Every application reads a page behind its own position in the cursor and the pages are merged by DateNew,
+        # so ties between applications never skip or repeat a row. The next cursor is None after the last page.
+        cursor = cursor or {}
+        results = self.fanOut(lambda app: app.notify.checkHistory(limit, cursor.get(app.name), level, text), self.selectApps(apps))
+        if self.succeeded(results, "load the notification history") is None:
+            return None
+        pages = [[(name,) + tuple(row) for row in rows] for name, rows in results.items() if rows]
+        page = list(itertools.islice(heapq.merge(*pages, key=lambda row: row[2], reverse=True), limit))
+        nextCursor = dict(cursor)
+        for row in page:
+            nextCursor[row[0]] = (row[2], row[1])
+        # rows fetched but not shown or a full page from any application mean there is more to read
+        more = sum(len(rows) for rows in pages) > len(page) or any(len(rows) == limit for rows in pages)
+        return page, nextCursor if more else None
+
+    def migrateRecipients(self, batchSize=100):
+        # returns the number of migrated notifications, None if the migration stopped on an error
+        def migrate(app):
+            migrated = 0
+            while True:
+                rows = app.db.getUnmigratedNotifications(batchSize)
+                if rows is None:
+                    return None
+                if not rows:
+                    return migrated
+                for notificationID, notifiedUsers in rows:
+                    if not app.db.migrateRecipients(notificationID, notifiedUsers.split(',')):
+                        return None
+                    migrated += 1
+                self.logger.info("%s: migrated recipients of %s notifications" % (app.name, migrated))
+        results = self.fanOut(migrate)
+        if any(result is None for result in results.values()):
+            return None
+        return sum(results.values())
+
+    def startOutbox(self):
+        # raise/solve from the user interface only enqueue, the outbox worker delivers in the background.
+        # Planned jobs spread their mails over minutes, they get their own lane so a raise or solve of the user is not queued behind them
+        outboxConfig = self.config.get("outbox", {})
+        self.outbox = Outbox(self.processJob, outboxConfig.get("path"), maxAttempts=outboxConfig.get("maxAttempts", 10), backoff=outboxConfig.get("backoff", 5), maxBackoff=outboxConfig.get("maxBackoff", 300),
+                             lanes=("interactive", "scheduled"), lease=outboxConfig.get("lease", 60))
+        self.outbox.start()
+        return self.outbox
+
+    def openScheduler(self):
+        # the planned notifications, without running them
+        if self.scheduler is None:
+            self.scheduler = Scheduler(self.dispatchScheduled, self.config.get("schedule", {}).get("path"), self.jobSettled)
+        return self.scheduler
+
+    def startScheduler(self):
+        # planned notifications are handed to the outbox when due, startOutbox has to run first
+        self.openScheduler().start()
+        return self.scheduler
+
+    def dispatchScheduled(self, entry):
+        # the entry key becomes the job key: a raise creates its notification under it, and firing an entry
+        # again after a crash finds the job already in the outbox. Like a raise from the user interface, a planned
+        # raise is dropped while another notification is active; returns False then, the scheduler marks it skipped
+        if entry.kind == "raise":
+            actNot, usrNot = self.getStatus(maxAge=0)
+            if self.offline:
+                raise RuntimeError("the notification status could not be checked")
+            if actNot > 0:
+                self.logger.warning("raise job %s skipped, %s notification(s) already active: %s" % (entry.key, actNot, usrNot[2]))
+                return False
+        self.outbox.enqueue(entry.kind, dict(entry.payload, window=entry.window), key=entry.key, lane="scheduled")
+
+    def jobSettled(self, key):
+        # True once the outbox job of a fired entry is done, False if it failed for good, None while it is retried.
+        # A solve is only sent after its raise went through, not for a notification that was never created
+        status = self.outbox.status(key) if self.outbox is not None else "pending"
+        return {"done": True, "pending": None, "running": None}.get(status, False)
+
+    def scheduleNotification(self, level, shortText, longText, users, at, duration=None, solveTexts=None, remindBefore=None, window=None, operator=None, apps=None):
+        # plans a downtime announced at `at` (epoch seconds): a reminder mail remindBefore seconds ahead, the raise at `at`
+        # and, with a duration (seconds) and solveTexts as (title, description), the solve at at + duration.
+        # The mails of every step are spread over window seconds. Returns the plan key, which cancels all steps at once
+        scheduleConfig = self.config.get("schedule", {})
+        remindBefore = scheduleConfig.get("remindBefore", 900) if remindBefore is None else remindBefore
+        window = scheduleConfig.get("window", 300) if window is None else window
+        plan = str(uuid.uuid4()).upper()
+        raiseKey = str(uuid.uuid4()).upper()
+        payload = self.raiseJob(level, shortText, longText, users, operator, apps)
+        end = at + duration if duration else None
+        if remindBefore and at - remindBefore > time.time():
+            self.scheduler.add("remind", dict(payload, shortText="Reminder: " + shortText), at - remindBefore, plan, expires=at, window=window)
+        self.scheduler.add("raise", payload, at, plan, raiseKey, expires=end, window=window)
+        if end is not None:
+            notificationIDs = {app.name: raiseKey for app in self.selectApps(apps)}
+            self.scheduler.add("solve", self.solveJob(solveTexts[0], solveTexts[1], users, notificationIDs), end, plan, window=window, after=raiseKey)
+        return plan
+
+    def prepareOperator(self):
+        # resolves the logged user and its user code in every application ahead of the first raise, both are cached for the session
+        user = User.get()
+        return self.fanOut(lambda app: app.notify.getUserCode(user[0], user[1]))
+
+    def raiseJob(self, level, shortText, longText, users, operator=None, apps=None):
+        # operator as (GID, email), the logged user by default; the notification is created in the given applications, all by default
+        user = operator or User.get()
+        users = UserDirectory.merge([users])
+        apps = self.selectApps(apps)
+        return dict(self.mailFields(shortText, longText, users, apps, level=level),
+                    level=level, shortText=shortText, longText=longText, adresses=[u.email for u in users],
+                    usersIDs={app.name: UserDirectory.guidsFor(users, app.name) for app in apps},
+                    userGID=user[0], userEmail=user[1])
+
+    def solveJob(self, shortText, longText, users, notificationIDs):
+        # notificationIDs as {application name: appGUID} of the notifications to deactivate
+        users = UserDirectory.merge([users])
+        apps = self.selectApps(notificationIDs)
+        return dict(self.mailFields(shortText, longText, users, apps),
+                    shortText=shortText, longText=longText, notificationIDs=notificationIDs, adresses=[u.email for u in users],
+                    usersIDs={app.name: UserDirectory.guidsFor(users, app.name) for app in apps})
+
+    def mailFields(self, shortText, longText, users, apps, **fields):
+        # merge fields of the mail, the recipient fields are only collected if the texts use them
+        names = [app.name for app in apps]
+        payload = {"fields": dict(fields, application=", ".join(names))}
+        if MailTemplate.get(shortText, longText).personal:
+            payload["recipients"] = {u.email: {"name": u.name, "firstName": u.firstName, "application": ", ".join(a for a in names if a in u.guids) or ", ".join(names)}
+                                     for u in users}
+        return payload
+
+    def enqueueRaise(self, level, shortText, longText, users, apps=None):
+        return self.outbox.enqueue("raise", self.raiseJob(level, shortText, longText, users, apps=apps))
+
+    def enqueueSolve(self, shortText, longText, users, notificationIDs):
+        return self.outbox.enqueue("solve", self.solveJob(shortText, longText, users, notificationIDs))
+
+    def raiseNotification(self, level, shortText, longText, users, operator=None, apps=None):
+        # returns (mail sent, notification created), mail sent is None when nobody had to be emailed
+        job = OutboxJob(str(uuid.uuid4()).upper(), "raise", self.raiseJob(level, shortText, longText, users, operator, apps), {}, 0)
+        self.processJob(job)
+        return job.state.get("mail", False), bool(job.state.get("db"))
+
+    def solveNotification(self, shortText, longText, users, notificationIDs):
+        # returns (mail sent, notifications deactivated), no mail is sent if deactivating failed
+        job = OutboxJob(str(uuid.uuid4()).upper(), "solve", self.solveJob(shortText, longText, users, notificationIDs), {}, 0)
+        self.processJob(job)
+        if not job.state.get("db"):
+            return None, False
+        return job.state.get("mail", False), True
+
+    def processJob(self, job):
+        # every step records its outcome in job.state, steps already done are skipped when a job is retried
+        if job.kind == "raise":
+            # the notification rows and the mail do not depend on each other, the raise takes as long as the slower one
+            with ThreadPoolExecutor(max_workers=1, thread_name_prefix="RaiseMail") as executor:
+                sent = executor.submit(self.stepMail, job)
+                created = self.stepCreate(job)
+                return created and sent.result()
+        if job.kind == "solve":
+            return self.stepDeactivate(job) and self.stepMail(job)
+        if job.kind == "remind":
+            return self.stepMail(job)
+        job.error = "unknown job kind %s" % job.kind
+        return False
+
+    def saveJob(self, job, message):
+        if self.outbox is not None:
+            with self.jobLock:
+                self.outbox.save(job)
+            self.outbox.report(job, "running", message)
+
+    def failJob(self, job, message):
+        # the errors of concurrent steps are combined into one message
+        with self.jobLock:
+            job.error = "%s %s" % (job.error, message) if job.error else message
+        self.saveJob(job, message)
+        return False
+
+    def updateJob(self, job, **state):
+        with self.jobLock:
+            job.state.update(state)
+
+    def stepApps(self, job, apps, step, error, message):
+        # runs step(app) in every application not done yet, the ones done are recorded so a retry skips them
+        if job.state.get("db"):
+            return True
+        done = dict(job.state.get("apps", {}))
+        results = self.fanOut(step, [app for app in self.selectApps(apps) if not done.get(app.name)])
+        done.update((name, True) for name, ok in results.items() if ok)
+        self.updateJob(job, apps=done)
+        failed = [name for name, ok in results.items() if not ok]
+        if len(failed) < len(results):
+            self.invalidateStatus()
+        if failed:
+            return self.failJob(job, "%s in %s." % (error, ", ".join(failed)))
+        self.updateJob(job, db=True)
+        self.saveJob(job, message)
+        return True
+
+    def stepCreate(self, job):
+        p = job.payload
+        # the job key is used as appGUID in every application, so a replayed insert is a no-op
+        return self.stepApps(job, p["usersIDs"], lambda app: app.notify.createNotification(p["userGID"], p["userEmail"], p["level"], p["shortText"], p["longText"], '1', '0', '0', p["usersIDs"][app.name], job.key),
+                             "Error creating system notification", "System notification created.")
+
+    def stepDeactivate(self, job):
+        p = job.payload
+        return self.stepApps(job, p["notificationIDs"], lambda app: app.notify.desactivateNotifications(p["usersIDs"][app.name], p["notificationIDs"][app.name]),
+                             "Error in desactivating the notifications", "Notifications deactivated.")
+
+    def stepMail(self, job):
+        p = job.payload
+        if "mail" in job.state:
+            return True
+        if not p["adresses"]:
+            self.updateJob(job, mail=None)
+            return True
+        delivered = set(job.state.get("mailBatches", []))
+        results = self.mail.deliver(p["adresses"], p["shortText"], p["longText"], skipBatches=delivered, fields=p.get("fields"), recipients=p.get("recipients"), window=p.get("window", 0))
+        if results is None:
+            return self.failJob(job, "Error sending email notification.")
+        delivered.update(r.batch for r in results if r.ok)
+        self.updateJob(job, mailBatches=sorted(delivered))
+        failed = [r for r in results if not r.ok]
+        if failed:
+            return self.failJob(job, "Error sending email notification, %s batches failed." % len(failed))
+        self.updateJob(job, mail=True)
+        self.saveJob(job, "Email notification sent to %s users." % len(p["adresses"]))
+        return True
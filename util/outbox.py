@@ -0,0 +1,176 @@
+import os
+import json
+import sqlite3
+import threading
+import time
+import uuid
+from util.basedir import BaseDir
+from util.logger import Logger
+
+
+class OutboxJob:
+    def __init__(self, key, kind, payload, state, attempts, lane=None):
+        self.key = key
+        self.kind = kind
+        self.payload = payload
+        # progress of the individual steps, persisted so a restart resumes where it stopped
+        self.state = state
+        self.attempts = attempts
+        self.lane = lane
+        self.error = None
+
+
+class Outbox:
+    # local SQLite journal, work is enqueued by the caller and drained by one background worker
+    # with at-least-once semantics: a job is retried until its handler reports it complete.
+    # Every lane has its own worker, so a slow job in one lane does not hold up the jobs of the others.
+    # Several processes may drain one file (the user interface and --headless scheduler): a worker claims a job
+    # with a lease it renews while the job runs, a job is only taken over once the lease of its owner expired
+    def __init__(self, handler, path=None, maxAttempts=10, backoff=5, maxBackoff=300, lanes=("default",), lease=60):
+        self.logger = Logger.getLogger(type(self).__name__)
+        self.handler = handler
+        self.path = path or os.path.join(BaseDir.get(), 'outbox', 'outbox.db')
+        self.maxAttempts = maxAttempts
+        self.backoff = backoff
+        self.maxBackoff = maxBackoff
+        self.lanes = tuple(lanes)
+        self.lease = lease
+        self.owner = str(uuid.uuid4()).upper()
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=FULL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS jobs (key TEXT PRIMARY KEY, kind TEXT NOT NULL, payload TEXT NOT NULL, state TEXT NOT NULL, status TEXT NOT NULL, attempts INTEGER NOT NULL DEFAULT 0, nextAttempt REAL NOT NULL, error TEXT, created REAL NOT NULL, updated REAL NOT NULL)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS jobs_pending ON jobs (status, nextAttempt)")
+        columns = [row[1] for row in self.conn.execute("PRAGMA table_info(jobs)")]
+        if "lane" not in columns:
+            self.conn.execute("ALTER TABLE jobs ADD COLUMN lane TEXT")
+        if "owner" not in columns:
+            self.conn.execute("ALTER TABLE jobs ADD COLUMN owner TEXT")
+            self.conn.execute("ALTER TABLE jobs ADD COLUMN leaseUntil REAL")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS jobs_lane ON jobs (lane, status, nextAttempt)")
+        # jobs of older files or of lanes no longer configured are run by the first lane
+        self.conn.execute("UPDATE jobs SET lane = ? WHERE lane IS NULL OR lane NOT IN (%s)" % ", ".join("?" * len(self.lanes)), (self.lanes[0],) + self.lanes)
+        self.listeners = []
+        self.wakeups = {lane: threading.Event() for lane in self.lanes}
+        self.stopping = threading.Event()
+        self.workers = []
+        self.heartbeat = None
+
+    def addListener(self, listener):
+        # listener(job, status, message) is called from the worker thread
+        self.listeners.append(listener)
+
+    def report(self, job, status, message):
+        for listener in self.listeners:
+            try:
+                listener(job, status, message)
+            except Exception as e:
+                self.logger.error("outbox listener failed - %s" % e)
+
+    def enqueue(self, kind, payload, key=None, lane=None):
+        # the key doubles as idempotency key for the work the handler does, the job runs in the first lane by default
+        key = key or str(uuid.uuid4()).upper()
+        lane = lane or self.lanes[0]
+        now = time.time()
+        with self.lock:
+            self.conn.execute("INSERT OR IGNORE INTO jobs (key, kind, payload, state, status, nextAttempt, created, updated, lane) VALUES (?, ?, ?, '{}', 'pending', ?, ?, ?, ?)",
+                              (key, kind, json.dumps(payload), now, now, now, lane))
+        self.logger.info("enqueued %s job %s" % (kind, key))
+        self.wakeups[lane].set()
+        return key
+
+    def save(self, job):
+        with self.lock:
+            self.conn.execute("UPDATE jobs SET state = ?, updated = ? WHERE key = ? AND owner = ?", (json.dumps(job.state), time.time(), job.key, self.owner))
+
+    def status(self, key):
+        # pending, running, done or failed, None for an unknown key
+        with self.lock:
+            row = self.conn.execute("SELECT status FROM jobs WHERE key = ?", (key,)).fetchone()
+        return row[0] if row is not None else None
+
+    def pending(self, lane=None):
+        # jobs not finished yet, of one lane or of all
+        with self.lock:
+            if lane is None:
+                return self.conn.execute("SELECT COUNT(*) FROM jobs WHERE status IN ('pending', 'running')").fetchone()[0]
+            return self.conn.execute("SELECT COUNT(*) FROM jobs WHERE lane = ? AND status IN ('pending', 'running')", (lane,)).fetchone()[0]
+
+    def next(self, lane):
+        # claims the oldest due job of the lane, a pending one or one whose owner stopped renewing its lease.
+        # Returns the job, or None and the seconds until the next one is due
+        now = time.time()
+        with self.lock:
+            # one statement, so two processes can not claim the same job
+            claimed = self.conn.execute("UPDATE jobs SET status = 'running', owner = ?, leaseUntil = ? WHERE key = "
+                                        "(SELECT key FROM jobs WHERE lane = ? AND ((status = 'pending' AND nextAttempt <= ?) OR (status = 'running' AND leaseUntil < ?)) ORDER BY created LIMIT 1)",
+                                        (self.owner, now + self.lease, lane, now, now)).rowcount
+            if claimed:
+                row = self.conn.execute("SELECT key, kind, payload, state, attempts FROM jobs WHERE lane = ? AND status = 'running' AND owner = ?", (lane, self.owner)).fetchone()
+                return OutboxJob(row[0], row[1], json.loads(row[2]), json.loads(row[3]), row[4], lane), 0
+            due = self.conn.execute("SELECT MIN(CASE status WHEN 'pending' THEN nextAttempt ELSE leaseUntil END) FROM jobs WHERE lane = ? AND status IN ('pending', 'running')", (lane,)).fetchone()[0]
+        return None, (max(0.0, due - now) if due is not None else None)
+
+    def renew(self):
+        # extends the leases of the jobs this outbox runs until it stops
+        while not self.stopping.wait(self.lease / 3):
+            with self.lock:
+                self.conn.execute("UPDATE jobs SET leaseUntil = ? WHERE owner = ? AND status = 'running'", (time.time() + self.lease, self.owner))
+
+    def start(self):
+        if not self.workers:
+            pending = self.pending()
+            if pending:
+                self.logger.info("resuming %s pending outbox jobs" % pending)
+            self.heartbeat = threading.Thread(target=self.renew, name="Outbox-lease", daemon=True)
+            self.heartbeat.start()
+            for lane in self.lanes:
+                worker = threading.Thread(target=self.run, args=(lane,), name="Outbox" if lane == self.lanes[0] else "Outbox-" + lane, daemon=True)
+                worker.start()
+                self.workers.append(worker)
+
+    def stop(self, timeout=5):
+        self.stopping.set()
+        for wakeup in self.wakeups.values():
+            wakeup.set()
+        deadline = time.monotonic() + timeout
+        for worker in self.workers:
+            worker.join(max(0, deadline - time.monotonic()))
+
+    def run(self, lane):
+        wakeup = self.wakeups[lane]
+        while not self.stopping.is_set():
+            job, wait = self.next(lane)
+            if job is None:
+                wakeup.wait(wait)
+                wakeup.clear()
+                continue
+            self.report(job, "running", None)
+            try:
+                done = self.handler(job)
+            except Exception as e:
+                job.error = str(e)
+                done = False
+            self.finish(job, done)
+
+    def finish(self, job, done):
+        now = time.time()
+        attempts = job.attempts + 1
+        if done:
+            status, nextAttempt = "done", now
+        elif attempts >= self.maxAttempts:
+            status, nextAttempt = "failed", now
+        else:
+            status, nextAttempt = "pending", now + min(self.maxBackoff, self.backoff * 2 ** job.attempts)
+        with self.lock:
+            self.conn.execute("UPDATE jobs SET state = ?, status = ?, attempts = ?, nextAttempt = ?, error = ?, updated = ?, owner = NULL, leaseUntil = NULL WHERE key = ? AND owner = ?",
+                              (json.dumps(job.state), status, attempts, nextAttempt, job.error, now, job.key, self.owner))
+        if status == "done":
+            self.logger.info("%s job %s done after %s attempts" % (job.kind, job.key, attempts))
+        elif status == "failed":
+            self.logger.error("%s job %s failed after %s attempts - %s" % (job.kind, job.key, attempts, job.error))
+        else:
+            self.logger.warning("%s job %s attempt %s failed, retrying in %.0f s - %s" % (job.kind, job.key, attempts, nextAttempt - now, job.error))
+        self.report(job, status, job.error)
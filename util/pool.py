@@ -0,0 +1,169 @@
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from util.logger import Logger
+from util.metrics import Metrics
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class ConnectionPool:
+    # process-wide registry, so every Database pointing at the same server shares one pool.
+    # Connections are probed with healthQuery, or with probe(conn) for connections that are not DB-API ones.
+    _pools = {}
+    _poolsLock = threading.Lock()
+
+    def __init__(self, connect, minSize=1, maxSize=5, idleTimeout=300, healthInterval=30, checkoutTimeout=30, healthQuery="SELECT 1", probe=None):
+        self.logger = Logger.getLogger(type(self).__name__)
+        self.connectFn = connect
+        self.minSize = max(0, minSize)
+        self.maxSize = max(1, maxSize, self.minSize)
+        self.idleTimeout = idleTimeout
+        self.healthInterval = healthInterval
+        self.checkoutTimeout = checkoutTimeout
+        self.healthQuery = healthQuery
+        self.probe = probe
+        # idle connections as [conn, lastUsed], most recently used on the right
+        self.idle = deque()
+        self.size = 0
+        self.cond = threading.Condition()
+        self.created = 0
+        self.discarded = 0
+        self.checkouts = 0
+        self.waits = 0
+
+    @classmethod
+    def shared(cls, key, connect, **kwargs):
+        with cls._poolsLock:
+            pool = cls._pools.get(key)
+            if pool is None:
+                pool = cls(connect, **kwargs)
+                cls._pools[key] = pool
+                Metrics.addSource("pool %s" % "/".join(str(k) for k in key[1:]), pool.stats)
+            return pool
+
+    @classmethod
+    def closeShared(cls):
+        with cls._poolsLock:
+            pools = list(cls._pools.items())
+            cls._pools.clear()
+        for key, pool in pools:
+            Metrics.removeSource("pool %s" % "/".join(str(k) for k in key[1:]))
+            pool.closeAll()
+
+    def acquire(self):
+        deadline = time.monotonic() + self.checkoutTimeout
+        while True:
+            with self.cond:
+                self.evictIdle()
+                if self.idle:
+                    conn, lastUsed = self.idle.pop()
+                elif self.size < self.maxSize:
+                    # reserve the slot before connecting so the handshake runs outside the lock
+                    self.size += 1
+                    conn, lastUsed = None, None
+                else:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise PoolTimeout("no connection available after %s seconds" % self.checkoutTimeout)
+                    self.waits += 1
+                    self.cond.wait(remaining)
+                    continue
+            if conn is None:
+                try:
+                    conn = self.connectFn()
+                except Exception:
+                    with self.cond:
+                        self.size -= 1
+                        self.cond.notify()
+                    raise
+                with self.cond:
+                    self.created += 1
+                    self.checkouts += 1
+                return conn
+            # only probe connections that sat idle for a while, recently used ones are trusted
+            if time.monotonic() - lastUsed < self.healthInterval or self.isHealthy(conn):
+                with self.cond:
+                    self.checkouts += 1
+                return conn
+            self.discard(conn)
+
+    def release(self, conn, broken=False):
+        if broken:
+            self.discard(conn)
+            return
+        with self.cond:
+            self.idle.append([conn, time.monotonic()])
+            self.cond.notify()
+
+    def discard(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+        with self.cond:
+            self.size -= 1
+            self.discarded += 1
+            self.cond.notify()
+
+    def isHealthy(self, conn):
+        try:
+            if self.probe is not None:
+                self.probe(conn)
+                return True
+            cursor = conn.cursor()
+            cursor.execute(self.healthQuery)
+            cursor.fetchone()
+            return True
+        except Exception as e:
+            self.logger.warning("discarding unhealthy connection: %s" % e)
+            return False
+
+    @contextmanager
+    def connection(self):
+        start = time.perf_counter()
+        conn = self.acquire()
+        Metrics.observe("pool_checkout_seconds", "acquire", time.perf_counter() - start)
+        try:
+            yield conn
+        except Exception:
+            # a failed statement does not mean a dead connection, keep it if it can still roll back
+            try:
+                conn.rollback()
+                self.release(conn)
+            except Exception:
+                self.release(conn, broken=True)
+            raise
+        else:
+            self.release(conn)
+
+    def evictIdle(self):
+        # caller must hold self.cond; oldest connections sit on the left
+        now = time.monotonic()
+        while self.idle and self.size > self.minSize and now - self.idle[0][1] > self.idleTimeout:
+            conn, lastUsed = self.idle.popleft()
+            self.size -= 1
+            self.discarded += 1
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+    def closeAll(self):
+        with self.cond:
+            idle = list(self.idle)
+            self.idle.clear()
+            self.size -= len(idle)
+        for conn, lastUsed in idle:
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+    def stats(self):
+        with self.cond:
+            return {"size": self.size, "idle": len(self.idle), "maxSize": self.maxSize, "created": self.created,
+                    "discarded": self.discarded, "checkouts": self.checkouts, "waits": self.waits}
@@ -1,32 +1,54 @@
-from util.database import Database
+import threading
 from util.logger import Logger
+from util.metrics import Metrics, returnedNone
 
 
 class PopUp:
-    def __init__(self, config):
+    # with a publisher, every notification raised or solved is also pushed to the broadcast channel,
+    # so client applications learn about it without polling the Notifications table
+    def __init__(self, db, publisher=None, app=None):
         self.logger = Logger.getLogger(type(self).__name__)
-        self.db = Database(config["database"]["driver"], config["database"]["host"], config["database"]["database"], config["database"]["owner"])
-
-    def getNotifiedUsersString(self, usersIDs):
-        notifiedUsers = ""
-        for i in range(len(usersIDs)):
-            if i == 0:
-                notifiedUsers = str(usersIDs[i])
-            else:
-                notifiedUsers = notifiedUsers + "," + str(usersIDs[i])
-        return notifiedUsers
-
-    def checkActiveNotifications(self):
-        return self.db.getActiveNotifications()
-
-    def checkNotifiedUsers(self):
-        return self.db.getNotifiedUsers()
-
-    def createNotification(self, userGID, userEmail, level, shortText, longText, active, readAccess, writeAccess, usersIDs):
-        user = self.db.getUserCode(userGID, userEmail)
-        notifiedUsers = self.getNotifiedUsersString(usersIDs)
-        return self.db.addNotification(user, level, shortText, longText, active, readAccess, writeAccess, notifiedUsers)
-
-    def desactivateNotifications(self, usersIDs):
-        notifiedUsers = self.getNotifiedUsersString(usersIDs)
-        return self.db.uptNotification(notifiedUsers)
\ No newline at end of file
+        self.db = db
+        self.publisher = publisher
+        self.app = app
+        # user codes of the operators seen in this session, only successful lookups are kept
+        self.userCodes = {}
+        self.lock = threading.Lock()
+
+    def getUserCode(self, userGID, userEmail):
+        with self.lock:
+            code = self.userCodes.get((userGID, userEmail))
+        if code is None:
+            code = self.db.getUserCode(userGID, userEmail)
+            if code is not None:
+                with self.lock:
+                    self.userCodes[(userGID, userEmail)] = code
+        return code
+
+    @Metrics.instrument("popup", failed=returnedNone)
+    def checkStatus(self):
+        return self.db.getNotificationStatus()
+
+    @Metrics.instrument("popup", failed=returnedNone)
+    def checkRecipients(self, notificationID):
+        return self.db.getNotificationRecipients(notificationID)
+
+    @Metrics.instrument("popup", failed=returnedNone)
+    def checkHistory(self, limit, after=None, level=None, text=None):
+        return self.db.getNotificationHistory(limit, after, level, text)
+
+    @Metrics.instrument("popup", failed=returnedNone)
+    def createNotification(self, userGID, userEmail, level, shortText, longText, active, readAccess, writeAccess, usersIDs, notificationID=None):
+        user = self.getUserCode(userGID, userEmail)
+        created = self.db.addNotification(user, level, shortText, longText, active, readAccess, writeAccess, usersIDs, notificationID)
+        if created and self.publisher is not None:
+            self.publisher.publish({"type": "raised", "app": self.app, "notificationID": notificationID, "level": level, "shortText": shortText,
+                                    "readAccess": readAccess, "writeAccess": writeAccess, "recipients": list(usersIDs)})
+        return created
+
+    @Metrics.instrument("popup", failed=returnedNone)
+    def desactivateNotifications(self, usersIDs, notificationID):
+        deactivated = self.db.uptNotification(usersIDs, notificationID)
+        if deactivated and self.publisher is not None:
+            self.publisher.publish({"type": "solved", "app": self.app, "notificationID": notificationID})
+        return deactivated
\ No newline at end of file
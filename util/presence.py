@@ -0,0 +1,50 @@
+import datetime
+from util.logger import Logger
+
+
+class ActiveSessions:
+    # users with a session active within the last window seconds, kept current by only querying
+    # the sessions stamped at or after the newest DateActive seen so far (the watermark)
+    def __init__(self, db, directory, window=360, app=None):
+        self.logger = Logger.getLogger(type(self).__name__)
+        self.db = db
+        self.app = app
+        self.directory = directory
+        self.window = datetime.timedelta(seconds=window)
+        self.lastActive = {}
+        self.watermark = None
+
+    def __len__(self):
+        return len(self.lastActive)
+
+    def records(self):
+        return [entry[0] for entry in self.lastActive.values()]
+
+    def isActive(self, record):
+        return record.guids.get(self.app) in self.lastActive
+
+    def refresh(self):
+        # returns (records that became active, records whose sessions expired), or None if the query failed
+        now = datetime.datetime.utcnow()
+        since = self.watermark if self.watermark is not None else now - self.window
+        rows = self.db.getCurrentActiveUsers(since)
+        if rows is None:
+            return None
+        added = []
+        for gid, name, firstName, email, guid, dateActive in rows:
+            if email is None or guid is None:
+                continue
+            entry = self.lastActive.get(guid)
+            if entry is None:
+                entry = self.lastActive[guid] = [self.directory.add(guid, name, firstName, email, self.app), dateActive]
+                added.append(entry[0])
+            elif dateActive > entry[1]:
+                entry[1] = dateActive
+            if self.watermark is None or dateActive > self.watermark:
+                self.watermark = dateActive
+        # sessions are stamped with the database clock, the newest stamp guards against a local clock running late
+        cutoff = max(now, self.watermark or now) - self.window
+        expired = [guid for guid, entry in self.lastActive.items() if entry[1] < cutoff]
+        expired = [self.lastActive.pop(guid)[0] for guid in expired]
+        self.logger.debug("%s: %s session rows since %s, %s added, %s expired" % (self.app, len(rows), since, len(added), len(expired)))
+        return added, expired
@@ -0,0 +1,48 @@
+import threading
+import time
+from contextlib import contextmanager
+from util.logger import Logger
+
+
+class StartupProfiler:
+    # records named startup phases while enabled, the report is written to the log once
+    enabled = False
+    start = time.perf_counter()
+    phases = []
+    lock = threading.Lock()
+
+    @staticmethod
+    def enable(start=None):
+        StartupProfiler.enabled = True
+        StartupProfiler.start = start or time.perf_counter()
+        StartupProfiler.phases = []
+
+    @staticmethod
+    @contextmanager
+    def phase(name):
+        if not StartupProfiler.enabled:
+            yield
+            return
+        begin = time.perf_counter()
+        try:
+            yield
+        finally:
+            StartupProfiler.record(name, begin, time.perf_counter())
+
+    @staticmethod
+    def record(name, begin, end):
+        if StartupProfiler.enabled:
+            with StartupProfiler.lock:
+                StartupProfiler.phases.append((name, begin, end, threading.current_thread().name))
+
+    @staticmethod
+    def report():
+        if not StartupProfiler.enabled:
+            return
+        StartupProfiler.enabled = False
+        logger = Logger.getLogger(StartupProfiler.__name__)
+        total = (time.perf_counter() - StartupProfiler.start) * 1000
+        lines = ["startup profile, %.0f ms in total:" % total]
+        for name, begin, end, thread in sorted(StartupProfiler.phases, key=lambda p: p[1]):
+            lines.append("  %8.1f ms at +%8.1f ms  %-32s [%s]" % ((end - begin) * 1000, (begin - StartupProfiler.start) * 1000, name, thread))
+        logger.info("\n".join(lines))
@@ -0,0 +1,33 @@
+import threading
+import time
+
+
+class RateLimiter:
+    # token bucket shared by threads: up to burst acquisitions at once, then rate per second.
+    # Every caller reserves its slot under the lock and sleeps outside it, so waiting threads are served in order.
+    # A rate of 0 or None does not limit.
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def over(count, window):
+        # paces count acquisitions evenly over window seconds, the first one right away
+        return RateLimiter(count / window if window and count > 1 else 0)
+
+    def acquire(self):
+        # returns the seconds waited
+        if not self.rate:
+            return 0.0
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+        if wait:
+            time.sleep(wait)
+        return wait
@@ -0,0 +1,70 @@
+import functools
+import html
+import re
+
+# merge fields are written as {{name}} in the subject and the description
+FIELD_PATTERN = re.compile(r"\{\{\s*(\w+)\s*\}\}")
+# fields that differ between recipients, everything else is the same in the whole mail
+RECIPIENT_FIELDS = ("name", "firstName", "email", "application")
+
+
+def toHtml(text):
+    # one paragraph per line of the description, a trailing empty line is dropped
+    lines = text.splitlines()
+    if lines and lines[-1] == "":
+        lines.pop()
+    return "".join("<p>%s</p>" % html.escape(line) for line in lines)
+
+
+def compileText(text):
+    # alternating literal text and field names, literals at the even positions
+    return tuple(FIELD_PATTERN.split(text))
+
+
+class MailTemplate:
+    # subject and description compiled once into literal parts and merge fields.
+    # The description is escaped while it is compiled, field values when they are filled in, so text typed
+    # by the operator or taken from the directory never turns into markup.
+    def __init__(self, subject, description):
+        self.subject = compileText(subject)
+        self.body = compileText(toHtml(description))
+        self.fields = set(self.subject[1::2]) | set(self.body[1::2])
+        self.personal = [f for f in RECIPIENT_FIELDS if f in self.fields]
+        self.tags = [("-%s-" % f, f, True) for f in RECIPIENT_FIELDS if f in self.body[1::2]] + \
+                    [("-%s.subject-" % f, f, False) for f in RECIPIENT_FIELDS if f in self.subject[1::2]]
+
+    @staticmethod
+    @functools.lru_cache(maxsize=32)
+    def get(subject, description):
+        return MailTemplate(subject, description)
+
+    @staticmethod
+    def fill(parts, values, escape, tag=None):
+        # fields without a value are kept as written, fields in the mail's personalizations become SendGrid substitution tags
+        out = [parts[0]]
+        for i in range(1, len(parts), 2):
+            field = parts[i]
+            if tag is not None and field in RECIPIENT_FIELDS:
+                out.append(tag % field)
+            elif field in values:
+                value = "" if values[field] is None else str(values[field])
+                out.append(html.escape(value) if escape else value)
+            else:
+                out.append("{{%s}}" % field)
+            out.append(parts[i + 1])
+        return "".join(out)
+
+    def render(self, values):
+        # (subject, html) with the fields common to all recipients filled in,
+        # the recipient fields are left as substitution tags to be filled per personalization
+        return (self.fill(self.subject, values, False, "-%s.subject-" if self.personal else None),
+                self.fill(self.body, values, True, "-%s-" if self.personal else None))
+
+    def substitutions(self, values):
+        # SendGrid substitutions of one recipient, escaped for the html body and plain for the subject
+        result = {}
+        for tag, field, escape in self.tags:
+            value = values.get(field)
+            value = "" if value is None else str(value)
+            result[tag] = html.escape(value) if escape else value
+        return result
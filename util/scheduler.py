@@ -0,0 +1,164 @@
+import os
+import json
+import heapq
+import sqlite3
+import threading
+import time
+import uuid
+from util.basedir import BaseDir
+from util.logger import Logger
+
+# the timer wakes up at least this often to pick up entries added or cancelled by another process
+RELOAD_INTERVAL = 60
+
+
+class ScheduledEntry:
+    def __init__(self, key, plan, kind, payload, due, expires, window, after, status):
+        self.key = key
+        # entries planned together (reminder, raise and solve of one downtime) share the plan key
+        self.plan = plan
+        self.kind = kind
+        self.payload = payload
+        self.due = due
+        # an entry still due after this time is dropped, e.g. a reminder once the raise time has passed
+        self.expires = expires
+        # seconds the mail batches of the job are spread over
+        self.window = window
+        # key of the entry that has to be fired first, e.g. the raise of a solve; if it never is, this one is skipped
+        self.after = after
+        self.status = status
+
+
+class Scheduler:
+    # timer thread over a heap of due times. The entries are kept in a local SQLite file, so planned
+    # notifications survive a restart; the heap only holds (due, key) and is rebuilt from the file.
+    # A due entry is passed to handler(entry), which hands it to the outbox, and is marked fired afterwards,
+    # or skipped if the handler returns False. settled(key), if given, tells whether the work started by a fired
+    # entry succeeded (True), failed (False) or is still running (None); an entry waits for it to succeed.
+    def __init__(self, handler, path=None, settled=None):
+        self.logger = Logger.getLogger(type(self).__name__)
+        self.handler = handler
+        self.settled = settled
+        self.path = path or os.path.join(BaseDir.get(), 'outbox', 'schedule.db')
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=FULL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, plan TEXT NOT NULL, kind TEXT NOT NULL, payload TEXT NOT NULL, due REAL NOT NULL, expires REAL, window REAL NOT NULL DEFAULT 0, after TEXT, status TEXT NOT NULL, created REAL NOT NULL, updated REAL NOT NULL)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS entries_scheduled ON entries (status, due)")
+        self.heap = []
+        self.queued = set()
+        self.wakeup = threading.Event()
+        self.stopping = threading.Event()
+        self.worker = None
+
+    def add(self, kind, payload, due, plan=None, key=None, expires=None, window=0, after=None):
+        # due and expires as epoch seconds, returns the entry key
+        key = key or str(uuid.uuid4()).upper()
+        now = time.time()
+        with self.lock:
+            self.conn.execute("INSERT OR IGNORE INTO entries (key, plan, kind, payload, due, expires, window, after, status, created, updated) VALUES (?, ?, ?, ?, ?, ?, ?, ?, 'scheduled', ?, ?)",
+                              (key, plan or key, kind, json.dumps(payload), due, expires, window, after, now, now))
+            self.push(due, key)
+        self.logger.info("scheduled %s job %s at %s" % (kind, key, time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(due))))
+        self.wakeup.set()
+        return key
+
+    def push(self, due, key):
+        if key not in self.queued:
+            self.queued.add(key)
+            heapq.heappush(self.heap, (due, key))
+
+    def cancel(self, key):
+        # cancels an entry or every entry of a plan, returns the number cancelled
+        with self.lock:
+            cancelled = self.conn.execute("UPDATE entries SET status = 'cancelled', updated = ? WHERE (key = ? OR plan = ?) AND status = 'scheduled'", (time.time(), key, key)).rowcount
+        if cancelled:
+            self.logger.info("cancelled %s scheduled jobs of %s" % (cancelled, key))
+        return cancelled
+
+    def entries(self, status="scheduled"):
+        # entries of the given status, the next due first
+        with self.lock:
+            rows = self.conn.execute("SELECT key, plan, kind, payload, due, expires, window, after, status FROM entries WHERE status = ? ORDER BY due", (status,)).fetchall()
+        return [ScheduledEntry(r[0], r[1], r[2], json.loads(r[3]), r[4], r[5], r[6], r[7], r[8]) for r in rows]
+
+    def get(self, key):
+        with self.lock:
+            r = self.conn.execute("SELECT key, plan, kind, payload, due, expires, window, after, status FROM entries WHERE key = ?", (key,)).fetchone()
+        return ScheduledEntry(r[0], r[1], r[2], json.loads(r[3]), r[4], r[5], r[6], r[7], r[8]) if r is not None else None
+
+    def reload(self):
+        # adds the scheduled entries not in the heap yet, also those added by another process
+        with self.lock:
+            rows = self.conn.execute("SELECT due, key FROM entries WHERE status = 'scheduled'").fetchall()
+            for due, key in rows:
+                self.push(due, key)
+        return len(rows)
+
+    def start(self):
+        if self.worker is None:
+            scheduled = self.reload()
+            if scheduled:
+                self.logger.info("%s scheduled jobs waiting" % scheduled)
+            self.worker = threading.Thread(target=self.run, name="Scheduler", daemon=True)
+            self.worker.start()
+
+    def stop(self, timeout=5):
+        self.stopping.set()
+        self.wakeup.set()
+        if self.worker is not None:
+            self.worker.join(timeout)
+
+    def run(self):
+        reloaded = time.monotonic()
+        while not self.stopping.is_set():
+            if time.monotonic() - reloaded >= RELOAD_INTERVAL:
+                self.reload()
+                reloaded = time.monotonic()
+            now = time.time()
+            with self.lock:
+                due = self.heap[0][0] if self.heap else None
+                if due is not None and due <= now:
+                    key = heapq.heappop(self.heap)[1]
+                    self.queued.discard(key)
+            if due is None or due > now:
+                # the wait is capped, the wall clock may jump (suspend, clock sync) and other processes may add entries
+                self.wakeup.wait(min(RELOAD_INTERVAL, due - now) if due is not None else RELOAD_INTERVAL)
+                self.wakeup.clear()
+                continue
+            # entries cancelled meanwhile stay in the heap and are skipped here
+            entry = self.get(key)
+            if entry is not None and entry.status == "scheduled":
+                self.fire(entry, now)
+
+    def fire(self, entry, now):
+        before = self.get(entry.after) if entry.after is not None else None
+        if before is not None and before.status == "scheduled":
+            # the entry it depends on could not be started yet, both are tried again on the next reload
+            return
+        settled = self.settled(entry.after) if before is not None and before.status == "fired" and self.settled is not None else True
+        if settled is None:
+            # the work of the entry it depends on is still running, this one is tried again on the next reload
+            return
+        if entry.after is not None and (before is None or before.status != "fired"):
+            self.logger.warning("%s job %s skipped, %s job %s was not sent" % (entry.kind, entry.key, before.kind if before else "the", entry.after))
+            status = "skipped"
+        elif not settled:
+            self.logger.warning("%s job %s skipped, %s job %s failed" % (entry.kind, entry.key, before.kind, entry.after))
+            status = "skipped"
+        elif entry.expires is not None and now > entry.expires:
+            self.logger.warning("%s job %s expired %.0f s ago, not sent" % (entry.kind, entry.key, now - entry.expires))
+            status = "expired"
+        else:
+            try:
+                status = "skipped" if self.handler(entry) is False else "fired"
+            except Exception as e:
+                # the entry stays scheduled and is tried again on the next reload
+                self.logger.error("could not start %s job %s - %s" % (entry.kind, entry.key, e))
+                return
+            if status == "fired":
+                self.logger.info("started %s job %s, %.0f s after it was due" % (entry.kind, entry.key, now - entry.due))
+        with self.lock:
+            self.conn.execute("UPDATE entries SET status = ?, updated = ? WHERE key = ? AND status = 'scheduled'", (status, time.time(), entry.key))
@@ -0,0 +1,107 @@
+import bisect
+import operator
+import threading
+from itertools import compress
+
+
+class SearchIndex:
+    # type-ahead index over name, first name and email of the user records.
+    # Every query term has to be the start of a word, the terms are combined with AND.
+    # The words of all records are kept sorted, so the records of a prefix are one slice found by bisection.
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.ids = {}
+        self.labels = []
+        self.texts = []
+        self.words = []
+        self.numbers = []
+
+    def __len__(self):
+        return len(self.labels)
+
+    @staticmethod
+    def wordsOf(record):
+        # the email as a whole and its local part split at dots, so "anna.meyer@..." is found as "meyer" too
+        email = (record.email or "").lower()
+        local = email.split("@")[0].replace(".", " ").replace("_", " ").replace("-", " ")
+        return list(dict.fromkeys(" ".join(f for f in (record.name, record.firstName) if f).lower().split() + [email] + local.split()))
+
+    def update(self, records):
+        # only records not indexed yet are added, returns their number
+        entries = [(r.label, self.wordsOf(r)) for r in records if r.label not in self.ids]
+        with self.lock:
+            new = []
+            added = 0
+            for label, words in entries:
+                if label in self.ids:
+                    continue
+                number = self.ids[label] = len(self.labels)
+                self.labels.append(label)
+                # leading blank so that a word start is found as " " + term
+                self.texts.append(" " + " ".join(words))
+                new.extend((word, number) for word in words)
+                added += 1
+            if len(new) > len(self.words) // 100:
+                pairs = sorted(list(zip(self.words, self.numbers)) + new)
+                self.words = [word for word, number in pairs]
+                self.numbers = [number for word, number in pairs]
+            else:
+                # a refresh only brings a few users, they are inserted in place
+                for word, number in new:
+                    position = bisect.bisect_right(self.words, word)
+                    self.words.insert(position, word)
+                    self.numbers.insert(position, number)
+        return added
+
+    def range(self, term):
+        return bisect.bisect_left(self.words, term), bisect.bisect_left(self.words, term + "\uffff")
+
+    def search(self, query):
+        # mask over the record numbers, 1 for the records matching every term of the query, None for an empty query.
+        # It has one byte more than there are records, always 0, that stands for the labels not indexed (see numbersOf)
+        terms = list(dict.fromkeys(query.lower().split()))
+        if not terms:
+            return None
+        with self.lock:
+            # candidates come from the term with the fewest words, the others only filter them
+            ranges = sorted((hi - lo, lo, hi, term) for term in terms for lo, hi in [self.range(term)])
+            size, lo, hi, term = ranges[0]
+            mask = bytearray(len(self.labels) + 1)
+            if len(ranges) == 1:
+                for n in self.numbers[lo:hi]:
+                    mask[n] = 1
+            else:
+                needles = [" " + term for *_, term in ranges[1:]]
+                texts = self.texts
+                for n in set(self.numbers[lo:hi]):
+                    if all(needle in texts[n] for needle in needles):
+                        mask[n] = 1
+            return mask
+
+    def numbersOf(self, labels, unknown):
+        # record number of every label, unknown for the ones not indexed or indexed after a mask of unknown records
+        with self.lock:
+            ids = self.ids
+            return [min(ids.get(label, unknown), unknown) for label in labels]
+
+
+class FilteredList:
+    # row numbers of a list of labels that match a search, in list order. The record numbers of the rows are looked up
+    # once while the list and the index stay the same, so a keystroke only tests every row against the mask, without sorting
+    def __init__(self, index):
+        self.index = index
+        self.keys = None
+        self.size = None
+        self.lookup = None
+
+    def invalidate(self):
+        # the rows moved, e.g. some were removed
+        self.keys = None
+
+    def rows(self, items, mask):
+        if self.keys is None or len(self.keys) != len(items) or self.size != len(mask):
+            self.keys = self.index.numbersOf(items, len(mask) - 1)
+            self.size = len(mask)
+            # itemgetter reads the mask bytes of all rows in one call, it needs two keys to return a tuple
+            self.lookup = operator.itemgetter(*self.keys) if len(self.keys) > 1 else lambda mask: [mask[k] for k in self.keys]
+        return list(compress(range(len(items)), self.lookup(mask)))
@@ -0,0 +1,63 @@
+import datetime
+import os
+import sqlite3
+from util.basedir import BaseDir
+from util.logger import Logger
+from util.profiler import StartupProfiler
+
+# bumped whenever the file layout changes, older snapshots are ignored
+SNAPSHOT_VERSION = 2
+
+
+class DirectorySnapshot:
+    # both user lists as written after the last successful load, in a SQLite file replaced atomically on save
+    def __init__(self, source, path=None):
+        self.logger = Logger.getLogger(type(self).__name__)
+        # snapshots of another database are never used
+        self.source = source
+        self.path = path or os.path.join(BaseDir.get(), 'snapshot', 'directory.db')
+
+    def save(self, lists):
+        # lists as {name: [(app, guid, name, firstName, email)]}
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        temp = self.path + ".tmp"
+        if os.path.exists(temp):
+            os.remove(temp)
+        try:
+            conn = sqlite3.connect(temp)
+            try:
+                conn.execute("CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)")
+                conn.execute("CREATE TABLE users (list TEXT, app TEXT, guid TEXT, name TEXT, firstName TEXT, email TEXT)")
+                conn.executemany("INSERT INTO meta VALUES (?, ?)", [("version", str(SNAPSHOT_VERSION)), ("source", self.source),
+                                                                   ("savedAt", datetime.datetime.now().isoformat(sep=" ", timespec="seconds"))])
+                for name, rows in lists.items():
+                    conn.executemany("INSERT INTO users VALUES (?, ?, ?, ?, ?, ?)", ((name,) + tuple(row) for row in rows))
+                conn.commit()
+            finally:
+                conn.close()
+            os.replace(temp, self.path)
+            self.logger.info("saved snapshot of %s users to %s" % (sum(len(rows) for rows in lists.values()), self.path))
+            return True
+        except Exception as e:
+            self.logger.error("could not save snapshot - %s" % e)
+
+    def load(self):
+        # returns ({name: rows}, savedAt), None if there is no usable snapshot
+        if not os.path.exists(self.path):
+            return None
+        try:
+            with StartupProfiler.phase("load snapshot"):
+                conn = sqlite3.connect(self.path)
+                try:
+                    meta = dict(conn.execute("SELECT key, value FROM meta").fetchall())
+                    if meta.get("version") != str(SNAPSHOT_VERSION) or meta.get("source") != self.source:
+                        self.logger.info("ignoring snapshot of version %s for %s" % (meta.get("version"), meta.get("source")))
+                        return None
+                    lists = {}
+                    for row in conn.execute("SELECT list, app, guid, name, firstName, email FROM users ORDER BY rowid"):
+                        lists.setdefault(row[0], []).append(row[1:])
+                finally:
+                    conn.close()
+            return lists, meta.get("savedAt")
+        except Exception as e:
+            self.logger.error("could not load snapshot - %s" % e)
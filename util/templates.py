@@ -0,0 +1,107 @@
+import os
+import re
+import json
+import threading
+from html.parser import HTMLParser
+from util.basedir import BaseDir
+from util.logger import Logger
+from util.profiler import StartupProfiler
+
+MESSAGE_PATTERN = re.compile(r'^message-(.+)\.html$')
+SHORT_PATTERN = re.compile(r'^short-(.+)\.txt$')
+
+
+class Parser(HTMLParser):
+    def __init__(self):
+        super().__init__()
+        self.data = []
+        self.capture = False
+
+    def handle_starttag(self, tag, attrs):
+        if tag in ('p', 'h1'):
+            self.capture = True
+
+    def handle_endtag(self, tag):
+        if tag in ('p', 'h1'):
+            self.capture = False
+
+    def handle_data(self, data):
+        if self.capture:
+            self.data.append(data)
+
+
+def parseMessage(text):
+    parser = Parser()
+    parser.feed(text)
+    return parser.data
+
+
+def parseShort(text):
+    return text.splitlines()[0] if text else ""
+
+
+class TemplateRegistry:
+    # standard texts are discovered from html/message-<category>.html and txt/short-<category>.txt,
+    # parsed on first use and reloaded only when the file modification time changes
+    _shared = None
+    _sharedLock = threading.Lock()
+
+    def __init__(self, baseDir=None):
+        self.logger = Logger.getLogger(type(self).__name__)
+        baseDir = baseDir or BaseDir.get()
+        self.htmlDir = os.path.join(baseDir, 'html')
+        self.txtDir = os.path.join(baseDir, 'txt')
+        self.lock = threading.Lock()
+        self.cache = {}
+
+    @classmethod
+    def shared(cls):
+        with cls._sharedLock:
+            if cls._shared is None:
+                cls._shared = cls()
+            return cls._shared
+
+    def load(self, path, parse):
+        mtime = os.stat(path).st_mtime_ns
+        with self.lock:
+            entry = self.cache.get(path)
+            if entry is not None and entry[0] == mtime:
+                return entry[1]
+        with StartupProfiler.phase("parse %s" % os.path.basename(path)):
+            with open(path, 'r') as f:
+                value = parse(f.read())
+        self.logger.debug("loaded template %s" % path)
+        with self.lock:
+            self.cache[path] = (mtime, value)
+        return value
+
+    def listDir(self, directory, pattern):
+        # directory listings are cached on the directory mtime as well
+        mtime = os.stat(directory).st_mtime_ns
+        key = (directory, pattern.pattern)
+        with self.lock:
+            entry = self.cache.get(key)
+            if entry is not None and entry[0] == mtime:
+                return entry[1]
+        found = {}
+        for name in sorted(os.listdir(directory)):
+            match = pattern.match(name)
+            if match:
+                found[match.group(1).lower()] = os.path.join(directory, name)
+        with self.lock:
+            self.cache[key] = (mtime, found)
+        return found
+
+    def categories(self):
+        return list(self.listDir(self.htmlDir, MESSAGE_PATTERN))
+
+    def getMessage(self, category):
+        path = self.listDir(self.htmlDir, MESSAGE_PATTERN).get(category.lower())
+        return self.load(path, parseMessage) if path else []
+
+    def getShort(self, category):
+        path = self.listDir(self.txtDir, SHORT_PATTERN).get(category.lower())
+        return self.load(path, parseShort) if path else ""
+
+    def getJson(self, path):
+        return self.load(path, json.loads)
@@ -0,0 +1,168 @@
+import os
+import smtplib
+import ssl
+import threading
+from email import policy
+from email.message import EmailMessage
+from util.logger import Logger
+from util.pool import ConnectionPool
+from util.profiler import StartupProfiler
+
+
+class TransportError(Exception):
+    # status is the HTTP or SMTP reply code if the server answered, retryable marks failures worth another attempt
+    def __init__(self, message, status=None, retryable=False):
+        super().__init__(message)
+        self.status_code = status
+        self.retryable = retryable
+
+
+class SendGridTransport:
+    # posts the batch payload to the SendGrid v3 mail send API
+    name = "sendgrid"
+
+    def __init__(self, config):
+        self.apiHost = config["email"].get("apiHost", "https://api.sendgrid.com")
+        self.lock = threading.Lock()
+        self.client = None
+
+    def getClient(self):
+        with self.lock:
+            if self.client is None:
+                # sendgrid is only imported once the first mail is sent
+                with StartupProfiler.phase("import sendgrid"):
+                    import sendgrid
+                    import urllib3
+                # disable certificate warnings
+                urllib3.disable_warnings()
+                self.client = sendgrid.SendGridAPIClient(os.environ.get('SENDGRID_API_KEY'), host=self.apiHost)
+            return self.client
+
+    def send(self, data):
+        # returns the status code, errors of the API client carry theirs as status_code
+        return self.getClient().client.mail.send.post(request_body=data).status_code
+
+    def close(self):
+        pass
+
+
+class SmtpTransport:
+    # sends the same batch payload over SMTP. Authenticated connections are kept in a pool and reused for
+    # many messages; with PIPELINING the envelope of a batch (MAIL FROM and all RCPT TO) is written at once.
+    name = "smtp"
+
+    def __init__(self, config):
+        self.logger = Logger.getLogger(type(self).__name__)
+        smtpConfig = config["email"].get("smtp", {})
+        self.host = smtpConfig.get("host", "localhost")
+        self.useSsl = smtpConfig.get("ssl", False)
+        self.port = smtpConfig.get("port", 465 if self.useSsl else 587)
+        self.starttls = smtpConfig.get("starttls", not self.useSsl)
+        self.username = smtpConfig.get("username")
+        self.password = os.environ.get("SMTP_PASSWORD", smtpConfig.get("password"))
+        self.timeout = smtpConfig.get("timeout", 30)
+        self.pool = ConnectionPool.shared(("smtp", self.host, self.port), self.connect, minSize=0, maxSize=smtpConfig.get("poolSize", 4),
+                                          idleTimeout=smtpConfig.get("idleTimeout", 60), healthInterval=smtpConfig.get("healthInterval", 10),
+                                          probe=self.probe)
+
+    def connect(self):
+        if self.useSsl:
+            conn = smtplib.SMTP_SSL(self.host, self.port, timeout=self.timeout, context=ssl.create_default_context())
+        else:
+            conn = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        try:
+            conn.ehlo()
+            if self.starttls:
+                conn.starttls(context=ssl.create_default_context())
+                conn.ehlo()
+            if self.username:
+                conn.login(self.username, self.password or "")
+        except Exception:
+            conn.close()
+            raise
+        self.logger.debug("connected to %s:%s" % (self.host, self.port))
+        return conn
+
+    @staticmethod
+    def probe(conn):
+        code, message = conn.noop()
+        if code != 250:
+            raise smtplib.SMTPResponseException(code, message)
+
+    @staticmethod
+    def messages(data):
+        # one message per personalization, the substitutions applied locally as SendGrid would
+        sender = data["from"]["email"]
+        content = data["content"][0]
+        for personalization in data["personalizations"]:
+            to = [a["email"] for a in personalization.get("to", [])]
+            bcc = [a["email"] for a in personalization.get("bcc", [])]
+            subject, body = data["subject"], content["value"]
+            for tag, value in personalization.get("substitutions", {}).items():
+                subject = subject.replace(tag, value)
+                body = body.replace(tag, value)
+            message = EmailMessage()
+            message["Subject"] = subject
+            message["From"] = sender
+            message["To"] = ", ".join(to)
+            message.set_content(body, subtype="html" if content["type"] == "text/html" else "plain")
+            # the SMTP policy ends lines with CRLF, strict servers reject bare LF in DATA
+            yield sender, to + bcc, message.as_bytes(policy=policy.SMTP)
+
+    @staticmethod
+    def transaction(conn, sender, recipients, message):
+        # returns the refused recipients, raises if the server refused the whole message
+        if not conn.has_extn("pipelining"):
+            return conn.sendmail(sender, recipients, message)
+        conn.send("".join(["MAIL FROM:<%s>\r\n" % sender] + ["RCPT TO:<%s>\r\n" % r for r in recipients]))
+        code, reply = conn.getreply()
+        replies = [conn.getreply() for r in recipients]
+        if code != 250:
+            conn.rset()
+            raise smtplib.SMTPSenderRefused(code, reply, sender)
+        refused = {r: reply for r, reply in zip(recipients, replies) if reply[0] not in (250, 251)}
+        if len(refused) == len(recipients):
+            conn.rset()
+            raise smtplib.SMTPRecipientsRefused(refused)
+        code, reply = conn.data(message)
+        if code != 250:
+            conn.rset()
+            raise smtplib.SMTPDataError(code, reply)
+        return refused
+
+    def send(self, data):
+        # all messages of the batch go over one pooled connection, a broken connection is replaced on the next attempt
+        conn = self.pool.acquire()
+        refused = {}
+        try:
+            for sender, recipients, message in self.messages(data):
+                refused.update(self.transaction(conn, sender, recipients, message))
+        except smtplib.SMTPRecipientsRefused as e:
+            self.pool.release(conn)
+            raise TransportError("all recipients refused: %s" % e.recipients, 550)
+        except smtplib.SMTPResponseException as e:
+            # 4xx replies are temporary, 421 also means the server is closing the connection
+            self.pool.release(conn, broken=e.smtp_code == 421)
+            raise TransportError("%s %s" % (e.smtp_code, e.smtp_error), e.smtp_code, 400 <= e.smtp_code < 500)
+        except (smtplib.SMTPException, OSError) as e:
+            self.pool.release(conn, broken=True)
+            raise TransportError(str(e), None, True)
+        self.pool.release(conn)
+        if refused:
+            self.logger.warning("%s recipients refused: %s" % (len(refused), ", ".join(sorted(refused))))
+        return 250
+
+    def close(self):
+        self.pool.closeAll()
+
+
+class Transport:
+    # transports by the name used in the email.transport and email.fallback settings
+    registry = {"sendgrid": SendGridTransport, "smtp": SmtpTransport}
+
+    @staticmethod
+    def fromConfig(config):
+        # the primary transport followed by the fallbacks, in the order they are tried
+        emailConfig = config["email"]
+        names = [emailConfig.get("transport", "sendgrid")] + list(emailConfig.get("fallback", []))
+        return [Transport.registry[name](config) for name in dict.fromkeys(names)]
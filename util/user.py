@@ -1,9 +1,18 @@
 import os
 import subprocess
+import threading
 
 class User:
+    # the operator does not change during a session, whoami is only asked once
+    cached = None
+    lock = threading.Lock()
+
+    @staticmethod
     def get():
-        userGUID = os.getlogin()
-        userEmail = subprocess.check_output("whoami /upn", shell=True)
-        userEmail = userEmail.strip().decode("utf-8")
-        return userGUID, userEmail
\ No newline at end of file
+        with User.lock:
+            if User.cached is None:
+                userGUID = os.getlogin()
+                userEmail = subprocess.check_output("whoami /upn", shell=True)
+                userEmail = userEmail.strip().decode("utf-8")
+                User.cached = (userGUID, userEmail)
+            return User.cached